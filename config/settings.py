@@ -28,26 +28,115 @@ DATA_DIR = BASE_DIR / "data"
 DATA_CLEAN_DIR = BASE_DIR / "data_clean"
 CHUNKS_DIR = BASE_DIR / "chunks"
 EMBEDDINGS_DIR = BASE_DIR / "embeddings"
+EMBEDDING_CACHE_DIR = BASE_DIR / "cache" / "embeddings"
+INDEX_VERSIONS_DIR = EMBEDDINGS_DIR / "versiones"   # Índices construidos en segundo plano
+INDEX_VERSIONS_TO_KEEP = 2                          # Versiones conservadas en disco
 
 # --- Configuración de Modelos y APIs ---
 # Modelo de embeddings de Hugging Face (multilingüe y ligero)
 EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_BATCH_SIZE = 64             # Tamaño de lote al codificar chunks
+EMBEDDING_CACHE_MAX_ENTRIES = None    # Límite de la caché de embeddings (None = sin límite)
 
 # Configuración de la API de Google Gemini
 # Leemos la variable de entorno por su NOMBRE
 GOOGLE_API_KEY = api_key_value
 LLM_MODEL_NAME = "models/gemini-2.5-flash-lite" # o "gemini-1.5-pro" para más calidad
 
+# Backend del LLM: "gemini" o "fake" (LLM local simulado para pruebas de carga y benchmarks)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+FAKE_LLM_FIRST_TOKEN_MS = float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "300"))      # Latencia hasta el primer token
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "100"))
+FAKE_LLM_RESPONSE_TOKENS = int(os.getenv("FAKE_LLM_RESPONSE_TOKENS", "80"))      # Longitud de cada respuesta
+
+# --- Configuración de la extracción de PDFs ---
+PDF_WORKERS = os.cpu_count() or 1   # Procesos en paralelo para extraer texto
+PDF_PAGES_PER_TASK = 50            # Páginas por tarea (los PDFs grandes se reparten en tramos)
+
 # --- Configuración de Chunking ---
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 
+# --- Modo de ingesta ---
+# "etapas": PDF -> data_clean/ -> chunks/ -> embeddings/ (incremental, por etapas)
+# "streaming": las páginas fluyen por limpieza, troceado y codificación por lotes,
+#              con memoria acotada por el tamaño de lote y no por el del corpus
+INGESTION_MODE = os.getenv("INGESTION_MODE", "etapas")
+STREAMING_BATCH_SIZE = 256                  # Chunks por lote en modo streaming
+STREAMING_SPLIT_WINDOW = 20 * CHUNK_SIZE    # Caracteres acumulados antes de trocear
+STREAMING_BM25_MAX_POSTINGS = 2_000_000     # Apariciones BM25 en memoria antes de volcarlas a disco
+
+# --- Historial de conversaciones ---
+HISTORIAL_PAGE_SIZE = 20    # Turnos por página de /api/historial (los más recientes primero)
+HISTORIAL_PAGE_MAX = 100    # Tamaño máximo de página que acepta /api/historial
+
+# --- Escritura diferida (write-behind) de historiales y logs ---
+# Las escrituras se encolan y un hilo de fondo las vuelca por lotes (WRITE_BEHIND=0 escribe en el acto)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "1") == "1"
+WRITE_BEHIND_MAX_BATCH = 512          # Registros máximos por lote
+WRITE_BEHIND_MAX_QUEUE = 10000        # Registros pendientes antes de frenar a los productores
+WRITE_BEHIND_FSYNC_INTERVAL_S = 1.0   # Cada cuánto se sincronizan con disco los ficheros escritos
+WRITE_BEHIND_MAX_RETRIES = 5         # Reintentos de un lote cuyo destino falla antes de descartarlo
+
+# --- Rotación del log de interacciones ---
+# logs/interactions.jsonl se comprime en un segmento indexado de logs/segments/
+# al superar este tamaño o esta antigüedad (la de su primer registro)
+LOG_ROTATE_MAX_MB = 64
+LOG_ROTATE_MAX_HOURS = 24
+LOG_SEGMENT_BLOCK_RECORDS = 1000   # Registros por bloque gzip (unidad mínima de lectura)
+
+# --- Concurrencia del servidor ---
+ENCODE_WORKERS = 2          # Hilos dedicados a codificar preguntas y buscar en el índice
+LLM_MAX_CONCURRENCY = 16    # Llamadas simultáneas máximas al LLM
+QUERY_BATCH_MAX_QUESTIONS = 256  # Preguntas máximas por petición a /api/query/batch
+
+# Micro-batching: las preguntas concurrentes que llegan en la misma ventana se
+# codifican y se buscan juntas (MICRO_BATCH_MAX_SIZE = 1 lo desactiva)
+MICRO_BATCH_MAX_SIZE = 32
+MICRO_BATCH_MAX_WAIT_MS = 3.0
+
 # --- Configuración de Búsqueda (RAG) ---
 TOP_K_CHUNKS = 4 # Número de fragmentos más relevantes a recuperar
 
+# Top-k adaptativo: en lugar de TOP_K_CHUNKS fijos, se conservan entre TOP_K_MIN y
+# TOP_K_MAX chunks, cortando cuando el score cae por debajo de TOP_K_RELATIVE_THRESHOLD
+# veces el mejor o baja más de TOP_K_MAX_GAP respecto al anterior
+ADAPTIVE_TOP_K = os.getenv("ADAPTIVE_TOP_K", "1") == "1"
+TOP_K_MIN = 2
+TOP_K_MAX = 8
+TOP_K_RELATIVE_THRESHOLD = 0.85
+TOP_K_MAX_GAP = 0.08
+CONTEXT_TOKEN_BUDGET = 1500  # Tokens máximos (estimados) del contexto enviado al LLM
+
+# Backend de búsqueda vectorial: "exact" (recorrido completo), "ivf" (aproximado) o
+# "int8" / "float16" (recorrido de la matriz cuantizada + reordenación exacta en float32)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "exact")
+IVF_NLIST = None        # Nº de clústeres IVF (None = raíz cuadrada del nº de chunks)
+IVF_NPROBE = 8          # Clústeres sondeados por consulta (más = más recall, más latencia)
+IVF_MIN_CHUNKS = 1000   # Por debajo de este tamaño no compensa construir el índice IVF
+QUANTIZED_RESCORE = 10  # Candidatos por resultado (k * QUANTIZED_RESCORE) que se reordenan en float32
+
+# Búsqueda híbrida: los candidatos vectoriales se fusionan (RRF) con los de un índice
+# léxico BM25, que recupera términos exactos (artículos, órdenes, códigos de formulario)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = 20  # Candidatos de cada búsqueda que entran en la fusión
+RRF_K = 60              # Constante de Reciprocal Rank Fusion
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Caché semántica de respuestas: preguntas casi idénticas que recuperan los mismos
+# chunks reutilizan la respuesta del LLM
+ANSWER_CACHE_MAX_ENTRIES = 1000           # 0 desactiva la caché
+ANSWER_CACHE_TTL_SECONDS = 24 * 3600      # Caducidad de cada respuesta (None = sin caducidad)
+ANSWER_CACHE_SIMILARITY = 0.95            # Similitud del coseno mínima entre preguntas
+
+# Caché LRU de embeddings de preguntas (evita recodificar preguntas repetidas)
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = 4096  # 0 desactiva la caché
+QUERY_EMBEDDING_CACHE_MAX_MB = 16         # Memoria máxima por worker
+
 # --- Creación de Directorios ---
 # Asegurarse de que los directorios existan antes de empezar
-for dir_path in [DATA_DIR, DATA_CLEAN_DIR, CHUNKS_DIR, EMBEDDINGS_DIR]:
+for dir_path in [DATA_DIR, DATA_CLEAN_DIR, CHUNKS_DIR, EMBEDDINGS_DIR, EMBEDDING_CACHE_DIR, INDEX_VERSIONS_DIR]:
     dir_path.mkdir(parents=True, exist_ok=True)
 
 print("✅ Configuración cargada y directorios verificados.")
\ No newline at end of file
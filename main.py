@@ -1,35 +1,27 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from typing import List, Optional
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import json
-import os
 import time
 
 # Servicios propios
-from services.perfil_service import agregar_conversacion
-from services.process_pdfs import run_pdf_processing
-from services.chunking import run_chunking
-from services.embeddings import run_embedding_generation
+from services.perfil_service import agregar_conversacion, leer_pagina
+from services.reindex_jobs import ReindexJobManager
 from services.rag_service import RAGService
 from services.agent_service import SimpleAgent
 from services.logger_service import log_interaction, log_error
+from services import write_behind
+from config.settings import QUERY_BATCH_MAX_QUESTIONS, HISTORIAL_PAGE_SIZE, HISTORIAL_PAGE_MAX
 
-def cargar_historial(usuario_id: str):
-    ruta = f"data/perfiles/{usuario_id}.json"
-
-    if not os.path.exists(ruta):
-        return {"conversaciones": []}
-
+def cargar_historial(usuario_id: str, limite: int, antes: Optional[int] = None):
     try:
-        with open(ruta, "r", encoding="utf-8") as f:
-            data = f.read().strip()
-            if not data:
-                return {"conversaciones": []}
-            return json.loads(data)
-    except:
-        return {"conversaciones": []}
+        cabecera, turnos, total, siguiente = leer_pagina(usuario_id, limite, antes)
+    except Exception:
+        return {"conversaciones": [], "total": 0, "siguiente": None}
+    return {**cabecera, "conversaciones": turnos, "total": total, "siguiente": siguiente}
 
 # --- Modelos de Pydantic para la API ---
 class QueryRequest(BaseModel):
@@ -44,11 +36,34 @@ class Source(BaseModel):
 class QueryResponse(BaseModel):
     respuesta: str
     fuentes: List[Source]
+    metadata: Optional[dict] = None  # k elegido y scores de los chunks usados
+
+
+class BatchQueryRequest(BaseModel):
+    preguntas: List[str]
+    usuario_id: str = "evaluacion"
+
+
+class BatchQueryItem(BaseModel):
+    pregunta: str
+    respuesta: Optional[str] = None
+    fuentes: List[Source] = []
+    metadata: Optional[dict] = None
+    error: Optional[str] = None
+
+
+class BatchQueryResponse(BaseModel):
+    resultados: List[BatchQueryItem]
 
 
 class HealthResponse(BaseModel):
     status: str
     vector_store: str
+    cache_respuestas: Optional[dict] = None
+    cache_preguntas: Optional[dict] = None
+    micro_batching: Optional[dict] = None
+    escritura_diferida: Optional[dict] = None
+    llm: Optional[str] = None
 
 
 class AgentRequest(BaseModel):
@@ -74,6 +89,12 @@ def get_rag_service() -> RAGService:
     return rag_service_instance
 
 
+@app.on_event("shutdown")
+def vaciar_escrituras_pendientes():
+    """Vuelca a disco los turnos y logs que siguen en la cola de escritura diferida."""
+    write_behind.cerrar()
+
+
 # --- Archivos estáticos ---
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -87,32 +108,52 @@ async def read_index():
 async def health_check():
     service = get_rag_service()
     vector_store_status = "connected" if service.embeddings is not None else "disconnected"
-    return {"status": "ok", "vector_store": vector_store_status}
+    return {"status": "ok", "vector_store": vector_store_status,
+            "cache_respuestas": service.answer_cache.stats(),
+            "cache_preguntas": service.query_cache.stats(),
+            "micro_batching": service.retrieval_batcher.stats() if service.retrieval_batcher else None,
+            "escritura_diferida": write_behind.get_writer().stats() if write_behind.WRITE_BEHIND else None,
+            "llm": f"{service.llm.name}:{service.llm.model_name}" if service.llm else None}
+
 
+def _on_index_published(version: str) -> None:
+    """Intercambia el índice del servicio ya cargado, conservando el modelo."""
+    if rag_service_instance is not None:
+        rag_service_instance.reload_index()
 
-@app.post("/api/reindex")
+
+reindex_jobs = ReindexJobManager(on_published=_on_index_published)
+
+
+@app.post("/api/reindex", status_code=202)
 async def reindex_data():
-    """Reconstruye embeddings, chunks e índice."""
-    global rag_service_instance
-    try:
-        run_pdf_processing()
-        run_chunking()
-        run_embedding_generation()
+    """Lanza la reconstrucción del índice en segundo plano.
 
-        # Reiniciar el servicio tras regenerar índice
-        rag_service_instance = RAGService()
+    Las consultas siguen atendiéndose con el índice actual; al terminar, la
+    nueva versión se publica y se intercambia de forma atómica.
+    Devuelve el trabajo, cuyo progreso se consulta en /api/reindex/{job_id}.
+    """
+    return reindex_jobs.start()
 
-        return {"message": "Índice reconstruido exitosamente."}
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error durante la reindexación: {str(e)}")
+
+@app.get("/api/reindex/{job_id}")
+async def reindex_status(job_id: str):
+    """Estado y progreso de un trabajo de reindexación."""
+    job = reindex_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo de reindexación no encontrado.")
+    return job
 
 
 @app.post("/api/query", response_model=QueryResponse)
-async def query_rag(request: QueryRequest):
+async def query_rag(request: QueryRequest, background_tasks: BackgroundTasks):
     """
     Endpoint principal: consulta el sistema RAG con la pregunta del usuario.
     Aquí también se guardan las conversaciones en JSON y se registra en logs.
+
+    Ni la consulta ni la persistencia bloquean el event loop: el embedding va a
+    un pool de hilos, Gemini se llama con su cliente asíncrono y las escrituras
+    en disco se hacen en segundo plano tras enviar la respuesta.
     """
     inicio = time.time()
     service = get_rag_service()
@@ -123,7 +164,7 @@ async def query_rag(request: QueryRequest):
                             detail="El índice no está disponible. Ejecuta /api/reindex primero.")
 
     # --- Procesar la pregunta con el modelo ---
-    result = service.query(request.pregunta)
+    result = await service.aquery(request.pregunta)
 
     if "error" in result:
         log_error("/api/query", request.usuario_id, result["error"], "QueryError")
@@ -133,43 +174,146 @@ async def query_rag(request: QueryRequest):
     usuario_id = request.usuario_id
     latencia_ms = (time.time() - inicio) * 1000
 
-    # --- Guardar conversación en JSON ---
-    agregar_conversacion(usuario_id, request.pregunta, respuesta)
+    # --- Guardar conversación en JSON (en segundo plano) ---
+    background_tasks.add_task(agregar_conversacion, usuario_id, request.pregunta, respuesta)
 
-    # --- Registrar en logs ---
-    log_interaction(
+    # --- Registrar en logs (en segundo plano) ---
+    background_tasks.add_task(
+        log_interaction,
         endpoint="/api/query",
         usuario_id=usuario_id,
         entrada=request.pregunta,
         salida=respuesta,
         latencia_ms=latencia_ms,
         fuentes=result.get("fuentes", []),
-        metadata={"model": "gemini-2.5-flash-lite"}
+        metadata={"model": service.llm.model_name, "desde_cache": result.get("desde_cache", False),
+                  "k": result["metadata"]["k"]}
     )
 
     # --- Crear objetos Pydantic para la respuesta ---
     fuentes_formateadas = [Source(documento=doc) for doc in result["fuentes"]]
 
-    return QueryResponse(respuesta=respuesta, fuentes=fuentes_formateadas)
+    return QueryResponse(respuesta=respuesta, fuentes=fuentes_formateadas, metadata=result.get("metadata"))
+
+@app.post("/api/query/stream")
+async def query_rag_stream(request: QueryRequest):
+    """
+    Igual que /api/query, pero la respuesta se envía como server-sent events:
+    primero las fuentes (`event: fuentes`), después los fragmentos de texto según
+    los genera Gemini (`event: token`) y por último `event: fin`.
+    """
+    inicio = time.time()
+    service = get_rag_service()
+
+    if service.embeddings is None:
+        log_error("/api/query/stream", request.usuario_id, "Índice no disponible", "IndexError")
+        raise HTTPException(status_code=503,
+                            detail="El índice no está disponible. Ejecuta /api/reindex primero.")
+
+    async def event_stream():
+        primer_token_ms = None
+        async for event in service.astream(request.pregunta):
+            if event["evento"] == "token" and primer_token_ms is None:
+                primer_token_ms = (time.time() - inicio) * 1000
+            yield f"event: {event['evento']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+            if event["evento"] == "error":
+                log_error("/api/query/stream", request.usuario_id, event["error"], "QueryError")
+            elif event["evento"] == "fin":
+                # El cliente ya tiene la respuesta completa: persistir sin bloquear el event loop
+                latencia_ms = (time.time() - inicio) * 1000
+                await asyncio.to_thread(agregar_conversacion, request.usuario_id, request.pregunta, event["respuesta"])
+                await asyncio.to_thread(
+                    log_interaction,
+                    endpoint="/api/query/stream",
+                    usuario_id=request.usuario_id,
+                    entrada=request.pregunta,
+                    salida=event["respuesta"],
+                    latencia_ms=latencia_ms,
+                    fuentes=event["fuentes"],
+                    metadata={"model": service.llm.model_name,
+                              "primer_token_ms": round(primer_token_ms or latencia_ms, 2),
+                              "desde_cache": event.get("desde_cache", False),
+                              "k": event["metadata"]["k"]}
+                )
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/query/batch", response_model=BatchQueryResponse)
+async def query_rag_batch(request: BatchQueryRequest, background_tasks: BackgroundTasks):
+    """
+    Consulta RAG de muchas preguntas en una sola petición (evaluaciones nocturnas,
+    precalentamiento de cachés). Todas las preguntas se codifican y se buscan de
+    una vez; las llamadas al LLM se hacen en paralelo con concurrencia acotada.
+
+    No se guardan en el historial del usuario; sí se registran en los logs.
+    """
+    service = get_rag_service()
+
+    if len(request.preguntas) > QUERY_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413,
+                            detail=f"Máximo {QUERY_BATCH_MAX_QUESTIONS} preguntas por petición.")
+    if service.embeddings is None:
+        log_error("/api/query/batch", request.usuario_id, "Índice no disponible", "IndexError")
+        raise HTTPException(status_code=503,
+                            detail="El índice no está disponible. Ejecuta /api/reindex primero.")
+
+    results = await service.aquery_many(request.preguntas)
+
+    resultados = []
+    for pregunta, result in zip(request.preguntas, results):
+        if "error" in result:
+            background_tasks.add_task(log_error, "/api/query/batch", request.usuario_id, result["error"], "QueryError")
+            resultados.append(BatchQueryItem(pregunta=pregunta, error=result["error"]))
+            continue
+
+        background_tasks.add_task(
+            log_interaction,
+            endpoint="/api/query/batch",
+            usuario_id=request.usuario_id,
+            entrada=pregunta,
+            salida=result["respuesta"],
+            latencia_ms=result["latencia_ms"],
+            fuentes=result["fuentes"],
+            metadata={"model": service.llm.model_name, "desde_cache": result.get("desde_cache", False),
+                      "k": result["metadata"]["k"], "lote": len(request.preguntas)}
+        )
+        resultados.append(BatchQueryItem(
+            pregunta=pregunta,
+            respuesta=result["respuesta"],
+            fuentes=[Source(documento=doc) for doc in result["fuentes"]],
+            metadata=result["metadata"],
+        ))
+
+    return BatchQueryResponse(resultados=resultados)
 
 @app.get("/api/historial")
-async def obtener_historial(usuario_id: str = "usuario_juan"):
+async def obtener_historial(usuario_id: str = "usuario_juan", limit: int = HISTORIAL_PAGE_SIZE,
+                            before: Optional[int] = None):
     """
-    Devuelve el historial guardado del usuario.
+    Devuelve el historial guardado del usuario por páginas, empezando por lo más reciente.
     Se llama desde el frontend cuando recarga la página.
+
+    - limit: turnos por página (máximo HISTORIAL_PAGE_MAX).
+    - before: cursor; se devuelven los turnos anteriores a esa posición. La respuesta
+      trae en "siguiente" el cursor de la página anterior (null si ya no hay más).
     """
-    perfil = cargar_historial(usuario_id)
-    return perfil
+    limit = max(1, min(limit, HISTORIAL_PAGE_MAX))
+    return await asyncio.to_thread(cargar_historial, usuario_id, limit, before)
 
 
 @app.post("/api/agent")
-async def run_agent(request: AgentRequest):
+async def run_agent(request: AgentRequest, background_tasks: BackgroundTasks):
     """Ejecuta el agente simple: puede responder o crear una 'solicitud' en disco."""
     inicio = time.time()
     try:
         service = get_rag_service()
         agent = SimpleAgent(rag_service=service)
-        result = agent.perform_task(request.instruccion, request.usuario_id)
+        result = await agent.aperform_task(request.instruccion, request.usuario_id)
 
         if result.get("status") == "error":
             latencia_ms = (time.time() - inicio) * 1000
@@ -179,8 +323,9 @@ async def run_agent(request: AgentRequest):
         latencia_ms = (time.time() - inicio) * 1000
         accion = result.get("action", "unknown")
 
-        # --- Registrar en logs ---
-        log_interaction(
+        # --- Registrar en logs (en segundo plano) ---
+        background_tasks.add_task(
+            log_interaction,
             endpoint="/api/agent",
             usuario_id=request.usuario_id,
             entrada=request.instruccion,
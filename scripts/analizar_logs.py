@@ -1,166 +1,392 @@
 """
 Script para analizar y visualizar estadísticas de las interacciones del chatbot.
-Lee logs/interactions.jsonl y muestra métricas, tendencias y reportes.
+Lee los logs de interacciones (segmentos rotados de logs/segments/ y
+logs/interactions.jsonl) y muestra métricas, tendencias y reportes.
 
-Ejecutar: python scripts/analizar_logs.py
+El análisis es incremental: los resúmenes (contadores por endpoint, usuario,
+fuente y acción, e histogramas de latencia para p50/p95/p99) se guardan en
+logs/analisis_estado.json junto con lo ya procesado (segmentos y offset del log
+activo), y cada ejecución sólo lee los registros nuevos.
+
+Ejecutar: python scripts/analizar_logs.py [--reiniciar]
+          python scripts/analizar_logs.py --desde 2025-12-01 [--hasta 2025-12-08]
 """
 
+import argparse
+import csv
 import json
+import math
+import os
+import sys
 from pathlib import Path
-from datetime import datetime
-from collections import defaultdict, Counter
-import statistics
+from collections import Counter
 
-# Ruta del log
-LOGS_DIR = Path(__file__).resolve().parent.parent / "logs"
-INTERACTIONS_LOG = LOGS_DIR / "interactions.jsonl"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
+from services.logger_service import LOGS_DIR, INTERACTIONS_LOG, SEGMENTS_DIR, iter_interactions, list_interaction_segments
+from services.log_segments import iter_segment
 
-def cargar_interacciones():
-    """Carga todos los registros del archivo de interacciones."""
-    registros = []
-    if not INTERACTIONS_LOG.exists():
-        print(f"❌ Archivo no encontrado: {INTERACTIONS_LOG}")
-        return registros
-    
+ESTADO_PATH = LOGS_DIR / "analisis_estado.json"
+CSV_PATH = LOGS_DIR / "interacciones_reporte.csv"
+CSV_CAMPOS = ['timestamp', 'endpoint', 'usuario_id', 'latencia_ms', 'accion_agente']
+ULTIMAS = 3
+VERSION_ESTADO = 1
+
+
+class HistogramaLatencias:
+    """Histograma log-lineal de latencias (estilo HDR), combinable y serializable.
+
+    Cada cubeta cubre un intervalo de anchura relativa `precision`, así que los
+    percentiles tienen un error relativo acotado por ella con memoria constante.
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.cubetas = Counter()
+        self.n = 0
+        self.suma = 0.0
+        self.minimo = None
+        self.maximo = None
+
+    def add(self, valor: float) -> None:
+        valor = max(float(valor), 0.0)
+        self.cubetas[int(math.log1p(valor) // self._log_base)] += 1
+        self.n += 1
+        self.suma += valor
+        self.minimo = valor if self.minimo is None else min(self.minimo, valor)
+        self.maximo = valor if self.maximo is None else max(self.maximo, valor)
+
+    def merge(self, otro: "HistogramaLatencias") -> None:
+        self.cubetas.update(otro.cubetas)
+        self.n += otro.n
+        self.suma += otro.suma
+        for valor in (otro.minimo, otro.maximo):
+            if valor is not None:
+                self.minimo = valor if self.minimo is None else min(self.minimo, valor)
+                self.maximo = valor if self.maximo is None else max(self.maximo, valor)
+
+    def percentil(self, p: float) -> float:
+        """Valor aproximado del percentil p (0-100): centro de la cubeta que lo contiene."""
+        if not self.n:
+            return 0.0
+        objetivo = max(1, math.ceil(self.n * p / 100))
+        acumulado = 0
+        for cubeta in sorted(self.cubetas):
+            acumulado += self.cubetas[cubeta]
+            if acumulado >= objetivo:
+                inferior = math.expm1(cubeta * self._log_base)
+                superior = math.expm1((cubeta + 1) * self._log_base)
+                return min(max((inferior + superior) / 2, self.minimo), self.maximo)
+        return self.maximo
+
+    def media(self) -> float:
+        return self.suma / self.n if self.n else 0.0
+
+    def to_dict(self) -> dict:
+        return {"precision": self.precision, "n": self.n, "suma": self.suma, "minimo": self.minimo,
+                "maximo": self.maximo, "cubetas": {str(k): v for k, v in self.cubetas.items()}}
+
+    @classmethod
+    def from_dict(cls, datos: dict) -> "HistogramaLatencias":
+        histograma = cls(datos["precision"])
+        histograma.cubetas = Counter({int(k): v for k, v in datos["cubetas"].items()})
+        histograma.n, histograma.suma = datos["n"], datos["suma"]
+        histograma.minimo, histograma.maximo = datos["minimo"], datos["maximo"]
+        return histograma
+
+
+class ResumenInteracciones:
+    """Resúmenes combinables de un conjunto de interacciones."""
+
+    def __init__(self):
+        self.total = 0
+        self.primer_registro = None
+        self.ultimo_registro = None
+        self.endpoints = Counter()
+        self.usuarios = Counter()
+        self.fuentes = Counter()
+        self.acciones_agente = Counter()
+        self.errores = 0
+        self.latencias = HistogramaLatencias()
+        self.latencias_endpoint = {}
+        self.ultimas = []
+
+    def add(self, r: dict) -> None:
+        self.total += 1
+        timestamp = r.get('timestamp')
+        if timestamp:
+            if self.primer_registro is None or timestamp < self.primer_registro:
+                self.primer_registro = timestamp
+            if self.ultimo_registro is None or timestamp > self.ultimo_registro:
+                self.ultimo_registro = timestamp
+
+        endpoint = r.get('endpoint', 'desconocido')
+        self.endpoints[endpoint] += 1
+        self.usuarios[r.get('usuario_id', 'desconocido')] += 1
+        self.fuentes.update(r.get('fuentes') or [])
+        if endpoint == '/api/agent':
+            self.acciones_agente[r.get('accion_agente', 'N/A')] += 1
+        if 'error' in str((r.get('metadata') or {}).get('status', '')).lower():
+            self.errores += 1
+
+        if r.get('latencia_ms'):
+            self.latencias.add(r['latencia_ms'])
+            if endpoint not in self.latencias_endpoint:
+                self.latencias_endpoint[endpoint] = HistogramaLatencias()
+            self.latencias_endpoint[endpoint].add(r['latencia_ms'])
+
+        self.ultimas = (self.ultimas + [{
+            'timestamp': timestamp, 'usuario_id': r.get('usuario_id', 'desconocido'),
+            'endpoint': r.get('endpoint', 'N/A'), 'latencia_ms': r.get('latencia_ms', 'N/A'),
+            'entrada': (r.get('entrada') or '')[:50],
+        }])[-ULTIMAS:]
+
+    def to_dict(self) -> dict:
+        return {
+            "total": self.total, "primer_registro": self.primer_registro,
+            "ultimo_registro": self.ultimo_registro, "endpoints": self.endpoints,
+            "usuarios": self.usuarios, "fuentes": self.fuentes,
+            "acciones_agente": self.acciones_agente, "errores": self.errores,
+            "latencias": self.latencias.to_dict(),
+            "latencias_endpoint": {k: h.to_dict() for k, h in self.latencias_endpoint.items()},
+            "ultimas": self.ultimas,
+        }
+
+    @classmethod
+    def from_dict(cls, datos: dict) -> "ResumenInteracciones":
+        resumen = cls()
+        resumen.total, resumen.errores = datos["total"], datos["errores"]
+        resumen.primer_registro, resumen.ultimo_registro = datos["primer_registro"], datos["ultimo_registro"]
+        for campo in ("endpoints", "usuarios", "fuentes", "acciones_agente"):
+            setattr(resumen, campo, Counter(datos[campo]))
+        resumen.latencias = HistogramaLatencias.from_dict(datos["latencias"])
+        resumen.latencias_endpoint = {k: HistogramaLatencias.from_dict(h)
+                                      for k, h in datos["latencias_endpoint"].items()}
+        resumen.ultimas = datos["ultimas"]
+        return resumen
+
+
+# -------------------------------
+# Estado incremental
+# -------------------------------
+def estado_vacio():
+    # "activo": primer timestamp del log activo y lo leído de él (bytes y registros).
+    # "parciales": logs activos leídos en parte que aún no han aparecido como segmento.
+    return {"version": VERSION_ESTADO, "resumen": ResumenInteracciones().to_dict(),
+            "segmentos": [], "activo": None, "parciales": {}}
+
+
+def cargar_estado():
     try:
-        with open(INTERACTIONS_LOG, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    registros.append(json.loads(line.strip()))
-    except Exception as e:
-        print(f"❌ Error al leer logs: {e}")
-    
-    return registros
-
-
-def analizar_logs(registros):
-    """Analiza los registros y calcula estadísticas."""
-    if not registros:
+        with open(ESTADO_PATH, "r", encoding="utf-8") as f:
+            estado = json.load(f)
+        if estado.get("version") == VERSION_ESTADO:
+            return estado
+        print("⚠️  Estado de análisis de otra versión; se recalcula desde el principio.")
+    except FileNotFoundError:
+        pass
+    except (json.JSONDecodeError, KeyError) as e:
+        print(f"⚠️  Estado de análisis ilegible ({e}); se recalcula desde el principio.")
+    return estado_vacio()
+
+
+def guardar_estado(estado):
+    tmp = ESTADO_PATH.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False)
+    os.replace(tmp, ESTADO_PATH)
+
+
+def _primer_timestamp(ruta: Path):
+    try:
+        with open(ruta, "rb") as f:
+            return json.loads(f.readline()).get("timestamp")
+    except (OSError, json.JSONDecodeError, AttributeError):
+        return None
+
+
+def _leer_activo(desde_offset: int):
+    """Registros completos del log activo a partir de un offset. Devuelve (registros, offset final)."""
+    registros = []
+    with open(INTERACTIONS_LOG, "rb") as f:
+        f.seek(desde_offset)
+        offset = desde_offset
+        for linea in f:
+            if not linea.endswith(b"\n"):
+                break  # Línea a medio escribir: se leerá en la próxima ejecución
+            offset += len(linea)
+            if linea.strip():
+                try:
+                    registros.append(json.loads(linea))
+                except json.JSONDecodeError:
+                    pass
+    return registros, offset
+
+
+def actualizar(estado, al_procesar):
+    """Procesa los registros nuevos desde el último análisis y actualiza `estado`.
+
+    `al_procesar(registro)` se llama con cada registro nuevo. Devuelve cuántos hubo.
+    """
+    nuevos = 0
+    procesados = set(estado["segmentos"])
+    parciales = estado["parciales"]
+    activo = estado["activo"]
+
+    # Log activo actual: si empieza por otro registro, el anterior se ha rotado
+    primer_activo = _primer_timestamp(INTERACTIONS_LOG) if INTERACTIONS_LOG.exists() else None
+    if activo and activo["primer_timestamp"] != primer_activo:
+        parciales[activo["primer_timestamp"]] = activo["registros"]
+        activo = None
+
+    # Segmentos nuevos (inmutables); los que vienen de un log activo ya leído en parte
+    # (misma primera línea) se saltan los registros contados
+    for segmento in list_interaction_segments():
+        nombre = Path(segmento["ruta"]).name
+        if nombre in procesados:
+            continue
+        saltar = parciales.pop(segmento.get("primer_timestamp", segmento.get("desde")), 0)
+        for i, registro in enumerate(iter_segment(segmento)):
+            if i >= saltar:
+                al_procesar(registro)
+                nuevos += 1
+        estado["segmentos"].append(nombre)
+
+    if primer_activo is not None:
+        activo = activo or {"primer_timestamp": primer_activo, "offset": 0, "registros": 0}
+        registros, activo["offset"] = _leer_activo(activo["offset"])
+        for registro in registros:
+            al_procesar(registro)
+        activo["registros"] += len(registros)
+        nuevos += len(registros)
+    estado["activo"] = activo
+    return nuevos
+
+
+# -------------------------------
+# Informes
+# -------------------------------
+def analizar_logs(resumen: ResumenInteracciones):
+    """Muestra las estadísticas de un resumen."""
+    if not resumen.total:
         print("⚠️  No hay registros para analizar.")
         return
-    
+
     print("\n" + "="*70)
     print("📊 ANÁLISIS DE INTERACCIONES DEL CHATBOT")
     print("="*70)
-    
+
     # Estadísticas generales
     print(f"\n📈 Estadísticas Generales")
-    print(f"   Total de interacciones: {len(registros)}")
-    print(f"   Primer registro: {registros[0].get('timestamp', 'N/A')}")
-    print(f"   Último registro: {registros[-1].get('timestamp', 'N/A')}")
-    
-    # Usuarios únicos
-    usuarios = set(r.get('usuario_id', 'desconocido') for r in registros)
-    print(f"   Usuarios únicos: {len(usuarios)}")
-    
+    print(f"   Total de interacciones: {resumen.total}")
+    print(f"   Primer registro: {resumen.primer_registro or 'N/A'}")
+    print(f"   Último registro: {resumen.ultimo_registro or 'N/A'}")
+    print(f"   Usuarios únicos: {len(resumen.usuarios)}")
+
     # Endpoints
-    endpoints = Counter(r.get('endpoint', 'desconocido') for r in registros)
     print(f"\n🔌 Llamadas por endpoint:")
-    for endpoint, count in endpoints.most_common():
+    for endpoint, count in resumen.endpoints.most_common():
         print(f"   {endpoint}: {count}")
-    
+
     # Latencias
-    latencias = [r.get('latencia_ms', 0) for r in registros if r.get('latencia_ms')]
-    if latencias:
+    latencias = resumen.latencias
+    if latencias.n:
         print(f"\n⏱️  Latencias (ms):")
-        print(f"   Mínima: {min(latencias):.2f}ms")
-        print(f"   Máxima: {max(latencias):.2f}ms")
-        print(f"   Promedio: {statistics.mean(latencias):.2f}ms")
-        print(f"   Mediana: {statistics.median(latencias):.2f}ms")
-    
+        print(f"   Mínima: {latencias.minimo:.2f}ms")
+        print(f"   Máxima: {latencias.maximo:.2f}ms")
+        print(f"   Promedio: {latencias.media():.2f}ms")
+        print(f"   p50: {latencias.percentil(50):.2f}ms | p95: {latencias.percentil(95):.2f}ms | "
+              f"p99: {latencias.percentil(99):.2f}ms")
+        print(f"\n⏱️  Latencias por endpoint (ms):")
+        for endpoint, h in sorted(resumen.latencias_endpoint.items(), key=lambda item: -item[1].n):
+            print(f"   {endpoint}: n={h.n} p50={h.percentil(50):.0f} p95={h.percentil(95):.0f} "
+                  f"p99={h.percentil(99):.0f} máx={h.maximo:.0f}")
+
     # Acciones del agente
-    acciones_agente = Counter(r.get('accion_agente', 'N/A') for r in registros if r.get('endpoint') == '/api/agent')
-    if acciones_agente:
+    if resumen.acciones_agente:
         print(f"\n🤖 Acciones del agente:")
-        for accion, count in acciones_agente.most_common():
+        for accion, count in resumen.acciones_agente.most_common():
             print(f"   {accion}: {count}")
-    
+
     # Fuentes más consultadas
-    todas_las_fuentes = []
-    for r in registros:
-        todas_las_fuentes.extend(r.get('fuentes', []))
-    
-    fuentes_count = Counter(todas_las_fuentes)
-    if fuentes_count:
+    if resumen.fuentes:
         print(f"\n📚 Documentos más consultados:")
-        for fuente, count in fuentes_count.most_common(5):
+        for fuente, count in resumen.fuentes.most_common(5):
             print(f"   {fuente}: {count} veces")
-    
+
     # Usuarios más activos
-    usuarios_count = Counter(r.get('usuario_id', 'desconocido') for r in registros)
-    if usuarios_count:
+    if resumen.usuarios:
         print(f"\n👥 Usuarios más activos:")
-        for usuario, count in usuarios_count.most_common(5):
+        for usuario, count in resumen.usuarios.most_common(5):
             print(f"   {usuario}: {count} interacciones")
-    
+
     # Errores (si hay)
-    errores = [r for r in registros if 'error' in r.get('metadata', {}).get('status', '').lower()]
-    if errores:
-        print(f"\n❌ Registros con errores: {len(errores)}")
-    
+    if resumen.errores:
+        print(f"\n❌ Registros con errores: {resumen.errores}")
+
     print("\n" + "="*70)
 
 
-def generar_reporte_csv(registros):
-    """Genera un CSV para análisis en Excel."""
-    if not registros:
-        return
-    
-    csv_path = LOGS_DIR / "interacciones_reporte.csv"
-    
-    try:
-        import csv
-        with open(csv_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=[
-                'timestamp', 'endpoint', 'usuario_id', 'latencia_ms', 'accion_agente'
-            ])
-            writer.writeheader()
-            for r in registros:
-                writer.writerow({
-                    'timestamp': r.get('timestamp', ''),
-                    'endpoint': r.get('endpoint', ''),
-                    'usuario_id': r.get('usuario_id', ''),
-                    'latencia_ms': r.get('latencia_ms', ''),
-                    'accion_agente': r.get('accion_agente', '')
-                })
-        print(f"\n✅ Reporte CSV generado: {csv_path}")
-    except Exception as e:
-        print(f"\n⚠️  Error generando CSV: {e}")
-
-
-def mostrar_ultimas_interacciones(registros, n=5):
-    """Muestra las últimas N interacciones."""
-    if not registros:
+def abrir_reporte_csv(reiniciar: bool):
+    """Abre el CSV para Excel; en modo incremental las filas nuevas se añaden al final."""
+    nuevo = reiniciar or not CSV_PATH.exists()
+    f = open(CSV_PATH, "w" if nuevo else "a", newline="", encoding="utf-8")
+    writer = csv.DictWriter(f, fieldnames=CSV_CAMPOS, extrasaction="ignore")
+    if nuevo:
+        writer.writeheader()
+    return f, writer
+
+
+def mostrar_ultimas_interacciones(resumen: ResumenInteracciones):
+    """Muestra las últimas interacciones."""
+    if not resumen.ultimas:
         return
-    
-    print(f"\n📝 Últimas {n} interacciones:")
+
+    print(f"\n📝 Últimas {len(resumen.ultimas)} interacciones:")
     print("-" * 70)
-    
-    for i, r in enumerate(registros[-n:], 1):
-        timestamp = r.get('timestamp', 'N/A')
-        usuario = r.get('usuario_id', 'desconocido')
-        endpoint = r.get('endpoint', 'N/A')
-        latencia = r.get('latencia_ms', 'N/A')
-        entrada = r.get('entrada', '')[:50]
-        
-        print(f"\n{i}. [{timestamp}] {usuario} ({endpoint})")
-        print(f"   Entrada: {entrada}...")
-        print(f"   Latencia: {latencia}ms")
+
+    for i, r in enumerate(resumen.ultimas, 1):
+        print(f"\n{i}. [{r['timestamp'] or 'N/A'}] {r['usuario_id']} ({r['endpoint']})")
+        print(f"   Entrada: {r['entrada']}...")
+        print(f"   Latencia: {r['latencia_ms']}ms")
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Estadísticas de las interacciones del chatbot.")
+    parser.add_argument("--desde", help="Timestamp ISO (UTC) inicial, incluido (ej. 2025-12-01)")
+    parser.add_argument("--hasta", help="Timestamp ISO (UTC) final, excluido (ej. 2025-12-08)")
+    parser.add_argument("--reiniciar", action="store_true",
+                        help="Descarta el estado guardado y recalcula desde el principio")
+    args = parser.parse_args()
+
     print("\n🚀 Analizando logs de interacciones...")
-    
-    registros = cargar_interacciones()
-    
-    if registros:
-        analizar_logs(registros)
-        mostrar_ultimas_interacciones(registros, n=3)
-        generar_reporte_csv(registros)
+
+    if args.desde or args.hasta:
+        # Ventana concreta: resumen independiente, sin tocar el estado incremental
+        resumen = ResumenInteracciones()
+        for registro in iter_interactions(args.desde, args.hasta):
+            resumen.add(registro)
+    else:
+        estado = estado_vacio() if args.reiniciar else cargar_estado()
+        resumen = ResumenInteracciones.from_dict(estado["resumen"])
+        csv_file, csv_writer = abrir_reporte_csv(args.reiniciar or not estado["segmentos"] and not estado["activo"])
+        with csv_file:
+            def procesar(registro):
+                resumen.add(registro)
+                csv_writer.writerow(registro)
+            nuevos = actualizar(estado, procesar)
+        estado["resumen"] = resumen.to_dict()
+        guardar_estado(estado)
+        print(f"   Registros nuevos desde el último análisis: {nuevos}")
+        print(f"   Reporte CSV actualizado: {CSV_PATH}")
+
+    if resumen.total:
+        analizar_logs(resumen)
+        mostrar_ultimas_interacciones(resumen)
     else:
         print("\n⚠️  No hay interacciones registradas aún.")
         print("   Usa el chatbot (http://127.0.0.1:9000) y vuelve a intentar.")
-    
-    print(f"\n📂 Archivo de logs: {INTERACTIONS_LOG}")
+
+    print(f"\n📂 Archivo de logs: {INTERACTIONS_LOG} (segmentos en {SEGMENTS_DIR})")
     print()
@@ -0,0 +1,70 @@
+"""
+Evalúa la búsqueda sobre embeddings cuantizados (int8 / float16) frente a la exacta.
+Usa como consultas las preguntas reales registradas en los logs de interacciones y
+muestra recall@k, latencia media y memoria de la matriz recorrida.
+
+Ejecutar: python -m scripts.evaluar_cuantizacion [--k 4] [--rescore 10]
+"""
+
+import argparse
+import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from config.settings import EMBEDDING_MODEL_NAME, TOP_K_CHUNKS, QUANTIZED_RESCORE
+from services.index_versions import active_index_dirs
+from services.logger_service import INTERACTIONS_LOG, iter_interactions
+from services.vector_search import VectorIndex, QuantizedIndex, load_embeddings, quantize_embeddings
+
+
+def cargar_preguntas(limite: int):
+    """Preguntas únicas de los logs de /api/query* (las más recientes primero)."""
+    preguntas = [
+        registro["entrada"] for registro in iter_interactions()
+        if registro.get("endpoint", "").startswith("/api/query") and registro.get("entrada")
+    ]
+    return list(dict.fromkeys(reversed(preguntas)))[:limite]
+
+
+def medir(index, consultas: np.ndarray, k: int):
+    inicio = time.perf_counter()
+    resultados = [index.search(q[None, :], k)[0] for q in consultas]
+    return resultados, (time.perf_counter() - inicio) * 1000 / len(consultas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k de la búsqueda cuantizada frente a la exacta.")
+    parser.add_argument("--k", type=int, default=TOP_K_CHUNKS)
+    parser.add_argument("--rescore", type=int, default=QUANTIZED_RESCORE)
+    parser.add_argument("--max-preguntas", type=int, default=500)
+    args = parser.parse_args()
+
+    preguntas = cargar_preguntas(args.max_preguntas)
+    if not preguntas:
+        print(f"⚠️ No hay preguntas registradas en {INTERACTIONS_LOG} ni en sus segmentos.")
+        return
+
+    _, embeddings_dir, version = active_index_dirs()
+    embeddings, normalized = load_embeddings(embeddings_dir)
+    exacto = VectorIndex(embeddings, normalized=normalized)
+    consultas = SentenceTransformer(EMBEDDING_MODEL_NAME).encode(preguntas)
+
+    print(f"\n📊 {len(preguntas)} preguntas, {len(exacto)} chunks{f' (versión {version})' if version else ''}, "
+          f"k={args.k}, reordenación de {args.k * args.rescore} candidatos")
+    referencia, ms_exacto = medir(exacto, consultas, args.k)
+    print(f"   float32  recall@{args.k}: 1.0000  {ms_exacto:7.2f} ms/consulta  "
+          f"{exacto.embeddings.nbytes / 2**20:8.1f} MiB")
+
+    for dtype in ("float16", "int8"):
+        cuantizada, escalas = quantize_embeddings(exacto.embeddings, dtype)
+        index = QuantizedIndex(exacto.embeddings, cuantizada, escalas, rescore=args.rescore, normalized=True)
+        resultados, ms = medir(index, consultas, args.k)
+        aciertos = sum(len(set(r.tolist()) & set(ref.tolist())) for r, ref in zip(resultados, referencia))
+        recall = aciertos / sum(len(ref) for ref in referencia)
+        print(f"   {dtype:8} recall@{args.k}: {recall:.4f}  {ms:7.2f} ms/consulta  "
+              f"{cuantizada.nbytes / 2**20:8.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
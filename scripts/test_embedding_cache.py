@@ -0,0 +1,83 @@
+"""
+Prueba de la caché de embeddings de la ingesta en streaming con textos repetidos.
+
+Simula dos lotes de `run_streaming_ingestion` (get_many + put_many de los que
+faltan) con textos repetidos dentro de cada lote y entre lotes, y comprueba que
+la caché guardada no tiene claves duplicadas y que `EmbeddingCache` puede
+volver a escribirla y compactarla.
+
+    python -m scripts.test_embedding_cache
+"""
+
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from services.embedding_cache import AppendOnlyEmbeddingCache, EmbeddingCache, KEYS_FILE
+
+
+def _vector(text: str) -> np.ndarray:
+    rng = np.random.default_rng(sum(text.encode("utf-8")))
+    return rng.normal(size=8).astype(np.float32)
+
+
+def _streaming_batch(cache: AppendOnlyEmbeddingCache, texts):
+    vectors, missing = cache.get_many(texts)
+    cache.put_many([texts[i] for i in missing], np.array([_vector(texts[i]) for i in missing]))
+    return vectors, missing
+
+
+def test_textos_repetidos_entre_lotes():
+    directory = Path(tempfile.mkdtemp())
+
+    cache = AppendOnlyEmbeddingCache("modelo-prueba", directory)
+    _, missing = _streaming_batch(cache, ["a", "a", "b"])
+    assert missing == [0, 1, 2]
+    vectors, missing = _streaming_batch(cache, ["b", "c", "a"])
+    assert missing == [1]
+    assert np.allclose(vectors[0], _vector("b")) and np.allclose(vectors[2], _vector("a"))
+    cache.save()
+
+    keys = np.load(directory / KEYS_FILE)
+    assert keys.shape[0] == 3 == np.unique(keys).shape[0]
+
+    # Una segunda ingesta con los mismos textos no añade nada
+    cache = AppendOnlyEmbeddingCache("modelo-prueba", directory)
+    _, missing = _streaming_batch(cache, ["a", "b", "c", "d", "d"])
+    assert missing == [3, 4]
+    cache.save()
+    assert np.load(directory / KEYS_FILE).shape[0] == 4
+
+    classic = EmbeddingCache("modelo-prueba", directory)
+    classic.put_many(["e"], np.array([_vector("e")]))
+    classic.save()
+    assert classic.compact(max_entries=2) == 3
+
+
+def test_cache_con_claves_duplicadas_en_disco():
+    directory = Path(tempfile.mkdtemp())
+    cache = EmbeddingCache("modelo-prueba", directory)
+    cache.put_many(["a", "b"], np.array([_vector("a"), _vector("b")]))
+    cache.save()
+
+    # Cachés escritas antes de la deduplicación: la misma clave en dos filas
+    for name in ("keys.npy", "vectors.npy", "last_used.npy"):
+        data = np.load(directory / name)
+        np.save(directory / name, np.concatenate([data, data[:1]]))
+
+    cache = EmbeddingCache("modelo-prueba", directory)
+    assert len(cache) == 2
+    cache.put_many(["c"], np.array([_vector("c")]))
+    cache.save()
+    assert cache.compact(max_entries=2) == 1
+
+
+def main():
+    test_textos_repetidos_entre_lotes()
+    test_cache_con_claves_duplicadas_en_disco()
+    print("✅ Caché de embeddings sin claves duplicadas.")
+
+
+if __name__ == '__main__':
+    main()
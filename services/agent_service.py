@@ -1,3 +1,4 @@
+import asyncio
 from pathlib import Path
 import json
 from datetime import datetime
@@ -31,20 +32,30 @@ class SimpleAgent:
         - En otro caso, devuelve la respuesta RAG al usuario.
         """
 
+        # Obtener contexto/respuesta desde el RAG
+        rag_result = self.rag.query(instruction)
+        return self._act(instruction, usuario_id, rag_result)
+
+    async def aperform_task(self, instruction: str, usuario_id: str = "anonimo") -> dict:
+        """Versión asíncrona de `perform_task`: no bloquea el event loop."""
+        rag_result = await self.rag.aquery(instruction)
+        return await asyncio.to_thread(self._act, instruction, usuario_id, rag_result)
+
+    @staticmethod
+    def _should_create(instruction: str) -> bool:
         text = instruction.lower()
-        should_create = any(k in text for k in ["crear solicitud", "generar solicitud", "crear documento", "generar documento", "crear solicitud", "crear solicitud de"]) or (
+        return any(k in text for k in ["crear solicitud", "generar solicitud", "crear documento", "generar documento", "crear solicitud", "crear solicitud de"]) or (
             ("crear" in text or "generar" in text) and ("solicitud" in text or "documento" in text)
         )
 
-        # Obtener contexto/respuesta desde el RAG
-        rag_result = self.rag.query(instruction)
-
+    def _act(self, instruction: str, usuario_id: str, rag_result: dict) -> dict:
+        """Decide la acción a partir de la respuesta del RAG y, si procede, crea la solicitud."""
         if "error" in rag_result:
             return {"status": "error", "detail": rag_result.get("error")}
 
         respuesta = rag_result.get("respuesta", "")
 
-        if should_create:
+        if self._should_create(instruction):
             # Crear un archivo JSON con la 'solicitud' que contenga la instrucción, la respuesta RAG y metadatos
             timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
             filename = f"solicitud_{usuario_id}_{timestamp}.json"
@@ -0,0 +1,112 @@
+"""
+Caché semántica de respuestas del LLM.
+
+Las preguntas frecuentes (discapacidad, dependencia, atención temprana...) llegan
+con redacciones ligeramente distintas. Si una pregunta nueva es casi idéntica a
+una ya respondida (similitud del coseno >= umbral) y además recupera exactamente
+los mismos chunks de la misma versión del índice, se devuelve la respuesta
+guardada sin llamar a Gemini.
+
+La caché vive en memoria de cada worker, con desalojo LRU y caducidad (TTL).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class AnswerCache:
+    """Respuestas agrupadas por (versión del índice, chunks recuperados).
+
+    Dentro de cada grupo se compara el embedding normalizado de la pregunta con
+    los de las preguntas guardadas; los grupos suelen tener muy pocas entradas,
+    así que la búsqueda es un producto escalar pequeño.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[float] = None,
+                 similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()   # id -> (clave de grupo, vector, respuesta, creado_en)
+        self._groups = {}               # clave de grupo -> [ids]
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _group_key(version, chunk_ids: Sequence[int]) -> tuple:
+        return version, tuple(sorted(int(i) for i in chunk_ids))
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, question_embedding, chunk_ids: Sequence[int], version=None) -> Optional[dict]:
+        """Devuelve la respuesta guardada más parecida, o None si no hay ninguna válida."""
+        if self.max_entries <= 0:
+            return None
+        key = self._group_key(version, chunk_ids)
+        query = self._unit(question_embedding)
+        now = time.time()
+
+        with self._lock:
+            best_id, best_score = None, self.similarity_threshold
+            for entry_id in list(self._groups.get(key, ())):
+                _, vector, _, created = self._entries[entry_id]
+                if self.ttl_seconds is not None and now - created > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                score = float(vector @ query)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return dict(self._entries[best_id][2])
+
+    def put(self, question_embedding, chunk_ids: Sequence[int], answer: dict, version=None) -> None:
+        if self.max_entries <= 0:
+            return
+        key = self._group_key(version, chunk_ids)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (key, self._unit(question_embedding), dict(answer), time.time())
+            self._groups.setdefault(key, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """Vacía la caché (p. ej. al publicarse una versión nueva del índice)."""
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entradas": len(self._entries),
+            "aciertos": self.hits,
+            "fallos": self.misses,
+            "tasa_aciertos": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def _remove(self, entry_id: int) -> None:
+        key = self._entries.pop(entry_id)[0]
+        group = self._groups[key]
+        group.remove(entry_id)
+        if not group:
+            del self._groups[key]
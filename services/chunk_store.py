@@ -0,0 +1,152 @@
+"""
+Almacén compacto de chunks, compartido por el chunking, los embeddings y el RAG.
+
+Formato (todos los ficheros en el mismo directorio):
+- chunks_text.bin           textos UTF-8 concatenados
+- chunks_text_offsets.npy   int64[n + 1], el chunk `i` es text[offsets[i]:offsets[i + 1]]
+- chunks_source_ids.npy     int32[n], índice del documento de origen en chunks_sources.json
+- chunks_chunk_ids.npy      int32[n], posición del chunk dentro de su documento
+- chunks_sources.json       lista de nombres de documento
+
+El texto y las columnas se abren con mmap, así que el acceso al chunk `i` es
+O(1) y varios workers de uvicorn comparten una única copia física en la caché
+de páginas del sistema operativo.
+"""
+
+import json
+import mmap
+import os
+from array import array
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+TEXT_FILE = "chunks_text.bin"
+TEXT_OFFSETS_FILE = "chunks_text_offsets.npy"
+SOURCE_IDS_FILE = "chunks_source_ids.npy"
+CHUNK_IDS_FILE = "chunks_chunk_ids.npy"
+SOURCES_FILE = "chunks_sources.json"
+
+
+def save_array(path: Path, array: np.ndarray) -> None:
+    """Guarda un .npy de forma atómica (fichero temporal + os.replace).
+
+    Reemplazar el fichero en lugar de sobrescribirlo evita corromper los
+    mapas de memoria que otros procesos tengan abiertos sobre la versión anterior.
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class ChunkStoreWriter:
+    """Escribe chunks en streaming: el texto va directo a disco y sólo se
+    mantienen en memoria las columnas de enteros."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._tmp_text_path = directory / (TEXT_FILE + ".tmp")
+        self._text_file = open(self._tmp_text_path, "wb")
+        self._offsets = array("q", [0])
+        self._source_ids = array("i")
+        self._chunk_ids = array("i")
+        self._sources = []
+        self._source_index = {}
+
+    def __len__(self) -> int:
+        return len(self._chunk_ids)
+
+    def add(self, text: str, source: str, chunk_id: int) -> None:
+        data = text.encode("utf-8")
+        self._text_file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+        if source not in self._source_index:
+            self._source_index[source] = len(self._sources)
+            self._sources.append(source)
+        self._source_ids.append(self._source_index[source])
+        self._chunk_ids.append(chunk_id)
+
+    def truncate(self, n: int) -> None:
+        """Descarta los chunks a partir del `n` (y los documentos que se quedan sin chunks)."""
+        self._text_file.flush()
+        self._text_file.truncate(self._offsets[n])
+        self._text_file.seek(self._offsets[n])
+        del self._offsets[n + 1:], self._source_ids[n:], self._chunk_ids[n:]
+        # Los documentos se numeran por orden de aparición: los usados son un prefijo
+        used = max(self._source_ids) + 1 if n else 0
+        for source in self._sources[used:]:
+            del self._source_index[source]
+        del self._sources[used:]
+
+    def close(self) -> None:
+        """Cierra el texto y publica todos los ficheros del almacén."""
+        self._text_file.close()
+        os.replace(self._tmp_text_path, self.directory / TEXT_FILE)
+        save_array(self.directory / TEXT_OFFSETS_FILE, np.frombuffer(self._offsets, dtype=np.int64))
+        save_array(self.directory / SOURCE_IDS_FILE, np.frombuffer(self._source_ids, dtype=np.int32))
+        save_array(self.directory / CHUNK_IDS_FILE, np.frombuffer(self._chunk_ids, dtype=np.int32))
+        with open(self.directory / SOURCES_FILE, "w", encoding="utf-8") as f:
+            json.dump(self._sources, f, ensure_ascii=False)
+
+    def abort(self) -> None:
+        """Descarta lo escrito y deja intacto el almacén anterior."""
+        self._text_file.close()
+        self._tmp_text_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_chunk_store(directory: Path, chunks: list) -> None:
+    """Guarda una lista de chunks ({"text", "metadata": {"source", "chunk_id"}})."""
+    with ChunkStoreWriter(directory) as writer:
+        for chunk in chunks:
+            writer.add(chunk["text"], chunk["metadata"]["source"], chunk["metadata"]["chunk_id"])
+
+
+class ChunkStore:
+    """Lectura perezosa de chunks: sólo se decodifica el chunk solicitado."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.offsets = np.load(directory / TEXT_OFFSETS_FILE, mmap_mode="r")
+        self.source_ids = np.load(directory / SOURCE_IDS_FILE, mmap_mode="r")
+        self.chunk_ids = np.load(directory / CHUNK_IDS_FILE, mmap_mode="r")
+        with open(directory / SOURCES_FILE, "r", encoding="utf-8") as f:
+            self.sources = json.load(f)
+
+        self._file = open(directory / TEXT_FILE, "rb")
+        # mmap no admite ficheros vacíos
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b""
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    def text(self, i: int) -> str:
+        return self._data[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def source(self, i: int) -> str:
+        return self.sources[self.source_ids[i]]
+
+    def metadata(self, i: int) -> dict:
+        return {"source": self.source(i), "chunk_id": int(self.chunk_ids[i])}
+
+    def texts(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.text(i)
+
+    def __getitem__(self, i: int) -> dict:
+        return {"text": self.text(i), "metadata": self.metadata(i)}
@@ -2,48 +2,92 @@
 
 # IMPORTACIÓN CORREGIDA
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+import numpy as np
+from pathlib import Path
+from typing import Optional
 from config.settings import DATA_CLEAN_DIR, CHUNKS_DIR, CHUNK_SIZE, CHUNK_OVERLAP
-import json
+from .chunk_store import ChunkStore, ChunkStoreWriter
+from .index_manifest import text_sha256, load_manifest, save_manifest
+from .sparse_index import SparseIndexWriter
 
-def run_chunking():
-    """Divide los textos limpios en chunks y los guarda."""
+
+def _load_previous_store(manifest: dict, previous_dir: Path):
+    """Abre el almacén anterior si se generó con los mismos parámetros de chunking."""
+    if manifest.get("chunk_size") != CHUNK_SIZE or manifest.get("chunk_overlap") != CHUNK_OVERLAP:
+        return None
+    try:
+        return ChunkStore(previous_dir)
+    except FileNotFoundError:
+        return None
+
+
+def run_chunking(chunks_dir: Path = CHUNKS_DIR, previous_dir: Optional[Path] = None) -> dict:
+    """Divide los textos limpios en chunks y los guarda en `chunks_dir`.
+
+    Es incremental: los documentos cuyo texto no ha cambiado (mismo hash que en
+    el manifiesto del almacén anterior, `previous_dir`, por defecto el propio
+    `chunks_dir`) copian sus chunks en lugar de volver a trocearse, y los
+    documentos eliminados desaparecen del almacén.
+    """
+    previous_dir = previous_dir or chunks_dir
     print("🧩 Iniciando el proceso de 'chunking'...")
+    resumen = {"documentos_troceados": 0, "documentos_reutilizados": 0, "chunks": 0}
     
     text_files = [f for f in DATA_CLEAN_DIR.glob("*.txt")]
     if not text_files:
+        # Se escribe igualmente un almacén vacío: si se borró el último PDF, sus chunks desaparecen
         print(f"⚠️ No se encontraron archivos de texto limpio en: {DATA_CLEAN_DIR}")
-        return
 
-    all_chunks = []
+    manifest = load_manifest(previous_dir)
+    previous_hashes = manifest.get("documentos", {})
+    previous_store = _load_previous_store(manifest, previous_dir)
+    current_hashes = {}
+
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
         separators=["\n\n", "\n", " ", ""] # Separadores lógicos
     )
 
-    for text_path in text_files:
-        print(f"📖 Troceando: {text_path.name}")
-        with open(text_path, "r", encoding="utf-8") as f:
-            text = f.read()
-        
-        source_chunks = splitter.create_documents([text])
-        
-        for i, chunk in enumerate(source_chunks):
-            all_chunks.append({
-                "text": chunk.page_content,
-                "metadata": {
-                    "source": text_path.name,
-                    "chunk_id": i
-                }
-            })
-    
-    # Guardar todos los chunks en un único archivo JSON
-    output_path = CHUNKS_DIR / "chunks.json"
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(all_chunks, f, ensure_ascii=False, indent=2)
-        
-    print(f"✅ Se han guardado {len(all_chunks)} chunks en: {output_path}")
+    # Los chunks se escriben directamente en el almacén compacto, sin acumularlos en memoria.
+    # A la vez se construye el índice léxico BM25 (ver sparse_index).
+    sparse_writer = SparseIndexWriter()
+    with ChunkStoreWriter(chunks_dir) as writer:
+        for text_path in sorted(text_files):
+            with open(text_path, "r", encoding="utf-8") as f:
+                text = f.read()
+            text_hash = text_sha256(text)
+            current_hashes[text_path.name] = text_hash
+
+            if (previous_store is not None and previous_hashes.get(text_path.name) == text_hash
+                    and text_path.name in previous_store.sources):
+                source_id = previous_store.sources.index(text_path.name)
+                for idx in np.flatnonzero(previous_store.source_ids == source_id):
+                    chunk_text = previous_store.text(idx)
+                    writer.add(chunk_text, source=text_path.name, chunk_id=int(previous_store.chunk_ids[idx]))
+                    sparse_writer.add(chunk_text)
+                resumen["documentos_reutilizados"] += 1
+                continue
+
+            print(f"📖 Troceando: {text_path.name}")
+            for i, chunk_text in enumerate(splitter.split_text(text)):
+                writer.add(chunk_text, source=text_path.name, chunk_id=i)
+                sparse_writer.add(chunk_text)
+            resumen["documentos_troceados"] += 1
+
+    sparse_writer.save(chunks_dir)
+    save_manifest(chunks_dir, {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "documentos": current_hashes,
+    })
+    resumen["chunks"] = len(writer)
+
+    print(f"✅ Se han guardado {len(writer)} chunks en: {chunks_dir} "
+          f"({resumen['documentos_troceados']} documentos troceados, "
+          f"{resumen['documentos_reutilizados']} reutilizados)")
     print("🏁 Proceso de 'chunking' finalizado.")
+    return resumen
 
 if __name__ == '__main__':
     run_chunking()
\ No newline at end of file
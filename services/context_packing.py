@@ -0,0 +1,88 @@
+"""
+Montaje del contexto que se envía al LLM a partir de los chunks recuperados.
+
+Con CHUNK_OVERLAP > 0, dos chunks contiguos de un mismo documento comparten
+texto que, concatenados tal cual, se enviaría dos veces a Gemini. Aquí:
+1. se seleccionan los chunks por relevancia mientras quepan en el presupuesto de tokens,
+2. los contiguos del mismo documento (chunk_id consecutivos) se fusionan quitando el solapamiento,
+3. los fragmentos se ordenan por posición dentro de cada documento.
+"""
+
+from typing import List, Sequence, Tuple
+
+from .chunk_store import ChunkStore
+
+SEPARATOR = "\n\n---\n\n"
+MIN_OVERLAP = 20   # Solapamientos más cortos se consideran coincidencias casuales
+
+
+def estimate_tokens(text: str, chars_per_token: float = 4.0) -> int:
+    """Estimación barata de tokens (Gemini no expone un tokenizador local)."""
+    return int(len(text) / chars_per_token) + 1
+
+
+def overlap_length(previous: str, following: str, max_overlap: int) -> int:
+    """Longitud del sufijo más largo de `previous` que es prefijo de `following`."""
+    for length in range(min(len(previous), len(following), max_overlap), MIN_OVERLAP - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+def _merge_runs(chunks: ChunkStore, selected: Sequence[int], max_overlap: int) -> List[Tuple[str, str]]:
+    """Fusiona los chunks seleccionados en bloques (documento, texto).
+
+    Los documentos aparecen en el orden de su chunk más relevante y, dentro de
+    cada uno, los bloques siguen el orden del documento.
+    """
+    by_source = {}
+    for idx in selected:
+        by_source.setdefault(chunks.source(idx), []).append(idx)
+
+    blocks = []
+    for source, indices in by_source.items():
+        indices = sorted(indices, key=lambda i: int(chunks.chunk_ids[i]))
+        text, last_id = chunks.text(indices[0]), int(chunks.chunk_ids[indices[0]])
+        for idx in indices[1:]:
+            chunk_id, chunk_text = int(chunks.chunk_ids[idx]), chunks.text(idx)
+            if chunk_id == last_id + 1:
+                overlap = overlap_length(text, chunk_text, max_overlap)
+                text += chunk_text[overlap:] if overlap else " " + chunk_text
+            else:
+                blocks.append((source, text))
+                text = chunk_text
+            last_id = chunk_id
+        blocks.append((source, text))
+    return blocks
+
+
+def pack_context(chunks: ChunkStore, ranked_indices: Sequence[int], token_budget: int,
+                 max_overlap: int, chars_per_token: float = 4.0):
+    """Monta el contexto de los chunks `ranked_indices` (de más a menos relevante).
+
+    Devuelve (contexto, índices usados, fuentes). Si ni siquiera el chunk más
+    relevante cabe en el presupuesto, se recorta.
+    """
+    def packed_tokens(selection):
+        blocks = _merge_runs(chunks, selection, max_overlap)
+        text_tokens = sum(estimate_tokens(text, chars_per_token) for _, text in blocks)
+        return text_tokens + estimate_tokens(SEPARATOR, chars_per_token) * (len(blocks) - 1)
+
+    selected = []
+    for idx in ranked_indices:
+        idx = int(idx)
+        if idx in selected:
+            continue
+        if not selected or packed_tokens(selected + [idx]) <= token_budget:
+            selected.append(idx)
+
+    if not selected:
+        return "", [], []
+
+    blocks = _merge_runs(chunks, selected, max_overlap)
+    if len(selected) == 1 and packed_tokens(selected) > token_budget:
+        source, text = blocks[0]
+        blocks = [(source, text[:int(token_budget * chars_per_token)])]
+
+    sources = list(dict.fromkeys(source for source, _ in blocks))
+    return SEPARATOR.join(text for _, text in blocks), selected, sources
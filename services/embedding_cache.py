@@ -0,0 +1,338 @@
+"""
+Caché persistente de embeddings de chunks.
+Cada vector se guarda con la clave hash(modelo + texto normalizado), de modo que
+al reingestar tras pequeñas ediciones o al probar otros tamaños de chunk se
+reutilizan los vectores ya calculados y sólo se codifican los textos nuevos.
+
+Compactación (elimina los vectores de chunks que ya no están en el índice):
+    python -m services.embedding_cache --compactar
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import time
+import unicodedata
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from config.settings import EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_MAX_ENTRIES
+from .chunk_store import ChunkStore, save_array
+from .index_versions import active_index_dirs
+
+KEYS_FILE = "keys.npy"
+VECTORS_FILE = "vectors.npy"
+LAST_USED_FILE = "last_used.npy"
+
+
+def normalize_text(text: str) -> str:
+    """Normalización usada para la clave: Unicode NFC y espacios colapsados."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, model_name: str) -> bytes:
+    data = f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """Caché en disco de vectores de un modelo concreto.
+
+    Los datos viven en `EMBEDDING_CACHE_DIR/<modelo>/` como tres columnas NumPy
+    (claves, vectores y último uso). Se carga entera en memoria al abrirla y sólo
+    se reescribe en `save()` si ha habido cambios.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, directory: Optional[Path] = None):
+        self.model_name = model_name
+        self.directory = directory or EMBEDDING_CACHE_DIR / re.sub(r"[^\w.-]+", "_", model_name)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index = {}
+        self._vectors = []
+        self._last_used = []
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            keys = np.load(self.directory / KEYS_FILE)
+            vectors = np.load(self.directory / VECTORS_FILE)
+            last_used = np.load(self.directory / LAST_USED_FILE)
+        except FileNotFoundError:
+            return
+        if not (keys.shape[0] == vectors.shape[0] == last_used.shape[0]):
+            print(f"⚠️ Caché de embeddings inconsistente en {self.directory}. Se ignora.")
+            return
+        # Filas con clave repetida: se conserva la primera y la caché se reescribe en el próximo save()
+        _, first = np.unique(keys, return_index=True)
+        if first.shape[0] < keys.shape[0]:
+            print(f"⚠️ Caché de embeddings con {keys.shape[0] - first.shape[0]} claves repetidas. Se eliminan.")
+            rows = np.sort(first)
+            keys, vectors, last_used = keys[rows], vectors[rows], last_used[rows]
+            self._dirty = True
+        self._index = {bytes(k): i for i, k in enumerate(keys)}
+        self._vectors = list(vectors)
+        self._last_used = list(last_used)
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def get_many(self, texts: List[str]):
+        """Devuelve (vectores, índices_faltantes); vectores[i] es None si no está en caché."""
+        now = int(time.time())
+        vectors, missing = [], []
+        for i, text in enumerate(texts):
+            row = self._index.get(cache_key(text, self.model_name))
+            if row is None:
+                vectors.append(None)
+                missing.append(i)
+            else:
+                vectors.append(self._vectors[row])
+                self._last_used[row] = now
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        self._dirty = self._dirty or len(missing) < len(texts)
+        return vectors, missing
+
+    def put_many(self, texts: List[str], vectors: np.ndarray) -> None:
+        now = int(time.time())
+        for text, vector in zip(texts, vectors):
+            key = cache_key(text, self.model_name)
+            if key in self._index:
+                continue
+            self._index[key] = len(self._vectors)
+            self._vectors.append(np.asarray(vector, dtype=np.float32))
+            self._last_used.append(now)
+            self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        keys = np.empty(len(self._index), dtype="S16")
+        for key, row in self._index.items():
+            keys[row] = key
+        dimension = self._vectors[0].shape[0] if self._vectors else 0
+        save_array(self.directory / KEYS_FILE, keys)
+        save_array(self.directory / VECTORS_FILE, np.array(self._vectors, dtype=np.float32).reshape(-1, dimension))
+        save_array(self.directory / LAST_USED_FILE, np.array(self._last_used, dtype=np.int64))
+        self._dirty = False
+
+    def compact(self, keep_texts: Optional[List[str]] = None, max_entries: Optional[int] = None) -> int:
+        """Elimina entradas y guarda la caché. Devuelve el número de entradas eliminadas.
+
+        - `keep_texts`: si se indica, sólo se conservan los vectores de esos textos.
+        - `max_entries`: si se supera, se desalojan las entradas usadas hace más tiempo.
+        """
+        rows = list(range(len(self._vectors)))
+        if keep_texts is not None:
+            keep_keys = {cache_key(text, self.model_name) for text in keep_texts}
+            rows = [self._index[k] for k in keep_keys if k in self._index]
+        if max_entries is not None and len(rows) > max_entries:
+            rows = sorted(rows, key=lambda r: self._last_used[r], reverse=True)[:max_entries]
+        rows = sorted(rows)
+
+        removed = len(self._vectors) - len(rows)
+        keys_by_row = {row: key for key, row in self._index.items()}
+        self._index = {keys_by_row[row]: new_row for new_row, row in enumerate(rows)}
+        self._vectors = [self._vectors[row] for row in rows]
+        self._last_used = [self._last_used[row] for row in rows]
+        self._dirty = True
+        self.save()
+        return removed
+
+
+
+class AppendOnlyEmbeddingCache:
+    """Variante de la caché para la ingesta en streaming, con memoria acotada.
+
+    La caché existente se abre con mmap (sólo se cargan las claves ordenadas y
+    los usos, no los vectores) y los vectores nuevos se añaden lote a lote a
+    ficheros temporales en disco. `save()` concatena ambos por bloques. Mismo
+    formato en disco que `EmbeddingCache`.
+
+    En memoria sólo queda un diccionario clave -> fila de las claves pendientes,
+    para no añadir dos veces el mismo texto y poder servirlo desde los pendientes.
+    """
+
+    PENDING_KEYS_FILE = "pending_keys.bin"
+    PENDING_VECTORS_FILE = "pending_vectors.bin"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, directory: Optional[Path] = None,
+                 block_rows: int = 65536):
+        self.model_name = model_name
+        self.directory = directory or EMBEDDING_CACHE_DIR / re.sub(r"[^\w.-]+", "_", model_name)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.block_rows = block_rows
+        self.hits = 0
+        self.misses = 0
+        self.dimension = None
+        self._pending = 0
+        self._pending_rows = {}
+        self._load()
+        self._pending_keys = open(self.directory / self.PENDING_KEYS_FILE, "wb")
+        self._pending_vectors = open(self.directory / self.PENDING_VECTORS_FILE, "w+b")
+
+    def _load(self) -> None:
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._sorted_keys = np.empty(0, dtype="S16")
+        self._order = np.empty(0, dtype=np.int64)
+        self._last_used = np.empty(0, dtype=np.int64)
+        try:
+            keys = np.load(self.directory / KEYS_FILE, mmap_mode="r")
+            vectors = np.load(self.directory / VECTORS_FILE, mmap_mode="r")
+            last_used = np.load(self.directory / LAST_USED_FILE)
+        except FileNotFoundError:
+            return
+        if not (keys.shape[0] == vectors.shape[0] == last_used.shape[0]):
+            print(f"⚠️ Caché de embeddings inconsistente en {self.directory}. Se ignora.")
+            return
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted_keys = np.asarray(keys)[self._order]
+        self._vectors = vectors
+        self._last_used = last_used
+        self.dimension = vectors.shape[1] if vectors.ndim == 2 and vectors.shape[0] else None
+
+    def __len__(self) -> int:
+        return self._vectors.shape[0] + self._pending
+
+    def _find_on_disk(self, keys: np.ndarray):
+        """(encontrada, fila) de cada clave en la caché existente."""
+        if self._sorted_keys.shape[0] == 0:
+            return np.zeros(keys.shape[0], dtype=bool), np.zeros(keys.shape[0], dtype=np.int64)
+        positions = np.searchsorted(self._sorted_keys, keys)
+        positions = np.minimum(positions, self._sorted_keys.shape[0] - 1)
+        return self._sorted_keys[positions] == keys, self._order[positions]
+
+    def _read_pending(self, row: int) -> np.ndarray:
+        size = self.dimension * 4
+        data = os.pread(self._pending_vectors.fileno(), size, row * size)
+        return np.frombuffer(data, dtype=np.float32).copy()
+
+    def get_many(self, texts: List[str]):
+        """Devuelve (vectores, índices_faltantes); vectores[i] es None si no está en caché."""
+        vectors, missing = [None] * len(texts), []
+        keys = np.array([cache_key(text, self.model_name) for text in texts], dtype="S16")
+        found, rows = self._find_on_disk(keys)
+        if self._pending_rows:
+            self._pending_vectors.flush()
+        now = int(time.time())
+        for i in range(len(texts)):
+            if found[i]:
+                vectors[i] = np.array(self._vectors[rows[i]], dtype=np.float32)
+                self._last_used[rows[i]] = now
+            elif bytes(keys[i]) in self._pending_rows:
+                vectors[i] = self._read_pending(self._pending_rows[bytes(keys[i])])
+            else:
+                missing.append(i)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return vectors, missing
+
+    def put_many(self, texts: List[str], vectors: np.ndarray) -> None:
+        """Añade los vectores nuevos al final de los ficheros pendientes.
+
+        Se omiten las claves que ya están en disco, entre los pendientes o
+        repetidas en el propio lote.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape[0] == 0:
+            return
+        keys = np.array([cache_key(text, self.model_name) for text in texts], dtype="S16")
+        on_disk, _ = self._find_on_disk(keys)
+        new_rows = []
+        for i, key in enumerate(keys):
+            key = bytes(key)
+            if on_disk[i] or key in self._pending_rows:
+                continue
+            self._pending_rows[key] = self._pending + len(new_rows)
+            new_rows.append(i)
+        if not new_rows:
+            return
+        self.dimension = vectors.shape[1]
+        self._pending_keys.write(keys[new_rows].tobytes())
+        self._pending_vectors.write(vectors[new_rows].tobytes())
+        self._pending += len(new_rows)
+
+    def _discard_pending(self) -> None:
+        self._pending_rows = {}
+        self._pending_keys.close()
+        self._pending_vectors.close()
+        (self.directory / self.PENDING_KEYS_FILE).unlink(missing_ok=True)
+        (self.directory / self.PENDING_VECTORS_FILE).unlink(missing_ok=True)
+
+    def abort(self) -> None:
+        """Descarta los vectores pendientes."""
+        self._discard_pending()
+
+    def save(self) -> None:
+        """Escribe la caché existente más los vectores pendientes, por bloques."""
+        self._pending_keys.close()
+        self._pending_vectors.close()
+        old_rows, rows = self._vectors.shape[0], self._vectors.shape[0] + self._pending
+        if self._pending == 0:
+            if old_rows:
+                save_array(self.directory / LAST_USED_FILE, self._last_used)
+            self._discard_pending()
+            return
+
+        dimension = self.dimension
+        new_keys = np.memmap(self.directory / self.PENDING_KEYS_FILE, dtype="S16", mode="r", shape=(self._pending,))
+        new_vectors = np.memmap(self.directory / self.PENDING_VECTORS_FILE, dtype=np.float32, mode="r",
+                                shape=(self._pending, dimension))
+        old_keys = np.load(self.directory / KEYS_FILE, mmap_mode="r") if old_rows else None
+
+        tmp_keys = self.directory / (KEYS_FILE + ".tmp")
+        tmp_vectors = self.directory / (VECTORS_FILE + ".tmp")
+        keys_out = np.lib.format.open_memmap(tmp_keys, mode="w+", dtype="S16", shape=(rows,))
+        vectors_out = np.lib.format.open_memmap(tmp_vectors, mode="w+", dtype=np.float32, shape=(rows, dimension))
+        for source_keys, source_vectors, offset in ((old_keys, self._vectors, 0), (new_keys, new_vectors, old_rows)):
+            if source_keys is None:
+                continue
+            for start in range(0, source_keys.shape[0], self.block_rows):
+                end = min(start + self.block_rows, source_keys.shape[0])
+                keys_out[offset + start:offset + end] = source_keys[start:end]
+                vectors_out[offset + start:offset + end] = source_vectors[start:end]
+        keys_out.flush()
+        vectors_out.flush()
+        del keys_out, vectors_out, new_keys, new_vectors, old_keys
+        self._vectors = np.empty((0, dimension), dtype=np.float32)  # Suelta el mmap antes de reemplazar
+
+        last_used = np.concatenate([self._last_used, np.full(self._pending, int(time.time()), dtype=np.int64)])
+        os.replace(tmp_keys, self.directory / KEYS_FILE)
+        os.replace(tmp_vectors, self.directory / VECTORS_FILE)
+        save_array(self.directory / LAST_USED_FILE, last_used)
+        self._discard_pending()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento de la caché de embeddings.")
+    parser.add_argument("--compactar", action="store_true",
+                        help="Conserva sólo los vectores de los chunks del almacén actual.")
+    parser.add_argument("--max-entradas", type=int, default=EMBEDDING_CACHE_MAX_ENTRIES,
+                        help="Desaloja las entradas menos usadas por encima de este número.")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache()
+    print(f"📦 Caché de embeddings: {len(cache)} entradas en {cache.directory}")
+
+    keep_texts = None
+    if args.compactar:
+        chunks_dir, _, _ = active_index_dirs()
+        try:
+            keep_texts = list(ChunkStore(chunks_dir).texts())
+        except FileNotFoundError:
+            print(f"❌ No se encontró el almacén de chunks en: {chunks_dir}")
+            return
+
+    if keep_texts is not None or args.max_entradas is not None:
+        removed = cache.compact(keep_texts=keep_texts, max_entries=args.max_entradas)
+        print(f"🧹 Eliminadas {removed} entradas. Quedan {len(cache)}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,135 @@
 from sentence_transformers import SentenceTransformer
 import numpy as np
-import json
-from config.settings import CHUNKS_DIR, EMBEDDINGS_DIR, EMBEDDING_MODEL_NAME
+from pathlib import Path
+from typing import Optional
+from config.settings import (
+    CHUNKS_DIR, EMBEDDINGS_DIR, EMBEDDING_MODEL_NAME, EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CACHE_MAX_ENTRIES, SEARCH_BACKEND, IVF_NLIST, IVF_NPROBE, IVF_MIN_CHUNKS,
+)
+from .chunk_store import ChunkStore, TEXT_OFFSETS_FILE, save_array
+from .embedding_cache import EmbeddingCache
+from .index_manifest import chunk_digest
+from .vector_search import (
+    IVFIndex, IVF_CENTROIDS_FILE, IVF_OFFSETS_FILE, IVF_IDS_FILE,
+    QUANTIZED_BACKENDS, QUANTIZED_FILE, QUANTIZED_SCALES_FILE,
+    save_embeddings, save_quantized_embeddings, load_embeddings, load_index_info,
+)
 
-def run_embedding_generation():
-    """Genera y guarda los embeddings para los chunks."""
+CHUNK_HASHES_FILE = "chunk_hashes.npy"
+
+
+def _load_previous_vectors(previous_dir: Path) -> dict:
+    """Mapa huella de chunk -> vector del índice anterior (vacío si el modelo cambió)."""
+    if load_index_info(previous_dir).get("modelo") != EMBEDDING_MODEL_NAME:
+        return {}
+    try:
+        embeddings, _ = load_embeddings(previous_dir)
+        hashes = np.load(previous_dir / CHUNK_HASHES_FILE)
+    except FileNotFoundError:
+        return {}
+    if hashes.shape[0] != embeddings.shape[0]:
+        return {}
+    return {bytes(h): embeddings[i] for i, h in enumerate(hashes)}
+
+
+def build_ann_index(embeddings: np.ndarray, embeddings_dir: Path = EMBEDDINGS_DIR) -> None:
+    """Construye el índice derivado del backend configurado: IVF (si el corpus lo
+    justifica) o la copia cuantizada de la matriz."""
+    # Eliminar un índice anterior para que nunca quede desalineado con los embeddings
+    for name in (IVF_CENTROIDS_FILE, IVF_OFFSETS_FILE, IVF_IDS_FILE, QUANTIZED_FILE, QUANTIZED_SCALES_FILE):
+        (embeddings_dir / name).unlink(missing_ok=True)
+
+    if SEARCH_BACKEND in QUANTIZED_BACKENDS:
+        print(f"🗜️ Guardando la matriz cuantizada ({SEARCH_BACKEND})...")
+        save_quantized_embeddings(embeddings_dir, embeddings, dtype=SEARCH_BACKEND)
+        return
+    if SEARCH_BACKEND != "ivf":
+        return
+    if len(embeddings) < IVF_MIN_CHUNKS:
+        print(f"ℹ️ Sólo hay {len(embeddings)} chunks (< {IVF_MIN_CHUNKS}). Se usará búsqueda exacta.")
+        return
+
+    print("🗂️ Construyendo índice IVF...")
+    index = IVFIndex.build(embeddings, nlist=IVF_NLIST, nprobe=IVF_NPROBE)
+    index.save(embeddings_dir)
+    print(f"✅ Índice IVF guardado con {index.nlist} clústeres.")
+
+def run_embedding_generation(chunks_dir: Path = CHUNKS_DIR, embeddings_dir: Path = EMBEDDINGS_DIR,
+                             previous_dir: Optional[Path] = None) -> dict:
+    """Genera y guarda en `embeddings_dir` los embeddings de los chunks de `chunks_dir`.
+
+    Es incremental: cada fila del índice guarda la huella del texto de su chunk,
+    así que los chunks que ya estaban en el índice anterior (`previous_dir`, por
+    defecto el propio `embeddings_dir`) reutilizan su vector. Los demás se
+    buscan en la caché persistente de embeddings y sólo los que faltan en ambos
+    se codifican, por lotes.
+    """
+    previous_dir = previous_dir or embeddings_dir
     print(f"🧠 Iniciando generación de embeddings con el modelo: {EMBEDDING_MODEL_NAME}")
+    resumen = {"reutilizados": 0, "desde_cache": 0, "codificados": 0}
     
-    chunks_path = CHUNKS_DIR / "chunks.json"
-    if not chunks_path.exists():
-        print(f"❌ Error: No se encontró el archivo de chunks en: {chunks_path}")
+    if not (chunks_dir / TEXT_OFFSETS_FILE).exists():
+        print(f"❌ Error: No se encontró el almacén de chunks en: {chunks_dir}")
         print("   Por favor, ejecuta primero el proceso de 'chunking'.")
-        return
+        return resumen
 
-    with open(chunks_path, "r", encoding="utf-8") as f:
-        chunks_data = json.load(f)
+    texts = list(ChunkStore(chunks_dir).texts())
+    if not texts:
+        print("⚠️ El almacén de chunks está vacío. No hay nada que indexar.")
+        return resumen
+    hashes = np.array([chunk_digest(text) for text in texts], dtype="S16")
 
-    texts_to_embed = [chunk["text"] for chunk in chunks_data]
-    
-    print(f"📊 Generando embeddings para {len(texts_to_embed)} fragmentos de texto...")
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-    embeddings = model.encode(texts_to_embed, show_progress_bar=True)
+    previous_hashes = None
+    if (embeddings_dir / CHUNK_HASHES_FILE).exists():
+        previous_hashes = np.load(embeddings_dir / CHUNK_HASHES_FILE)
+    if (previous_hashes is not None and np.array_equal(previous_hashes, hashes)
+            and load_index_info(embeddings_dir).get("modelo") == EMBEDDING_MODEL_NAME):
+        resumen["reutilizados"] = len(texts)
+        print("✅ Los chunks no han cambiado. El índice de embeddings está al día.")
+        return resumen
+
+    vectors = [None] * len(texts)
+    previous_vectors = _load_previous_vectors(previous_dir)
+    for row, h in enumerate(hashes):
+        vectors[row] = previous_vectors.get(bytes(h))
+    not_in_index = [i for i, v in enumerate(vectors) if v is None]
+    resumen["reutilizados"] = len(texts) - len(not_in_index)
+
+    cache = EmbeddingCache(EMBEDDING_MODEL_NAME)
+    cached, missing_positions = cache.get_many([texts[i] for i in not_in_index])
+    for i, vector in zip(not_in_index, cached):
+        vectors[i] = vector
+    missing = [not_in_index[p] for p in missing_positions]
+    resumen["desde_cache"] = len(not_in_index) - len(missing)
+    resumen["codificados"] = len(missing)
+
+    print(f"📊 Generando embeddings para {len(missing)} de {len(texts)} fragmentos de texto "
+          f"({resumen['reutilizados']} reutilizados del índice, {resumen['desde_cache']} desde la caché)...")
+    if missing:
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        new_vectors = model.encode([texts[i] for i in missing], batch_size=EMBEDDING_BATCH_SIZE,
+                                   show_progress_bar=True)
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+
+    embeddings = np.array(vectors, dtype=np.float32)
     
-    # Guardar embeddings y chunks
-    np.save(EMBEDDINGS_DIR / "embeddings.npy", embeddings)
-    with open(EMBEDDINGS_DIR / "chunks_metadata.json", "w", encoding="utf-8") as f:
-        json.dump(chunks_data, f, ensure_ascii=False, indent=2)
+    # Guardar embeddings normalizados, listos para mmap. Los chunks no se duplican:
+    # el RAG los lee directamente del almacén de chunks.
+    embeddings = save_embeddings(embeddings_dir, embeddings, modelo=EMBEDDING_MODEL_NAME)
+    save_array(embeddings_dir / CHUNK_HASHES_FILE, hashes)
+
+    # Todos los vectores del índice quedan en la caché para futuras reingestas
+    cache.put_many(texts, embeddings)
+    if EMBEDDING_CACHE_MAX_ENTRIES is not None:
+        cache.compact(max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+    cache.save()
+
+    build_ann_index(embeddings, embeddings_dir)
         
-    print(f"✅ Embeddings guardados en: {EMBEDDINGS_DIR / 'embeddings.npy'}")
-    print(f"✅ Metadatos de chunks guardados en: {EMBEDDINGS_DIR / 'chunks_metadata.json'}")
+    print(f"✅ Embeddings guardados en: {embeddings_dir / 'embeddings.npy'}")
     print("🏁 Generación de embeddings finalizada.")
+    return resumen
 
 if __name__ == '__main__':
     run_embedding_generation()
\ No newline at end of file
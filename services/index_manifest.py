@@ -0,0 +1,46 @@
+"""
+Manifiestos de la reindexación incremental.
+Guardan los hashes de contenido de cada etapa (PDF, texto limpio, chunks) para
+que una reindexación sólo reprocese lo que ha cambiado.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MANIFEST_FILE = "manifest.json"
+
+
+def file_sha256(path: Path) -> str:
+    """Hash SHA-256 del contenido de un fichero, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_digest(text: str) -> bytes:
+    """Huella compacta (16 bytes) del texto de un chunk, para guardarla como columna NumPy."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def load_manifest(directory: Path) -> dict:
+    """Carga el manifiesto de un directorio, o uno vacío si no existe o está dañado."""
+    try:
+        with open(directory / MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(directory: Path, manifest: dict) -> None:
+    tmp_path = directory / (MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, directory / MANIFEST_FILE)
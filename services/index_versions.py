@@ -0,0 +1,80 @@
+"""
+Versiones del índice de conocimiento.
+Cada reindexación en segundo plano construye un directorio nuevo en
+`embeddings/versiones/<versión>/` (almacén de chunks + embeddings + IVF) y, al
+terminar, lo publica reescribiendo de forma atómica el puntero `embeddings/ACTUAL`.
+Los servicios RAG comprueban el puntero y cambian de índice sin reiniciarse.
+
+Si no existe el puntero se usa la disposición clásica: `chunks/` + `embeddings/`.
+"""
+
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+from config.settings import CHUNKS_DIR, EMBEDDINGS_DIR, INDEX_VERSIONS_DIR, INDEX_VERSIONS_TO_KEEP
+
+CURRENT_POINTER = EMBEDDINGS_DIR / "ACTUAL"
+
+
+def active_version() -> Optional[str]:
+    """Nombre de la versión publicada, o None si se usa la disposición clásica."""
+    try:
+        name = CURRENT_POINTER.read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    if name and (INDEX_VERSIONS_DIR / name).is_dir():
+        return name
+    return None
+
+
+def active_index_dirs() -> Tuple[Path, Path, Optional[str]]:
+    """Devuelve (directorio de chunks, directorio de embeddings, versión) del índice activo."""
+    version = active_version()
+    if version is None:
+        return CHUNKS_DIR, EMBEDDINGS_DIR, None
+    version_dir = INDEX_VERSIONS_DIR / version
+    return version_dir, version_dir, version
+
+
+def pointer_mtime() -> int:
+    """Marca de modificación del puntero (0 si no existe), para detectar cambios baratamente."""
+    try:
+        return CURRENT_POINTER.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def create_version_dir() -> Tuple[str, Path]:
+    """Crea un directorio vacío para una nueva versión del índice."""
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+    version_dir = INDEX_VERSIONS_DIR / version
+    version_dir.mkdir(parents=True, exist_ok=False)
+    return version, version_dir
+
+
+def publish_version(version: str) -> None:
+    """Publica una versión de forma atómica y elimina las versiones antiguas."""
+    tmp_path = CURRENT_POINTER.with_name(CURRENT_POINTER.name + ".tmp")
+    tmp_path.write_text(version, encoding="utf-8")
+    os.replace(tmp_path, CURRENT_POINTER)
+    _remove_old_versions(keep=version)
+
+
+def discard_version(version: str) -> None:
+    shutil.rmtree(INDEX_VERSIONS_DIR / version, ignore_errors=True)
+
+
+def _remove_old_versions(keep: str) -> None:
+    """Conserva las INDEX_VERSIONS_TO_KEEP versiones más recientes.
+
+    La anterior a la activa puede seguir abierta (mmap) en otros workers hasta
+    que detecten el cambio, por eso no se borra nunca sólo la activa.
+    """
+    versions = sorted(p.name for p in INDEX_VERSIONS_DIR.iterdir() if p.is_dir())
+    for name in versions[:-max(INDEX_VERSIONS_TO_KEEP, 2)]:
+        if name != keep:
+            # En Windows un fichero mapeado no se puede borrar: se reintentará en la próxima publicación
+            shutil.rmtree(INDEX_VERSIONS_DIR / name, ignore_errors=True)
@@ -0,0 +1,200 @@
+"""
+Ingesta en streaming: PDF -> páginas limpias -> chunks -> embeddings.
+
+A diferencia del pipeline por etapas (process_pdfs -> chunking -> embeddings),
+aquí no se materializa ningún fichero con el corpus completo: las páginas fluyen
+como generadores por la limpieza y el troceado, y los chunks se codifican y se
+añaden al almacén en lotes de STREAMING_BATCH_SIZE. Los vectores nuevos van a la
+caché en disco lote a lote (AppendOnlyEmbeddingCache) y las listas de BM25 se
+vuelcan a tandas en disco (STREAMING_BM25_MAX_POSTINGS), así que la memoria
+máxima depende del tamaño de lote, no del tamaño del corpus.
+
+Si un PDF falla a mitad de lectura, sus chunks ya añadidos se descartan: el
+documento queda fuera del índice, igual que en el pipeline por etapas.
+
+Ejecutar: python -m services.ingestion
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Tuple, Union
+
+import numpy as np
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from sentence_transformers import SentenceTransformer
+
+from config.settings import (
+    DATA_DIR, CHUNKS_DIR, EMBEDDINGS_DIR, CHUNK_SIZE, CHUNK_OVERLAP,
+    EMBEDDING_MODEL_NAME, EMBEDDING_BATCH_SIZE, STREAMING_BATCH_SIZE, STREAMING_SPLIT_WINDOW,
+    STREAMING_BM25_MAX_POSTINGS,
+)
+from .chunk_store import ChunkStoreWriter, save_array
+from .embedding_cache import AppendOnlyEmbeddingCache
+from .embeddings import CHUNK_HASHES_FILE, build_ann_index
+from .index_manifest import chunk_digest, save_manifest
+from .process_pdfs import iter_clean_pages
+from .sparse_index import SparseIndexWriter
+from .vector_search import EmbeddingsWriter, load_embeddings
+
+
+def iter_document_chunks(pages: Iterable[str], splitter: RecursiveCharacterTextSplitter,
+                         window: int = STREAMING_SPLIT_WINDOW) -> Iterator[str]:
+    """Trocea un documento página a página.
+
+    Se acumula texto hasta `window` caracteres, se trocea y se emiten todos los
+    chunks salvo el último, que pasa a ser el inicio del siguiente bloque. Así el
+    solapamiento entre chunks se conserva sin cargar el documento entero.
+    """
+    buffer = ""
+    for page in pages:
+        buffer = f"{buffer} {page}" if buffer else page
+        if len(buffer) >= window:
+            pieces = splitter.split_text(buffer)
+            yield from pieces[:-1]
+            buffer = pieces[-1] if pieces else ""
+    if buffer:
+        yield from splitter.split_text(buffer)
+
+
+class DocumentoFallido(NamedTuple):
+    """Marca emitida por iter_corpus_chunks cuando un documento falla a mitad de lectura."""
+    source: str
+    chunks: int   # Chunks de ese documento ya emitidos, que hay que descartar
+
+
+def iter_corpus_chunks(splitter: RecursiveCharacterTextSplitter,
+                       text_hashes: dict) -> Iterator[Union[Tuple[str, str, int], DocumentoFallido]]:
+    """Genera (texto, documento, chunk_id) para todos los PDFs de DATA_DIR.
+
+    Si un documento falla después de emitir parte de sus chunks, se emite un
+    DocumentoFallido para que el consumidor los descarte.
+
+    Rellena `text_hashes` con el hash del texto limpio de cada documento, igual
+    al que calcula el pipeline por etapas, para que el manifiesto de chunks
+    siga siendo válido para una reindexación incremental posterior.
+    """
+    for pdf_path in sorted(DATA_DIR.glob("*.pdf")):
+        source = f"{pdf_path.stem}.txt"
+        digest = hashlib.sha256()
+
+        def pages_with_hash():
+            for i, page in enumerate(iter_clean_pages(pdf_path)):
+                digest.update(((" " if i else "") + page).encode("utf-8"))
+                yield page
+
+        print(f"📄 Procesando en streaming: {pdf_path.name}")
+        emitted = 0
+        try:
+            for chunk_id, text in enumerate(iter_document_chunks(pages_with_hash(), splitter)):
+                yield text, source, chunk_id
+                emitted += 1
+        except Exception as e:
+            print(f"❌ Error al leer {pdf_path.name}: {e}")
+            if emitted:
+                yield DocumentoFallido(source, emitted)
+            continue
+        text_hashes[source] = digest.hexdigest()
+
+
+def run_streaming_ingestion(chunks_dir: Path = CHUNKS_DIR, embeddings_dir: Path = EMBEDDINGS_DIR) -> dict:
+    """Reconstruye chunks y embeddings en streaming, con memoria acotada por lote."""
+    print("🌊 Iniciando ingesta en streaming...")
+    resumen = {"chunks": 0, "desde_cache": 0, "codificados": 0}
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    cache = AppendOnlyEmbeddingCache(EMBEDDING_MODEL_NAME)
+    model = None
+    text_hashes = {}
+    digests = bytearray()
+    pending = []   # Textos añadidos al almacén cuyo embedding aún no se ha calculado
+
+    chunk_writer = ChunkStoreWriter(chunks_dir)
+    embeddings_writer = EmbeddingsWriter(embeddings_dir)
+    sparse_writer = SparseIndexWriter(spill_dir=chunks_dir / "bm25_tandas.tmp",
+                                      max_postings=STREAMING_BM25_MAX_POSTINGS)
+
+    def encode_pending():
+        nonlocal model
+        vectors, missing = cache.get_many(pending)
+        if missing:
+            if model is None:
+                model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+            encoded = model.encode([pending[i] for i in missing], batch_size=EMBEDDING_BATCH_SIZE)
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+            cache.put_many([pending[i] for i in missing], encoded)
+
+        embeddings_writer.append(np.array(vectors, dtype=np.float32))
+        resumen["desde_cache"] += len(pending) - len(missing)
+        resumen["codificados"] += len(missing)
+        pending.clear()
+        print(f"   … {embeddings_writer.rows} chunks procesados")
+
+    def discard_last(n):
+        """Descarta los últimos `n` chunks añadidos (un documento que ha fallado)."""
+        keep = len(chunk_writer) - n
+        chunk_writer.truncate(keep)
+        sparse_writer.truncate(keep)
+        del digests[keep * 16:]
+        del pending[max(len(pending) - n, 0):]
+        embeddings_writer.truncate(keep - len(pending))
+        print(f"   ↩️ Descartados {n} chunks del documento fallido")
+
+    try:
+        for item in iter_corpus_chunks(splitter, text_hashes):
+            if isinstance(item, DocumentoFallido):
+                discard_last(item.chunks)
+                continue
+            text, source, chunk_id = item
+            if chunk_id == 0:
+                # El documento anterior está completo: ya se puede volcar su BM25
+                sparse_writer.spill_if_full()
+            chunk_writer.add(text, source=source, chunk_id=chunk_id)
+            sparse_writer.add(text)
+            digests += chunk_digest(text)
+            pending.append(text)
+            if len(pending) >= STREAMING_BATCH_SIZE:
+                encode_pending()
+        if pending:
+            encode_pending()
+        resumen["chunks"] = len(chunk_writer)
+    except BaseException:
+        chunk_writer.abort()
+        embeddings_writer.abort()
+        sparse_writer.abort()
+        cache.abort()
+        raise
+
+    if resumen["chunks"] == 0:
+        chunk_writer.abort()
+        embeddings_writer.abort()
+        sparse_writer.abort()
+        cache.save()
+        print(f"⚠️ No se encontró texto en los PDFs de: {DATA_DIR}")
+        return resumen
+
+    chunk_writer.close()
+    sparse_writer.save(chunks_dir)
+    embeddings_writer.close(modelo=EMBEDDING_MODEL_NAME)
+    save_array(embeddings_dir / CHUNK_HASHES_FILE, np.frombuffer(bytes(digests), dtype="S16"))
+    save_manifest(chunks_dir, {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "documentos": text_hashes,
+    })
+    cache.save()
+
+    embeddings, _ = load_embeddings(embeddings_dir)
+    build_ann_index(embeddings, embeddings_dir)
+
+    print(f"✅ Ingesta en streaming completada: {resumen['chunks']} chunks "
+          f"({resumen['desde_cache']} desde la caché, {resumen['codificados']} codificados)")
+    return resumen
+
+
+if __name__ == '__main__':
+    run_streaming_ingestion()
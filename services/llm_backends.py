@@ -0,0 +1,146 @@
+"""
+Backends de LLM intercambiables para el servicio RAG.
+
+- "gemini": Google Gemini (google.generativeai), el de producción.
+- "fake":   LLM local y determinista que simula la latencia, el streaming y el
+            recuento de tokens, para pruebas de carga y benchmarks sin llamar a Google.
+
+Se elige con LLM_BACKEND en config/settings.py (o la variable de entorno).
+"""
+
+import asyncio
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Optional
+
+from config.settings import (
+    LLM_BACKEND, GOOGLE_API_KEY, LLM_MODEL_NAME,
+    FAKE_LLM_FIRST_TOKEN_MS, FAKE_LLM_TOKENS_PER_SECOND, FAKE_LLM_RESPONSE_TOKENS,
+)
+
+
+class LLMResponse:
+    """Respuesta completa de un backend, con el recuento de tokens si está disponible."""
+
+    def __init__(self, text: str, prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    def usage(self) -> dict:
+        return {"tokens_prompt": self.prompt_tokens, "tokens_respuesta": self.completion_tokens}
+
+
+class LLMBackend(ABC):
+    """Interfaz común: generación síncrona, asíncrona y en streaming."""
+
+    name = "base"
+    label = "LLM"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    @abstractmethod
+    def generate(self, prompt: str) -> LLMResponse:
+        ...
+
+    @abstractmethod
+    async def agenerate(self, prompt: str) -> LLMResponse:
+        ...
+
+    @abstractmethod
+    def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Genera la respuesta por fragmentos de texto (generador asíncrono)."""
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+    label = "Gemini"
+
+    def __init__(self, api_key: str, model_name: str = LLM_MODEL_NAME):
+        super().__init__(model_name)
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    @staticmethod
+    def _response(response) -> LLMResponse:
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            response.text,
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            completion_tokens=getattr(usage, "candidates_token_count", None),
+        )
+
+    def generate(self, prompt: str) -> LLMResponse:
+        return self._response(self.model.generate_content(prompt))
+
+    async def agenerate(self, prompt: str) -> LLMResponse:
+        return self._response(await self.model.generate_content_async(prompt))
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeLLMBackend(LLMBackend):
+    """LLM simulado y determinista.
+
+    La respuesta depende sólo del prompt y tarda first_token_ms más
+    response_tokens / tokens_per_second, igual en las tres variantes.
+    Los tokens del prompt se estiman a razón de 4 caracteres por token.
+    """
+
+    name = "fake"
+    label = "simulado"
+
+    def __init__(self, first_token_ms: float = FAKE_LLM_FIRST_TOKEN_MS,
+                 tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND,
+                 response_tokens: int = FAKE_LLM_RESPONSE_TOKENS):
+        super().__init__("fake")
+        self.first_token_delay = first_token_ms / 1000
+        self.token_delay = 1 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.response_tokens = response_tokens
+
+    def _tokens(self, prompt: str) -> list:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        words = [digest[i:i + 4] for i in range(0, len(digest), 4)]
+        return ["Respuesta simulada"] + [f" {words[i % len(words)]}" for i in range(self.response_tokens - 1)]
+
+    def _response(self, prompt: str) -> LLMResponse:
+        return LLMResponse("".join(self._tokens(prompt)), prompt_tokens=len(prompt) // 4 + 1,
+                           completion_tokens=self.response_tokens)
+
+    def _total_delay(self) -> float:
+        return self.first_token_delay + self.token_delay * max(self.response_tokens - 1, 0)
+
+    def generate(self, prompt: str) -> LLMResponse:
+        time.sleep(self._total_delay())
+        return self._response(prompt)
+
+    async def agenerate(self, prompt: str) -> LLMResponse:
+        await asyncio.sleep(self._total_delay())
+        return self._response(prompt)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.first_token_delay)
+        for i, token in enumerate(self._tokens(prompt)):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield token
+
+
+def create_llm_backend(backend: str = LLM_BACKEND) -> Optional[LLMBackend]:
+    """Crea el backend configurado. Devuelve None si Gemini no tiene clave de API."""
+    if backend == "fake":
+        print("🧪 Usando el LLM simulado (LLM_BACKEND=fake).")
+        return FakeLLMBackend()
+    if backend != "gemini":
+        print(f"⚠️ Backend de LLM desconocido '{backend}'. Usando Gemini.")
+    if not GOOGLE_API_KEY:
+        print("⚠️ ADVERTENCIA: La clave de API de Google (GOOGLE_API_KEY) no está configurada.")
+        return None
+    return GeminiBackend(GOOGLE_API_KEY, LLM_MODEL_NAME)
@@ -0,0 +1,169 @@
+"""
+Segmentos comprimidos e indexados del log de interacciones.
+
+El log activo (logs/interactions.jsonl) se rota por tamaño o antigüedad a
+logs/segments/. Cada segmento es un .jsonl.gz formado por varios miembros gzip
+independientes (bloques de `block_records` registros) y va acompañado de un
+índice pequeño (<segmento>.idx.json):
+
+    {"desde": ts, "hasta": ts, "registros": n, "primer_timestamp": ts,
+     "bloques": [{"offset": o, "bytes": b, "desde": ts, "hasta": ts, "registros": n}, ...]}
+
+Para leer una ventana de tiempo basta con consultar los índices, descartar los
+segmentos y bloques que no se solapan con ella y descomprimir sólo el resto,
+saltando con seek al offset de cada bloque. El índice se escribe el último: un
+segmento sin índice es una rotación interrumpida y se ignora.
+
+"desde" es el timestamp mínimo; "primer_timestamp" es el de la primera línea del
+log de origen (con escrituras concurrentes no tienen por qué coincidir), y es el
+que identifica de qué log activo procede el segmento.
+
+Los timestamps son cadenas ISO 8601 en UTC ("2025-12-04T18:30:45.123456Z") y se
+comparan como texto.
+"""
+
+import gzip
+import json
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+SEGMENT_PREFIX = "interactions-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".idx.json"
+
+
+def _solapa(desde_a: Optional[str], hasta_a: Optional[str],
+            desde: Optional[str], hasta: Optional[str]) -> bool:
+    """¿Se solapa el rango [desde_a, hasta_a] con la ventana [desde, hasta)?"""
+    if desde is not None and hasta_a is not None and hasta_a < desde:
+        return False
+    if hasta is not None and desde_a is not None and desde_a >= hasta:
+        return False
+    return True
+
+
+def en_ventana(timestamp: Optional[str], desde: Optional[str], hasta: Optional[str]) -> bool:
+    """¿Cae el timestamp en la ventana [desde, hasta)? (None = sin límite)"""
+    if desde is None and hasta is None:
+        return True
+    if timestamp is None:
+        return False
+    return (desde is None or timestamp >= desde) and (hasta is None or timestamp < hasta)
+
+
+def _nombre_segmento(segments_dir: Path, primer_timestamp: Optional[str]) -> Path:
+    sello = re.sub(r"[^0-9T]", "", primer_timestamp or "") or "sin-fecha"
+    ruta = segments_dir / f"{SEGMENT_PREFIX}{sello}{SEGMENT_SUFFIX}"
+    n = 1
+    while ruta.exists() or Path(str(ruta) + INDEX_SUFFIX).exists():
+        ruta = segments_dir / f"{SEGMENT_PREFIX}{sello}-{n}{SEGMENT_SUFFIX}"
+        n += 1
+    return ruta
+
+
+def write_segment(source: Path, segments_dir: Path, block_records: int = 1000) -> Optional[Path]:
+    """Comprime `source` (JSONL) en un segmento nuevo con su índice. Devuelve su ruta.
+
+    No modifica `source`; quien rota decide cuándo borrarlo.
+    """
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    bloques = []
+    pendientes: List[bytes] = []
+    rango = [None, None]
+    primer_timestamp = None
+    primera = True
+
+    def cerrar_bloque(destino):
+        if not pendientes:
+            return
+        offset = destino.tell()
+        destino.write(gzip.compress(b"".join(pendientes)))
+        bloques.append({"offset": offset, "bytes": destino.tell() - offset,
+                        "desde": rango[0], "hasta": rango[1], "registros": len(pendientes)})
+        pendientes.clear()
+        rango[0] = rango[1] = None
+
+    tmp = segments_dir / (source.name + ".tmp.gz")
+    with open(source, "rb") as origen, open(tmp, "wb") as destino:
+        for linea in origen:
+            if not linea.strip():
+                continue
+            if not linea.endswith(b"\n"):
+                linea += b"\n"
+            try:
+                timestamp = json.loads(linea).get("timestamp")
+            except (json.JSONDecodeError, AttributeError):
+                continue
+            if primera:
+                primer_timestamp, primera = timestamp, False
+            pendientes.append(linea)
+            if timestamp is not None:
+                rango[0] = timestamp if rango[0] is None else min(rango[0], timestamp)
+                rango[1] = timestamp if rango[1] is None else max(rango[1], timestamp)
+            if len(pendientes) >= block_records:
+                cerrar_bloque(destino)
+        cerrar_bloque(destino)
+        destino.flush()
+        os.fsync(destino.fileno())
+
+    if not bloques:
+        tmp.unlink()
+        return None
+
+    desdes = [b["desde"] for b in bloques if b["desde"] is not None]
+    hastas = [b["hasta"] for b in bloques if b["hasta"] is not None]
+    indice = {
+        "desde": min(desdes) if desdes else None,
+        "hasta": max(hastas) if hastas else None,
+        "registros": sum(b["registros"] for b in bloques),
+        "primer_timestamp": primer_timestamp,
+        "bloques": bloques,
+    }
+    ruta = _nombre_segmento(segments_dir, indice["desde"])
+    os.replace(tmp, ruta)
+    ruta_indice = Path(str(ruta) + INDEX_SUFFIX)
+    with open(str(ruta_indice) + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(indice, f)
+    os.replace(str(ruta_indice) + ".tmp", ruta_indice)
+    return ruta
+
+
+def list_segments(segments_dir: Path) -> List[dict]:
+    """Índices de los segmentos completos, del más antiguo al más reciente (con su "ruta")."""
+    if not segments_dir.exists():
+        return []
+    segmentos = []
+    for ruta_indice in segments_dir.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}{INDEX_SUFFIX}"):
+        try:
+            with open(ruta_indice, "r", encoding="utf-8") as f:
+                indice = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        indice["ruta"] = str(ruta_indice)[:-len(INDEX_SUFFIX)]
+        segmentos.append(indice)
+    segmentos.sort(key=lambda s: (s.get("desde") or "", s["ruta"]))
+    return segmentos
+
+
+def iter_segment(segmento: dict, desde: Optional[str] = None, hasta: Optional[str] = None) -> Iterator[dict]:
+    """Registros de un segmento dentro de la ventana, descomprimiendo sólo los bloques necesarios."""
+    with open(segmento["ruta"], "rb") as f:
+        for bloque in segmento["bloques"]:
+            if not _solapa(bloque["desde"], bloque["hasta"], desde, hasta):
+                continue
+            f.seek(bloque["offset"])
+            datos = zlib.decompress(f.read(bloque["bytes"]), wbits=31)
+            for linea in datos.splitlines():
+                registro = json.loads(linea)
+                if en_ventana(registro.get("timestamp"), desde, hasta):
+                    yield registro
+
+
+def iter_segments(segments_dir: Path, desde: Optional[str] = None, hasta: Optional[str] = None) -> Iterator[dict]:
+    """Registros de todos los segmentos que se solapan con la ventana, en orden."""
+    for segmento in list_segments(segments_dir):
+        if _solapa(segmento.get("desde"), segmento.get("hasta"), desde, hasta):
+            yield from iter_segment(segmento, desde, hasta)
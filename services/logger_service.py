@@ -1,13 +1,40 @@
 """
 Logger service para registrar interacciones del chatbot en formato JSON.
 Guarda cada consulta RAG y acción del agente en logs/interactions.jsonl
+
+Las interacciones se escriben de forma diferida (ver write_behind): se encolan
+y un hilo de fondo las vuelca por lotes, fuera de la latencia de la petición.
+
+Cuando el log activo supera LOG_ROTATE_MAX_MB o LOG_ROTATE_MAX_HOURS se renombra
+a logs/interactions.jsonl.rotating-<fecha> y se empieza uno nuevo. Sólo el
+renombrado va en el camino de escritura; la compresión a un segmento indexado de
+logs/segments/ (ver log_segments) la hace un hilo aparte, y mientras tanto los
+lectores leen también los rotados pendientes.
+
+Con varios procesos (workers) escribiendo en logs/, las escrituras toman un flock
+compartido sobre logs/interactions.lock y el renombrado uno exclusivo: nadie
+escribe en el fichero que se está rotando y dos procesos no rotan el mismo log a
+la vez. La compresión toma logs/segments.lock, así que cada rotado pendiente lo
+comprime un solo proceso.
 """
 
 import json
 import logging
+import os
+import threading
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+from config.settings import LOG_ROTATE_MAX_MB, LOG_ROTATE_MAX_HOURS, LOG_SEGMENT_BLOCK_RECORDS
+from .log_segments import en_ventana, iter_segments, list_segments, write_segment
+from .write_behind import escribir, vaciar
 
 # Configurar directorio de logs
 LOGS_DIR = Path(__file__).resolve().parent.parent / "logs"
@@ -16,6 +43,12 @@ LOGS_DIR.mkdir(exist_ok=True)
 # Archivo de interacciones
 INTERACTIONS_LOG = LOGS_DIR / "interactions.jsonl"
 
+# Segmentos rotados y comprimidos del log de interacciones
+SEGMENTS_DIR = LOGS_DIR / "segments"
+_ROTATING_LOG = LOGS_DIR / "interactions.jsonl.rotating"
+_LOCK_FILE = LOGS_DIR / "interactions.lock"
+_SEGMENTS_LOCK_FILE = LOGS_DIR / "segments.lock"
+
 # Archivo de errores
 ERRORS_LOG = LOGS_DIR / "errors.log"
 
@@ -68,13 +101,169 @@ def log_interaction(
     }
     
     try:
-        with open(INTERACTIONS_LOG, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        escribir(_anexar_registros, INTERACTIONS_LOG, json.dumps(record, ensure_ascii=False) + "\n")
         logger.info(f"[{endpoint}] Usuario: {usuario_id} | Latencia: {latencia_ms:.0f}ms")
     except Exception as e:
         logger.error(f"Error al registrar interacción: {e}")
 
 
+@contextmanager
+def _bloqueo_log(exclusivo: bool):
+    """flock sobre logs/interactions.lock: compartido para escribir, exclusivo para rotar."""
+    with open(_LOCK_FILE, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+_barrido_pendiente = True   # Al primer lote del proceso se comprimen los rotados que quedaran
+
+
+def _anexar_registros(ruta: Path, lineas: List[str]) -> list:
+    """Añade un lote de registros ya serializados con una sola escritura."""
+    global _barrido_pendiente
+    comprimir, _barrido_pendiente = _barrido_pendiente, False
+    if _debe_rotar(ruta):
+        try:
+            with _bloqueo_log(exclusivo=True):
+                # Otro proceso puede haber rotado mientras esperábamos el bloqueo
+                if _debe_rotar(ruta):
+                    comprimir = _renombrar_activo() is not None or comprimir
+        except Exception as e:
+            # Si la rotación falla, el lote se escribe igualmente en el log activo
+            logger.error(f"Error al rotar el log de interacciones: {e}")
+    with _bloqueo_log(exclusivo=False), open(ruta, "a", encoding="utf-8") as f:
+        f.write("".join(lineas))
+    if comprimir and _rotados_pendientes():
+        threading.Thread(target=_comprimir_en_segundo_plano, name="log-segments", daemon=True).start()
+    return [str(ruta)]
+
+
+def _debe_rotar(ruta: Path) -> bool:
+    try:
+        if ruta.stat().st_size >= LOG_ROTATE_MAX_MB * 2**20:
+            return True
+        with open(ruta, "r", encoding="utf-8") as f:
+            primera = f.readline()
+        inicio = datetime.fromisoformat(json.loads(primera)["timestamp"].rstrip("Z"))
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+    return (datetime.utcnow() - inicio).total_seconds() >= LOG_ROTATE_MAX_HOURS * 3600
+
+
+def rotate_interactions_log() -> Optional[Path]:
+    """
+    Comprime el log activo en un segmento nuevo de logs/segments/ y lo vacía.
+    También comprime los rotados que estuvieran pendientes. Espera a terminar.
+
+    Returns:
+        Ruta del último segmento creado (None si no había registros)
+    """
+    with _bloqueo_log(exclusivo=True):
+        _renombrar_activo()
+    return _comprimir_pendientes(esperar=True)
+
+
+def _renombrar_activo() -> Optional[Path]:
+    """Aparta el log activo como rotado pendiente; quien llama tiene el bloqueo exclusivo."""
+    if not INTERACTIONS_LOG.exists():
+        return None
+    sello = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    destino = _ROTATING_LOG.with_name(f"{_ROTATING_LOG.name}-{sello}-{os.getpid()}")
+    # Las escrituras siguientes ya van a un interactions.jsonl nuevo
+    INTERACTIONS_LOG.replace(destino)
+    return destino
+
+
+def _rotados_pendientes() -> List[Path]:
+    """Logs rotados que aún no se han comprimido, del más antiguo al más reciente."""
+    return sorted(LOGS_DIR.glob(_ROTATING_LOG.name + "*"))
+
+
+def _comprimir_pendientes(esperar: bool) -> Optional[Path]:
+    """Comprime los rotados pendientes en segmentos. Sin `esperar`, no hace nada si otro ya lo hace."""
+    segmento = None
+    with open(_SEGMENTS_LOCK_FILE, "a") as bloqueo:
+        if fcntl is not None:
+            try:
+                fcntl.flock(bloqueo.fileno(), fcntl.LOCK_EX | (0 if esperar else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return None
+        try:
+            for rotado in _rotados_pendientes():
+                nuevo = write_segment(rotado, SEGMENTS_DIR, LOG_SEGMENT_BLOCK_RECORDS)
+                rotado.unlink(missing_ok=True)
+                if nuevo is not None:
+                    segmento = nuevo
+                    logger.info(f"Log de interacciones rotado a {segmento.name}")
+        finally:
+            if fcntl is not None:
+                fcntl.flock(bloqueo.fileno(), fcntl.LOCK_UN)
+    return segmento
+
+
+def _comprimir_en_segundo_plano() -> None:
+    try:
+        _comprimir_pendientes(esperar=False)
+    except Exception as e:
+        # Los rotados siguen en logs/ (y se leen desde ahí); se reintentará en la próxima rotación
+        logger.error(f"Error al comprimir el log de interacciones rotado: {e}")
+
+
+def _como_timestamp(valor: Union[str, datetime, None]) -> Optional[str]:
+    """Convierte un datetime (UTC) al formato de los registros; las cadenas se dejan igual."""
+    if isinstance(valor, datetime):
+        return valor.replace(tzinfo=None).isoformat() + "Z"
+    return valor
+
+
+def iter_interactions(
+    desde: Union[str, datetime, None] = None,
+    hasta: Union[str, datetime, None] = None
+) -> Iterator[dict]:
+    """
+    Recorre las interacciones en orden: primero los segmentos rotados y después el log activo.
+    Con una ventana [desde, hasta) sólo se descomprimen los bloques que la solapan.
+
+    Args:
+        desde: Timestamp ISO (UTC) o datetime inicial, incluido (None = sin límite)
+        hasta: Timestamp ISO (UTC) o datetime final, excluido (None = sin límite)
+    """
+    desde, hasta = _como_timestamp(desde), _como_timestamp(hasta)
+    vaciar()
+    # Los rotados pendientes se abren antes de listar los segmentos: si uno se
+    # comprime (y se borra) mientras tanto, se sigue leyendo desde el fichero abierto
+    with ExitStack() as abiertos:
+        ficheros = []
+        for ruta in _rotados_pendientes():
+            try:
+                ficheros.append(abiertos.enter_context(open(ruta, "r", encoding="utf-8")))
+            except FileNotFoundError:
+                continue
+        yield from iter_segments(SEGMENTS_DIR, desde, hasta)
+        try:
+            ficheros.append(abiertos.enter_context(open(INTERACTIONS_LOG, "r", encoding="utf-8")))
+        except FileNotFoundError:
+            pass
+        for f in ficheros:
+            for line in f:
+                try:
+                    registro = json.loads(line.strip())
+                except json.JSONDecodeError:
+                    continue
+                if en_ventana(registro.get("timestamp"), desde, hasta):
+                    yield registro
+
+
+def list_interaction_segments() -> List[dict]:
+    """Índices de los segmentos rotados (rango de tiempo, nº de registros, bloques)."""
+    return list_segments(SEGMENTS_DIR)
+
+
 def log_error(
     endpoint: str,
     usuario_id: str,
@@ -93,29 +282,28 @@ def log_error(
     logger.error(f"[{endpoint}] User: {usuario_id} | Type: {error_type} | Message: {error_message}")
 
 
-def read_interactions_log(limit: Optional[int] = None) -> list:
+def read_interactions_log(
+    limit: Optional[int] = None,
+    desde: Union[str, datetime, None] = None,
+    hasta: Union[str, datetime, None] = None
+) -> list:
     """
-    Lee el archivo de interacciones y devuelve lista de registros JSON.
+    Lee las interacciones (segmentos rotados y log activo) y devuelve lista de registros JSON.
     
     Args:
         limit: Número máximo de registros a leer (None = todos)
+        desde: Sólo registros con timestamp >= desde (ISO UTC o datetime)
+        hasta: Sólo registros con timestamp < hasta (ISO UTC o datetime)
     
     Returns:
         Lista de diccionarios con interacciones
     """
     records = []
-    if not INTERACTIONS_LOG.exists():
-        return records
-    
     try:
-        with open(INTERACTIONS_LOG, "r", encoding="utf-8") as f:
-            for i, line in enumerate(f):
-                if limit and i >= limit:
-                    break
-                try:
-                    records.append(json.loads(line.strip()))
-                except json.JSONDecodeError:
-                    pass
+        for record in iter_interactions(desde, hasta):
+            if limit and len(records) >= limit:
+                break
+            records.append(record)
     except Exception as e:
         logger.error(f"Error al leer logs: {e}")
     
@@ -0,0 +1,93 @@
+"""
+Micro-batching de peticiones concurrentes.
+
+Con varias consultas simultáneas, codificar cada pregunta por separado (lotes de
+uno) desaprovecha la CPU. El MicroBatcher agrupa los elementos que llegan en una
+ventana de pocos milisegundos, los procesa con una sola llamada y resuelve el
+futuro de cada llamante con su resultado.
+
+Si sólo llega una petición, espera como mucho `max_wait_ms` antes de procesarla.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """Agrupa elementos y los procesa en lotes en un hilo dedicado.
+
+    `process_batch` recibe una lista de elementos y debe devolver una lista de
+    resultados del mismo tamaño y en el mismo orden.
+    """
+
+    def __init__(self, process_batch: Callable[[List], List],
+                 max_batch_size: int = 32, max_wait_ms: float = 3.0, name: str = "micro-batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Encola un elemento; el futuro se resuelve cuando se procese su lote."""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def close(self) -> None:
+        """Procesa lo pendiente y detiene el hilo."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "lotes": self.batches,
+            "elementos": self.items,
+            "tamano_medio_lote": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def _collect(self, first) -> tuple:
+        """Reúne un lote a partir del primer elemento. Devuelve (lote, parar)."""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stop = self._collect(first)
+
+            # Un llamante puede haber cancelado su futuro mientras esperaba
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.process_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -1,50 +1,302 @@
+"""
+Perfiles de usuario y su historial de conversaciones.
+
+Cada usuario tiene tres ficheros en data/perfiles/:
+- <usuario>.json    cabecera del perfil (usuario_id, fecha_creacion)
+- <usuario>.jsonl   historial append-only, un turno por línea
+- <usuario>.idx     índice en disco: offset (int64) del inicio de cada turno en el .jsonl
+
+Añadir un turno es una única escritura al final de cada fichero, con coste
+constante sea cual sea la longitud del historial. Las escrituras de un mismo
+usuario se serializan con un cerrojo por usuario (y flock entre procesos, si
+el sistema lo admite). Los perfiles antiguos, con las conversaciones dentro del
+.json, se migran automáticamente la primera vez que se usan.
+"""
+
 import os
 import json
+import shutil
+import threading
+from array import array
 from datetime import datetime
 
+from .write_behind import escribir, vaciar
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo cerrojo dentro del proceso
+    fcntl = None
+
 PERFILES_PATH = "data/perfiles"
 
-def cargar_perfil(usuario_id):
-    """
-    Carga el perfil del usuario desde JSON.
-    Si no existe, lo crea con estructura inicial.
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _ruta(usuario_id, extension):
+    return os.path.join(PERFILES_PATH, f"{usuario_id}{extension}")
+
+
+def _lock_usuario(usuario_id):
+    with _locks_guard:
+        if usuario_id not in _locks:
+            _locks[usuario_id] = threading.Lock()
+        return _locks[usuario_id]
+
+
+class _BloqueoArchivo:
+    """flock exclusivo sobre un fichero abierto (no hace nada si no hay fcntl)."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self.f
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+
+
+def _escribir_json_atomico(ruta, datos):
+    tmp = ruta + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=4, ensure_ascii=False)
+    os.replace(tmp, ruta)
+
+
+def _migrar_perfil_antiguo(usuario_id):
+    """Pasa las conversaciones de un perfil antiguo (.json completo) al historial append-only.
+
+    Se conserva una copia del fichero original como <usuario>.json.bak.
     """
+    ruta = _ruta(usuario_id, ".json")
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            perfil = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    if "conversaciones" not in perfil:
+        return
+
+    shutil.copyfile(ruta, ruta + ".bak")
+    _reescribir_historial(usuario_id, perfil.pop("conversaciones") or [])
+    _escribir_json_atomico(ruta, perfil)
+    print(f"📦 Perfil de {usuario_id} migrado al historial append-only.")
+
+
+def _reescribir_historial(usuario_id, conversaciones):
+    """Sustituye el historial completo (sólo para migraciones y guardar_perfil)."""
+    offsets = array("q")
+    tmp_log, tmp_idx = _ruta(usuario_id, ".jsonl.tmp"), _ruta(usuario_id, ".idx.tmp")
+    with open(tmp_log, "wb") as f:
+        for turno in conversaciones:
+            offsets.append(f.tell())
+            f.write((json.dumps(turno, ensure_ascii=False) + "\n").encode("utf-8"))
+    with open(tmp_idx, "wb") as f:
+        f.write(offsets.tobytes())
+    os.replace(tmp_log, _ruta(usuario_id, ".jsonl"))
+    os.replace(tmp_idx, _ruta(usuario_id, ".idx"))
+
+
+def _asegurar_perfil(usuario_id):
+    """Crea la cabecera del perfil si no existe y migra el formato antiguo. Devuelve la cabecera."""
     os.makedirs(PERFILES_PATH, exist_ok=True)
-    ruta = os.path.join(PERFILES_PATH, f"{usuario_id}.json")
+    ruta = _ruta(usuario_id, ".json")
+    if os.path.exists(ruta) and not os.path.exists(_ruta(usuario_id, ".jsonl")):
+        _migrar_perfil_antiguo(usuario_id)
 
     if not os.path.exists(ruta):
-        perfil = {
+        cabecera = {
             "usuario_id": usuario_id,
-            "fecha_creacion": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "conversaciones": []
+            "fecha_creacion": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
-        guardar_perfil(usuario_id, perfil)
-    else:
-        with open(ruta, "r", encoding="utf-8") as f:
-            perfil = json.load(f)
+        _escribir_json_atomico(ruta, cabecera)
+        open(_ruta(usuario_id, ".jsonl"), "ab").close()
+        return cabecera
+
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
 
+
+def _leer_indice(usuario_id):
+    """Offsets de los turnos. Si el índice quedó incompleto (p. ej. una caída entre
+    las dos escrituras de un turno), se reconstruye recorriendo el final del historial."""
+    try:
+        log = open(_ruta(usuario_id, ".jsonl"), "rb")
+    except FileNotFoundError:
+        return array("q")
+
+    # Con el historial bloqueado ningún otro proceso puede estar a mitad de un turno
+    with log, _BloqueoArchivo(log):
+        offsets = array("q")
+        try:
+            with open(_ruta(usuario_id, ".idx"), "rb") as f:
+                datos = f.read()
+            offsets.frombytes(datos[:len(datos) - len(datos) % offsets.itemsize])
+        except FileNotFoundError:
+            pass
+
+        tamano = os.fstat(log.fileno()).st_size
+        inicio = offsets[-1] if offsets else 0
+        log.seek(inicio)
+        if offsets:
+            log.readline()
+        if log.tell() == tamano:
+            return offsets
+
+        # Índice desalineado: reconstruir desde el último offset conocido
+        offsets = offsets[:-1] if offsets else array("q")
+        log.seek(inicio)
+        while True:
+            posicion = log.tell()
+            linea = log.readline()
+            if not linea:
+                break
+            if linea.endswith(b"\n"):
+                offsets.append(posicion)
+        with open(_ruta(usuario_id, ".idx"), "wb") as f:
+            f.write(offsets.tobytes())
+    return offsets
+
+
+def _descartar_linea_incompleta(log):
+    """Recorta una última línea a medias (escritura interrumpida). Devuelve el tamaño final."""
+    tamano = log.seek(0, os.SEEK_END)
+    if tamano == 0:
+        return 0
+    log.seek(tamano - 1)
+    if log.read(1) == b"\n":
+        return tamano
+
+    inicio = max(0, tamano - 65536)
+    while True:
+        log.seek(inicio)
+        fin_linea = log.read(tamano - inicio).rfind(b"\n")
+        if fin_linea >= 0 or inicio == 0:
+            break
+        inicio = max(0, inicio - 65536)
+    log.truncate(inicio + fin_linea + 1)
+    return log.seek(0, os.SEEK_END)
+
+
+def contar_conversaciones(usuario_id):
+    """Número de turnos del historial, sin leerlo."""
+    vaciar()
+    with _lock_usuario(usuario_id):
+        _asegurar_perfil(usuario_id)
+        return len(_leer_indice(usuario_id))
+
+
+def _leer_rango(usuario_id, offsets, inicio, fin):
+    """Lee y decodifica los turnos [inicio, fin) usando los offsets del índice."""
+    total = len(offsets)
+    if inicio >= fin:
+        return []
+    with open(_ruta(usuario_id, ".jsonl"), "rb") as f:
+        f.seek(offsets[inicio])
+        if fin < total:
+            datos = f.read(offsets[fin] - offsets[inicio])
+        else:
+            datos = f.read()
+            datos = datos[:datos.rfind(b"\n") + 1]
+    return [json.loads(linea) for linea in datos.decode("utf-8").splitlines() if linea.strip()]
+
+
+def leer_conversaciones(usuario_id, inicio=0, fin=None):
+    """
+    Devuelve los turnos [inicio, fin) del historial, del más antiguo al más reciente.
+    Sólo se leen del disco los bytes de esos turnos.
+    """
+    vaciar()
+    with _lock_usuario(usuario_id):
+        _asegurar_perfil(usuario_id)
+        offsets = _leer_indice(usuario_id)
+        total = len(offsets)
+        inicio = max(0, min(inicio, total))
+        fin = total if fin is None else max(inicio, min(fin, total))
+        return _leer_rango(usuario_id, offsets, inicio, fin)
+
+
+def leer_pagina(usuario_id, limite, antes=None):
+    """
+    Página del historial empezando por el final: los `limite` turnos anteriores
+    a la posición `antes` (por defecto, los más recientes), del más reciente al más antiguo.
+
+    Devuelve (cabecera, turnos, total, siguiente). Cada turno lleva su posición en
+    "indice"; `siguiente` es el cursor `antes` de la página anterior, o None si no hay más.
+    """
+    vaciar()
+    with _lock_usuario(usuario_id):
+        cabecera = _asegurar_perfil(usuario_id)
+        offsets = _leer_indice(usuario_id)
+        total = len(offsets)
+        fin = total if antes is None else max(0, min(antes, total))
+        inicio = max(0, fin - limite)
+        turnos = _leer_rango(usuario_id, offsets, inicio, fin)
+
+    for indice, turno in enumerate(turnos, start=inicio):
+        turno["indice"] = indice
+    turnos.reverse()
+    return cabecera, turnos, total, (inicio if inicio > 0 else None)
+
+
+def cargar_perfil(usuario_id):
+    """
+    Carga el perfil del usuario con todo su historial.
+    Si no existe, lo crea con estructura inicial.
+    """
+    vaciar()
+    with _lock_usuario(usuario_id):
+        perfil = dict(_asegurar_perfil(usuario_id))
+    perfil["conversaciones"] = leer_conversaciones(usuario_id)
     return perfil
 
 
 def guardar_perfil(usuario_id, perfil):
     """
-    Guarda el perfil del usuario en su archivo JSON.
+    Guarda el perfil del usuario. Si incluye "conversaciones", sustituyen
+    al historial completo.
     """
-    ruta = os.path.join(PERFILES_PATH, f"{usuario_id}.json")
-    with open(ruta, "w", encoding="utf-8") as f:
-        json.dump(perfil, f, indent=4, ensure_ascii=False)
+    vaciar()
+    with _lock_usuario(usuario_id):
+        os.makedirs(PERFILES_PATH, exist_ok=True)
+        perfil = dict(perfil)
+        conversaciones = perfil.pop("conversaciones", None)
+        _escribir_json_atomico(_ruta(usuario_id, ".json"), perfil)
+        if conversaciones is not None:
+            _reescribir_historial(usuario_id, conversaciones)
+
+
+def _anexar_turnos(usuario_id, lineas):
+    """Añade varios turnos ya serializados con una sola escritura en cada fichero."""
+    with _lock_usuario(usuario_id):
+        _asegurar_perfil(usuario_id)
+        with open(_ruta(usuario_id, ".jsonl"), "a+b") as log, _BloqueoArchivo(log):
+            offset = _descartar_linea_incompleta(log)
+            offsets = array("q")
+            for linea in lineas:
+                offsets.append(offset)
+                offset += len(linea)
+            log.write(b"".join(lineas))
+            log.flush()
+            with open(_ruta(usuario_id, ".idx"), "ab") as idx:
+                idx.write(offsets.tobytes())
+    return _ruta(usuario_id, ".jsonl"), _ruta(usuario_id, ".idx")
 
 
 def agregar_conversacion(usuario_id, mensaje_usuario, respuesta_agente):
     """
-    Agrega un turno de conversación al perfil del usuario.
+    Agrega un turno de conversación al final del historial del usuario.
+    La escritura es diferida (ver write_behind): las lecturas de este módulo
+    esperan a que los turnos pendientes estén en disco.
     """
-    perfil = cargar_perfil(usuario_id)
-
-    perfil["conversaciones"].append({
+    turno = {
         "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "usuario": mensaje_usuario,
         "agente": respuesta_agente
-    })
-
-    guardar_perfil(usuario_id, perfil)
+    }
+    linea = (json.dumps(turno, ensure_ascii=False) + "\n").encode("utf-8")
+    escribir(_anexar_turnos, usuario_id, linea)
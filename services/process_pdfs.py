@@ -1,7 +1,13 @@
+import multiprocessing
 import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pypdf import PdfReader
 from pathlib import Path  # <-- ¡AÑADE ESTA LÍNEA!
-from config.settings import DATA_DIR, DATA_CLEAN_DIR
+from typing import Iterator, Optional
+from config.settings import DATA_DIR, DATA_CLEAN_DIR, PDF_WORKERS, PDF_PAGES_PER_TASK
+from .index_manifest import file_sha256, load_manifest, save_manifest
 
 def clean_text(text: str) -> str:
     """Limpia el texto extraído del PDF."""
@@ -9,42 +15,190 @@ def clean_text(text: str) -> str:
     text = ' '.join(text.split())
     return text.strip()
 
+def iter_clean_pages(pdf_path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    """Genera el texto limpio de cada página no vacía del rango [start, end)."""
+    reader = PdfReader(pdf_path)
+    for page in reader.pages[start:end]:
+        page_text = clean_text(page.extract_text() or "")
+        if page_text:
+            yield page_text
+
 def extract_text_from_pdf(pdf_path: Path) -> str:
     """Extrae y limpia el texto de un único archivo PDF."""
     try:
-        reader = PdfReader(pdf_path)
-        full_text = ""
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                full_text += page_text + "\n"
-        return clean_text(full_text)
+        # Limpiar página a página y unir con espacios equivale a limpiar el texto completo
+        return " ".join(iter_clean_pages(pdf_path))
     except Exception as e:
         print(f"❌ Error al leer {pdf_path.name}: {e}")
         return ""
 
-def run_pdf_processing():
-    """Función principal para procesar todos los PDFs en la carpeta 'data'."""
+def _extract_pages_to_file(pdf_path: Path, start: int, end: int, part_path: Path) -> dict:
+    """Tarea de un proceso del pool: escribe en `part_path` el texto de las páginas [start, end).
+
+    Las páginas se vuelcan al fichero según se extraen, sin construir una cadena
+    con el documento completo.
+    """
+    started = time.perf_counter()
+    try:
+        written = False
+        with open(part_path, "w", encoding="utf-8") as f:
+            for page_text in iter_clean_pages(pdf_path, start, end):
+                if written:
+                    f.write(" ")
+                f.write(page_text)
+                written = True
+        return {"ok": True, "vacio": not written, "segundos": time.perf_counter() - started}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+def _page_ranges(pdf_path: Path) -> list:
+    """Divide el documento en tramos de PDF_PAGES_PER_TASK páginas."""
+    num_pages = len(PdfReader(pdf_path).pages)
+    return [(start, min(start + PDF_PAGES_PER_TASK, num_pages))
+            for start in range(0, max(num_pages, 1), PDF_PAGES_PER_TASK)]
+
+def _merge_parts(part_paths: list, results: list, output_path: Path) -> bool:
+    """Concatena en streaming las partes no vacías de un documento. Devuelve si hay texto."""
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    written = False
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        for part_path, result in zip(part_paths, results):
+            if result["vacio"]:
+                continue
+            if written:
+                out.write(" ")
+            with open(part_path, "r", encoding="utf-8") as part:
+                shutil.copyfileobj(part, out)
+            written = True
+    if written:
+        os.replace(tmp_path, output_path)
+    else:
+        tmp_path.unlink(missing_ok=True)
+    return written
+
+def run_pdf_processing() -> dict:
+    """Función principal para procesar todos los PDFs en la carpeta 'data'.
+
+    Es incremental: el manifiesto de `data_clean/` guarda el hash de cada PDF, de
+    modo que sólo se extraen los PDFs nuevos o modificados y se eliminan los
+    textos de los PDFs que ya no existen.
+
+    La extracción se reparte en un pool de procesos (PDF_WORKERS): una tarea por
+    tramo de PDF_PAGES_PER_TASK páginas, de modo que también los PDFs muy grandes
+    se procesan en paralelo.
+    """
     print("🚀 Iniciando procesamiento de PDFs...")
     pdf_files = [f for f in DATA_DIR.glob("*.pdf")]
-    
+    resumen = {"nuevos": 0, "modificados": 0, "sin_cambios": 0, "eliminados": 0, "errores": 0, "tiempos": {}}
+
     if not pdf_files:
         print(f"⚠️ No se encontraron archivos PDF en la carpeta: {DATA_DIR}")
-        return
 
+    manifest = load_manifest(DATA_CLEAN_DIR)
+    previous = manifest.get("pdfs", {})
+    current = {}
+
+    def keep_previous(pdf_name, output_path, entry):
+        """Si la extracción falla se conserva el texto anterior del PDF (si lo hay)."""
+        resumen["errores"] += 1
+        if entry and output_path.exists():
+            current[pdf_name] = entry
+            print(f"↩️ Se conserva el texto anterior de: {pdf_name}")
+
+    # 1. Detectar los PDFs nuevos o modificados
+    pending = []
     for pdf_path in pdf_files:
-        print(f"📄 Procesando: {pdf_path.name}")
-        text = extract_text_from_pdf(pdf_path)
-        
-        if text:
-            output_path = DATA_CLEAN_DIR / f"{pdf_path.stem}.txt"
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(text)
-            print(f"✅ Texto limpio guardado en: {output_path}")
+        pdf_hash = file_sha256(pdf_path)
+        output_path = DATA_CLEAN_DIR / f"{pdf_path.stem}.txt"
+        entry = previous.get(pdf_path.name)
+
+        if entry and entry["sha256"] == pdf_hash and output_path.exists():
+            current[pdf_path.name] = entry
+            resumen["sin_cambios"] += 1
         else:
-            print(f"⚠️ No se pudo extraer texto de: {pdf_path.name}")
+            pending.append((pdf_path, pdf_hash, output_path, entry))
+
+    # 2. Extraer en paralelo, por tramos de páginas
+    jobs = []
+    for pdf_path, pdf_hash, output_path, entry in pending:
+        try:
+            ranges = _page_ranges(pdf_path)
+        except Exception as e:
+            print(f"❌ Error al leer {pdf_path.name}: {e}")
+            keep_previous(pdf_path.name, output_path, entry)
+            continue
+        part_paths = [output_path.with_name(f"{output_path.name}.part{i}") for i in range(len(ranges))]
+        jobs.append((pdf_path, pdf_hash, output_path, entry, ranges, part_paths))
+
+    num_tasks = sum(len(job[4]) for job in jobs)
+    workers = min(PDF_WORKERS, num_tasks)
+    # "spawn": el proceso que llama puede tener hilos (servidor, reindexación en segundo
+    # plano) y hacer fork con hilos vivos puede dejar bloqueos heredados en los hijos
+    executor = (ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                if workers > 1 else None)
+
+    try:
+        submitted = []
+        for pdf_path, pdf_hash, output_path, entry, ranges, part_paths in jobs:
+            if executor is not None:
+                futures = [executor.submit(_extract_pages_to_file, pdf_path, start, end, part_path)
+                           for (start, end), part_path in zip(ranges, part_paths)]
+            else:
+                futures = None
+            submitted.append((pdf_path, pdf_hash, output_path, entry, ranges, part_paths, futures))
+
+        for pdf_path, pdf_hash, output_path, entry, ranges, part_paths, futures in submitted:
+            print(f"📄 Procesando: {pdf_path.name} ({ranges[-1][1]} páginas)")
+            if futures is not None:
+                results = [future.result() for future in futures]
+            else:
+                results = [_extract_pages_to_file(pdf_path, start, end, part_path)
+                           for (start, end), part_path in zip(ranges, part_paths)]
+
+            errors = [r["error"] for r in results if not r["ok"]]
+            has_text = not errors and _merge_parts(part_paths, results, output_path)
+            for part_path in part_paths:
+                part_path.unlink(missing_ok=True)
+            # Tiempo de extracción del documento: suma del tiempo de sus tramos
+            elapsed = sum(r.get("segundos", 0.0) for r in results)
+
+            if errors:
+                print(f"❌ Error al leer {pdf_path.name}: {errors[0]}")
+                keep_previous(pdf_path.name, output_path, entry)
+            elif has_text:
+                current[pdf_path.name] = {
+                    "sha256": pdf_hash,
+                    "texto": output_path.name,
+                    "texto_sha256": file_sha256(output_path),
+                }
+                resumen["modificados" if entry else "nuevos"] += 1
+                resumen["tiempos"][pdf_path.name] = round(elapsed, 3)
+                print(f"✅ Texto limpio guardado en: {output_path} ({elapsed:.2f} s)")
+            else:
+                print(f"⚠️ No se pudo extraer texto de: {pdf_path.name}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # Eliminar los textos de PDFs borrados para que sus chunks desaparezcan del índice.
+    # Un PDF que sigue en data/ pero ya no tiene texto también pierde el anterior.
+    for name, entry in previous.items():
+        if name not in current:
+            (DATA_CLEAN_DIR / entry["texto"]).unlink(missing_ok=True)
+            resumen["eliminados"] += 1
+            if (DATA_DIR / name).exists():
+                print(f"🗑️ Eliminado texto de PDF sin texto: {entry['texto']}")
+            else:
+                print(f"🗑️ Eliminado texto de PDF borrado: {entry['texto']}")
+
+    manifest["pdfs"] = current
+    save_manifest(DATA_CLEAN_DIR, manifest)
 
+    print(f"📋 PDFs — nuevos: {resumen['nuevos']}, modificados: {resumen['modificados']}, "
+          f"sin cambios: {resumen['sin_cambios']}, eliminados: {resumen['eliminados']}, "
+          f"con errores: {resumen['errores']}")
     print("🏁 Procesamiento de PDFs finalizado.")
+    return resumen
 
 if __name__ == '__main__':
-    run_pdf_processing()
\ No newline at end of file
+    run_pdf_processing()
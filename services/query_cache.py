@@ -0,0 +1,108 @@
+"""
+Caché LRU de embeddings de preguntas.
+
+Las preguntas repetidas (y los reintentos del frontend) no vuelven a pasar por
+SentenceTransformer.encode: el vector float32 se guarda bajo la pregunta
+normalizada. La caché está acotada por número de entradas y por memoria.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from .embedding_cache import normalize_text
+
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries: int = 2048, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._vectors = OrderedDict()   # pregunta normalizada -> vector float32
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    @staticmethod
+    def _size(key: str, vector: np.ndarray) -> int:
+        return vector.nbytes + len(key.encode("utf-8"))
+
+    def get_or_encode(self, question: str, encode: Callable[[str], np.ndarray]) -> np.ndarray:
+        """Devuelve el vector de la pregunta, codificándola con `encode` sólo si no está en caché.
+
+        Se codifica siempre el texto normalizado, así dos preguntas con la misma
+        clave tienen exactamente el mismo vector.
+        """
+        key = normalize_text(question)
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        # La codificación se hace fuera del cerrojo para no serializar los hilos
+        vector = np.asarray(encode(key), dtype=np.float32).ravel()
+        vector.setflags(write=False)
+        if self.max_entries > 0:
+            self._put(key, vector)
+        return vector
+
+    def get_or_encode_many(self, questions: List[str],
+                           encode_many: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Como `get_or_encode` para varias preguntas; las que falten se codifican en una sola llamada."""
+        keys = [normalize_text(q) for q in questions]
+        vectors = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._vectors.get(key)
+                if vector is not None:
+                    self._vectors.move_to_end(key)
+                    vectors[i] = vector
+            hits = sum(v is not None for v in vectors)
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        missing = list(dict.fromkeys(key for key, v in zip(keys, vectors) if v is None))
+        if missing:
+            encoded = {}
+            for key, vector in zip(missing, np.asarray(encode_many(missing), dtype=np.float32)):
+                vector = vector.copy()
+                vector.setflags(write=False)
+                encoded[key] = vector
+                if self.max_entries > 0:
+                    self._put(key, vector)
+            vectors = [v if v is not None else encoded[key] for key, v in zip(keys, vectors)]
+        return np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+    def _put(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            if key in self._vectors:
+                return
+            self._vectors[key] = vector
+            self._bytes += self._size(key, vector)
+            while self._vectors and (len(self._vectors) > self.max_entries or
+                                     (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                old_key, old_vector = self._vectors.popitem(last=False)
+                self._bytes -= self._size(old_key, old_vector)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entradas": len(self._vectors),
+            "bytes": self._bytes,
+            "aciertos": self.hits,
+            "fallos": self.misses,
+            "tasa_aciertos": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -1,68 +1,309 @@
+import asyncio
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
+
 import numpy as np
-import json
-import google.generativeai as genai # <-- Importar la biblioteca de Google
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from config.settings import EMBEDDINGS_DIR, EMBEDDING_MODEL_NAME, GOOGLE_API_KEY, LLM_MODEL_NAME, TOP_K_CHUNKS
+from config.settings import (
+    EMBEDDING_MODEL_NAME, EMBEDDING_BATCH_SIZE, TOP_K_CHUNKS,
+    SEARCH_BACKEND, IVF_NPROBE, QUANTIZED_RESCORE, ENCODE_WORKERS, LLM_MAX_CONCURRENCY,
+    ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY,
+    QUERY_EMBEDDING_CACHE_MAX_ENTRIES, QUERY_EMBEDDING_CACHE_MAX_MB,
+    MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS,
+    HYBRID_SEARCH, HYBRID_CANDIDATES, RRF_K, BM25_K1, BM25_B,
+    CHUNK_OVERLAP, CONTEXT_TOKEN_BUDGET,
+    ADAPTIVE_TOP_K, TOP_K_MIN, TOP_K_MAX, TOP_K_RELATIVE_THRESHOLD, TOP_K_MAX_GAP,
+)
+from .answer_cache import AnswerCache
+from .micro_batcher import MicroBatcher
+from .query_cache import QueryEmbeddingCache
+from .sparse_index import SparseIndex, reciprocal_rank_fusion
+from .chunk_store import ChunkStore
+from .context_packing import pack_context
+from .llm_backends import LLMBackend, create_llm_backend
+from .index_versions import active_index_dirs, pointer_mtime
+from .vector_search import adaptive_k, create_search_index, normalize_rows
+
+
+class LoadedIndex:
+    """Índice de búsqueda y almacén de chunks de una misma versión.
+
+    Se sustituye entero en una sola asignación, así una consulta nunca mezcla
+    embeddings de una versión con chunks de otra.
+    """
+
+    def __init__(self, index, chunks: ChunkStore, version, sparse=None):
+        self.index = index
+        self.chunks = chunks
+        self.version = version
+        self.sparse = sparse
+
 
 class RAGService:
-    def __init__(self):
-        print("🔄 Inicializando el servicio RAG con Google Gemini...")
+    def __init__(self, llm: Optional[LLMBackend] = None):
+        print("🔄 Inicializando el servicio RAG...")
         self.model = SentenceTransformer(EMBEDDING_MODEL_NAME)
         
-        # Configurar la API de Gemini
-        if GOOGLE_API_KEY:
-            genai.configure(api_key=GOOGLE_API_KEY)
-            self.gemini_model = genai.GenerativeModel(LLM_MODEL_NAME)
-        else:
-            self.gemini_model = None
-            print("⚠️ ADVERTENCIA: La clave de API de Google (GOOGLE_API_KEY) no está configurada.")
+        # Backend del LLM (Gemini o el simulado, según LLM_BACKEND); None si falta la clave de Google
+        self.llm = llm or create_llm_backend()
         
-        self.embeddings = None
-        self.chunks_metadata = None
+        self.loaded = None
+        self._pointer_mtime = None
+
+        # Concurrencia de la ruta asíncrona (aquery)
+        self._encode_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+        self._llm_semaphores = weakref.WeakKeyDictionary()
+
+        self.answer_cache = AnswerCache(
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+            similarity_threshold=ANSWER_CACHE_SIMILARITY,
+        )
+        self.query_cache = QueryEmbeddingCache(
+            max_entries=QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+            max_bytes=QUERY_EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+        )
+
+        # Las recuperaciones de consultas concurrentes se agrupan en lotes
+        self.retrieval_batcher = None
+        if MICRO_BATCH_MAX_SIZE > 1:
+            self.retrieval_batcher = MicroBatcher(
+                self.retrieve_many,
+                max_batch_size=MICRO_BATCH_MAX_SIZE,
+                max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+                name="retrieval-batcher",
+            )
         
-        self._load_index()
+        self.reload_index()
+
+    @property
+    def embeddings(self):
+        return self.loaded.index.embeddings if self.loaded else None
+
+    @property
+    def index(self):
+        return self.loaded.index if self.loaded else None
+
+    @property
+    def chunks(self):
+        return self.loaded.chunks if self.loaded else None
+
+    @property
+    def index_version(self):
+        return self.loaded.version if self.loaded else None
 
     def _load_index(self):
-        """Carga los embeddings y metadatos desde el disco."""
+        """Abre los embeddings y los chunks del índice activo desde el disco.
+
+        Ambos se mapean en memoria (mmap) en lugar de copiarse, de modo que todos
+        los workers comparten las mismas páginas y el texto de cada chunk sólo
+        se lee cuando se recupera.
+        """
+        chunks_dir, embeddings_dir, version = active_index_dirs()
         try:
-            self.embeddings = np.load(EMBEDDINGS_DIR / "embeddings.npy")
-            with open(EMBEDDINGS_DIR / "chunks_metadata.json", "r", encoding="utf-8") as f:
-                self.chunks_metadata = json.load(f)
-            print(f"✅ Índice cargado correctamente con {len(self.chunks_metadata)} chunks.")
+            index = create_search_index(embeddings_dir, backend=SEARCH_BACKEND, nprobe=IVF_NPROBE,
+                                        rescore=QUANTIZED_RESCORE)
+            chunks = ChunkStore(chunks_dir)
+            if len(chunks) != len(index):
+                raise FileNotFoundError("El almacén de chunks no corresponde a los embeddings.")
+            print(f"✅ Índice cargado correctamente con {len(chunks)} chunks"
+                  f"{f' (versión {version})' if version else ''}.")
+            return LoadedIndex(index, chunks, version, sparse=self._load_sparse_index(chunks_dir, len(chunks)))
         except FileNotFoundError:
             print("❌ Error: No se encontraron los archivos del índice de embeddings.")
             print("   Por favor, ejecuta el proceso de 'reindexación' primero.")
-            self.embeddings = None
-            self.chunks_metadata = None
+            return None
 
-    def query(self, question: str) -> dict:
-        """Realiza una consulta RAG completa."""
-        if not self.gemini_model:
+    @staticmethod
+    def _load_sparse_index(chunks_dir, num_chunks: int):
+        """Índice BM25 para la búsqueda híbrida, o None si no está activa o no existe."""
+        if not HYBRID_SEARCH:
+            return None
+        try:
+            sparse = SparseIndex(chunks_dir, k1=BM25_K1, b=BM25_B)
+        except FileNotFoundError:
+            print("ℹ️ No hay índice BM25 para estos chunks (reindexa para crearlo). Se usará sólo la búsqueda vectorial.")
+            return None
+        if len(sparse) != num_chunks:
+            print("⚠️ El índice BM25 no corresponde al almacén de chunks. Se usará sólo la búsqueda vectorial.")
+            return None
+        return sparse
+
+    def reload_index(self):
+        """Carga el índice activo y lo intercambia de forma atómica.
+
+        El modelo de embeddings y el cliente del LLM se conservan; sólo cambian
+        los datos del índice.
+        """
+        self._pointer_mtime = pointer_mtime()
+        loaded = self._load_index()
+        if loaded is not None or self.loaded is None:
+            self.loaded = loaded
+            # Las respuestas guardadas citan chunks de la versión anterior
+            self.answer_cache.clear()
+
+    def _current_index(self):
+        """Devuelve el índice vigente, recargándolo si otra reindexación publicó una versión nueva."""
+        if pointer_mtime() != self._pointer_mtime:
+            self.reload_index()
+        return self.loaded
+
+    def retrieve(self, question: str) -> dict:
+        """Recupera el contexto de una pregunta: embedding + búsqueda + prompt.
+
+        Es la parte de la consulta que consume CPU; no llama al LLM.
+        Devuelve {"prompt", "fuentes", "embedding", "indices", "version", "metadata"} o {"error"}.
+        """
+        if not self.llm:
             return {"error": "La clave de Google API no está configurada."}
-        if self.embeddings is None:
+        loaded = self._current_index()
+        if loaded is None:
             return {"error": "El índice de conocimiento no está disponible. Ejecuta /api/reindex."}
 
-        # 1. Embedding de la pregunta del usuario
-        question_embedding = self.model.encode([question])
+        # 1. Embedding de la pregunta del usuario (desde la caché si se repite)
+        question_embedding = self.encode_question(question)[None, :]
 
-        # 2. Búsqueda de similitud del coseno
-        similarities = cosine_similarity(question_embedding, self.embeddings)[0]
-        
-        # 3. Obtener los top-k chunks más relevantes
-        top_k_indices = np.argsort(similarities)[::-1][:TOP_K_CHUNKS]
-        
-        retrieved_chunks = []
-        sources = set()
-        for idx in top_k_indices:
-            chunk_data = self.chunks_metadata[idx]
-            retrieved_chunks.append(chunk_data["text"])
-            sources.add(chunk_data["metadata"]["source"])
-
-        # 4. Construcción del contexto para el LLM
-        context = "\n\n---\n\n".join(retrieved_chunks)
+        # 2-3. Búsqueda por similitud del coseno (+ BM25) y selección de los top-k chunks
+        dense_indices, _ = loaded.index.search(question_embedding, self._dense_k(loaded))
+        candidates, keep = self._fuse(loaded, question, dense_indices)
+
+        return self._build_retrieval(question, question_embedding[0], candidates, loaded, keep)
+
+    def retrieve_many(self, questions: List[str]) -> List[dict]:
+        """`retrieve` para un lote de preguntas.
+
+        Las preguntas que no están en la caché se codifican en una sola llamada a
+        encode y la búsqueda es un único producto matriz-matriz.
+        """
+        if not self.llm:
+            return [{"error": "La clave de Google API no está configurada."} for _ in questions]
+        loaded = self._current_index()
+        if loaded is None:
+            return [{"error": "El índice de conocimiento no está disponible. Ejecuta /api/reindex."}
+                    for _ in questions]
+        if not questions:
+            return []
+
+        question_embeddings = self.query_cache.get_or_encode_many(
+            questions, lambda texts: self.model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE)
+        )
+        dense_indices, _ = loaded.index.search_many(question_embeddings, self._dense_k(loaded))
+        retrievals = []
+        for question, embedding, indices in zip(questions, question_embeddings, dense_indices):
+            candidates, keep = self._fuse(loaded, question, indices)
+            retrievals.append(self._build_retrieval(question, embedding, candidates, loaded, keep))
+        return retrievals
+
+    @staticmethod
+    def _k_bounds():
+        """(mínimo, máximo) de chunks por consulta."""
+        if ADAPTIVE_TOP_K:
+            return TOP_K_MIN, TOP_K_MAX
+        return TOP_K_CHUNKS, TOP_K_CHUNKS
+
+    def _dense_k(self, loaded: LoadedIndex) -> int:
+        max_k = self._k_bounds()[1]
+        return max(HYBRID_CANDIDATES, max_k) if loaded.sparse is not None else max_k
+
+    def _fuse(self, loaded: LoadedIndex, question: str, dense_indices):
+        """Combina los candidatos densos con los de BM25 por RRF (si hay índice BM25).
+
+        Devuelve (candidatos, chunks que se conservan siempre): el mejor resultado
+        de BM25 no se descarta aunque su similitud del coseno sea baja.
+        """
+        max_k = self._k_bounds()[1]
+        if loaded.sparse is None:
+            return dense_indices[:max_k], []
+        sparse_indices, _ = loaded.sparse.search(question, max(HYBRID_CANDIDATES, max_k))
+        fused = reciprocal_rank_fusion([dense_indices, sparse_indices], max_k, rrf_k=RRF_K)
+        return fused, [int(idx) for idx in sparse_indices[:1]]
+
+    def _select(self, loaded: LoadedIndex, question_embedding, candidates, keep=()):
+        """Elige cuántos candidatos usar según sus similitudes del coseno con la pregunta.
+
+        El corte adaptativo se hace sobre los candidatos reordenados por coseno
+        (el orden de RRF no es el de los scores). Los chunks de `keep` que queden
+        fuera se añaden justo detrás del mejor, en lugar de los de menor coseno
+        si hace falta para no pasar de TOP_K_MAX. Se devuelven (índices elegidos,
+        {índice: score} de todos los candidatos).
+        """
+        candidates = [int(idx) for idx in candidates]
+        extra = [idx for idx in keep if idx not in candidates]
+        candidates = np.asarray(candidates + extra, dtype=np.int64)
+        query = normalize_rows(question_embedding)[0]
+        scores = loaded.index.embeddings[candidates] @ query
+        order = np.argsort(-scores, kind="stable")
+        min_k, max_k = self._k_bounds()
+        k = adaptive_k(scores[order], min_k, max_k, TOP_K_RELATIVE_THRESHOLD, TOP_K_MAX_GAP)
+        selected = [int(idx) for idx in candidates[order[:k]]]
+        missing = [idx for idx in keep if idx not in selected]
+        if missing:
+            selected = selected[:max(max_k - len(missing), 0)]
+        score_by_index = {int(idx): float(score) for idx, score in zip(candidates, scores)}
+        return selected[:1] + missing + selected[1:], score_by_index
+
+    def _build_retrieval(self, question: str, question_embedding, candidates,
+                         loaded: LoadedIndex, keep=()) -> dict:
+        selected, score_by_index = self._select(loaded, question_embedding, candidates, keep)
+
+        # 4. Construcción del contexto para el LLM: chunks contiguos fusionados sin
+        #    solapamiento, en orden de documento y dentro del presupuesto de tokens
+        context, used_indices, sources = pack_context(
+            loaded.chunks, selected, CONTEXT_TOKEN_BUDGET, max_overlap=CHUNK_OVERLAP,
+        )
         
-        # 5. Generación de la respuesta con el LLM de Gemini
+        return {
+            "prompt": self._build_prompt(question, context),
+            "fuentes": sources,
+            "embedding": question_embedding,
+            "indices": used_indices,
+            "version": loaded.version,
+            "metadata": {
+                "k": len(used_indices),
+                "scores": [round(score_by_index[idx], 4) for idx in used_indices],
+            },
+        }
+
+    def encode_question(self, question: str):
+        """Vector float32 de una pregunta, usando la caché LRU de preguntas."""
+        return self.query_cache.get_or_encode(question, lambda text: self.model.encode([text])[0])
+
+    async def aretrieve(self, question: str) -> dict:
+        """`retrieve` sin bloquear el event loop.
+
+        Con micro-batching activo la pregunta se une al lote en curso; si no, se
+        recupera sola en el pool de hilos de codificación.
+        """
+        if self.retrieval_batcher is not None:
+            return await asyncio.wrap_future(self.retrieval_batcher.submit(question))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._encode_executor, self.retrieve, question)
+
+    def _cached_answer(self, retrieval: dict):
+        return self.answer_cache.get(retrieval["embedding"], retrieval["indices"], retrieval["version"])
+
+    def _store_answer(self, retrieval: dict, result: dict) -> None:
+        self.answer_cache.put(retrieval["embedding"], retrieval["indices"], result, retrieval["version"])
+
+    def _answer(self, retrieval: dict, text: str, usage: Optional[dict] = None) -> dict:
+        """Resultado de una consulta recién generada, que queda guardado en la caché de respuestas."""
+        result = {"respuesta": text, "fuentes": retrieval["fuentes"]}
+        self._store_answer(retrieval, result)
+        return {**result, "metadata": {**retrieval["metadata"], **(usage or {})}}
+
+    def _llm_error(self, e: Exception) -> dict:
+        return {"error": f"Error al contactar con el modelo de lenguaje {self.llm.label}: {e}"}
+
+    def _cached_result(self, retrieval: dict):
+        cached = self._cached_answer(retrieval)
+        if cached is None:
+            return None
+        return {**cached, "metadata": retrieval["metadata"], "desde_cache": True}
+
+    @staticmethod
+    def _build_prompt(question: str, context: str) -> str:
         system_prompt = (
             "Eres un asistente experto en trámites administrativos para familias con miembros con autismo en Andalucía. "
             "Tu tarea es responder a la pregunta del usuario basándote ÚNICAMENTE en el contexto proporcionado. "
@@ -80,18 +321,108 @@ class RAGService:
         ---
         """
 
+        # Gemini usa un solo mensaje combinando el system prompt y el user prompt
+        return f"{system_prompt}\n\n{user_prompt}"
+
+    def query(self, question: str) -> dict:
+        """Realiza una consulta RAG completa (versión síncrona)."""
+        retrieval = self.retrieve(question)
+        if "error" in retrieval:
+            return retrieval
+
+        cached = self._cached_result(retrieval)
+        if cached is not None:
+            return cached
+
+        # 5. Generación de la respuesta con el LLM
         try:
-            # Gemini usa un solo mensaje combinando el system prompt y el user prompt
-            full_prompt = f"{system_prompt}\n\n{user_prompt}"
-            
-            response = self.gemini_model.generate_content(full_prompt)
-            
-            answer = response.text
-            
-            return {
-                "respuesta": answer,
-                "fuentes": list(sources)
-            }
+            response = self.llm.generate(retrieval["prompt"])
+            return self._answer(retrieval, response.text, response.usage())
+        except Exception as e:
+            return self._llm_error(e)
+
+    async def aquery(self, question: str) -> dict:
+        """Realiza una consulta RAG completa sin bloquear el event loop.
 
+        - El embedding y la búsqueda (CPU) se hacen fuera del event loop, en
+          micro-lotes junto con las demás consultas concurrentes.
+        - La llamada al LLM usa su cliente asíncrono, limitada a
+          LLM_MAX_CONCURRENCY peticiones simultáneas.
+        """
+        retrieval = await self.aretrieve(question)
+        if "error" in retrieval:
+            return retrieval
+
+        return await self._agenerate(retrieval)
+
+    async def aquery_many(self, questions: List[str]) -> List[dict]:
+        """Consulta RAG de un lote de preguntas.
+
+        La recuperación del lote entero se hace de una vez en el pool de hilos y
+        las generaciones se lanzan en paralelo, acotadas por LLM_MAX_CONCURRENCY.
+        Devuelve un resultado por pregunta, en el mismo orden. Cada resultado
+        lleva su "latencia_ms": desde el inicio del lote (la recuperación es
+        común) hasta que termina su propia respuesta.
+        """
+        inicio = time.perf_counter()
+
+        async def timed(retrieval: dict) -> dict:
+            result = await self._agenerate(retrieval) if "error" not in retrieval else retrieval
+            return {**result, "latencia_ms": (time.perf_counter() - inicio) * 1000}
+
+        loop = asyncio.get_running_loop()
+        retrievals = await loop.run_in_executor(self._encode_executor, self.retrieve_many, questions)
+        return await asyncio.gather(*(timed(retrieval) for retrieval in retrievals))
+
+    async def _agenerate(self, retrieval: dict) -> dict:
+        """Respuesta del LLM para una recuperación ya hecha (o desde la caché de respuestas)."""
+        cached = self._cached_result(retrieval)
+        if cached is not None:
+            return cached
+
+        try:
+            async with self._llm_semaphore():
+                response = await self.llm.agenerate(retrieval["prompt"])
+            return self._answer(retrieval, response.text, response.usage())
         except Exception as e:
-            return {"error": f"Error al contactar con el modelo de lenguaje Gemini: {e}"}
+            return self._llm_error(e)
+
+    async def astream(self, question: str) -> AsyncIterator[dict]:
+        """Consulta RAG en streaming.
+
+        Genera eventos en este orden: {"evento": "fuentes"} en cuanto termina la
+        recuperación, un {"evento": "token"} por fragmento que emite el LLM y un
+        {"evento": "fin"} con la respuesta completa. Ante un fallo emite
+        {"evento": "error"} y termina.
+        """
+        retrieval = await self.aretrieve(question)
+        if "error" in retrieval:
+            yield {"evento": "error", "error": retrieval["error"]}
+            return
+
+        yield {"evento": "fuentes", "fuentes": retrieval["fuentes"]}
+
+        cached = self._cached_result(retrieval)
+        if cached is not None:
+            yield {"evento": "token", "texto": cached["respuesta"]}
+            yield {"evento": "fin", **cached}
+            return
+
+        parts = []
+        try:
+            async with self._llm_semaphore():
+                async for text in self.llm.astream(retrieval["prompt"]):
+                    parts.append(text)
+                    yield {"evento": "token", "texto": text}
+        except Exception as e:
+            yield {"evento": "error", **self._llm_error(e)}
+            return
+
+        yield {"evento": "fin", **self._answer(retrieval, "".join(parts))}
+
+    def _llm_semaphore(self) -> asyncio.Semaphore:
+        """Semáforo de concurrencia del LLM, uno por event loop."""
+        loop = asyncio.get_running_loop()
+        if self._llm_semaphores.get(loop) is None:
+            self._llm_semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        return self._llm_semaphores[loop]
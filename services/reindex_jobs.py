@@ -0,0 +1,215 @@
+"""
+Trabajos de reindexación en segundo plano.
+La reindexación se ejecuta en un hilo aparte y escribe en un directorio de
+versión nuevo, de modo que las consultas siguen atendiéndose con el índice
+actual hasta que la nueva versión se publica (ver `index_versions`).
+
+El estado de cada trabajo se guarda en `embeddings/versiones/reindex_<id>.json`
+y la exclusión (un solo trabajo a la vez) es un flock sobre
+`embeddings/versiones/reindex.lock`, de modo que con varios workers de uvicorn
+cualquiera puede responder por un trabajo y nunca corren dos a la vez.
+
+Estados: "pendiente", "en_curso", "completado", "error" (la versión nueva se
+descarta) y "error_recarga" (la versión se publicó, pero el proceso que lanzó
+el trabajo no pudo recargarla; los demás workers la cargan igualmente).
+"""
+
+import json
+import os
+import re
+import threading
+import traceback
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo exclusión dentro del proceso
+    fcntl = None
+
+from config.settings import INGESTION_MODE, INDEX_VERSIONS_DIR
+from .chunking import run_chunking
+from .embeddings import run_embedding_generation
+from .index_versions import (
+    active_index_dirs, active_version, create_version_dir, publish_version, discard_version,
+)
+from .ingestion import run_streaming_ingestion
+from .process_pdfs import run_pdf_processing
+from .vector_search import EMBEDDINGS_FILE
+
+LOCK_FILE = INDEX_VERSIONS_DIR / "reindex.lock"
+JOBS_TO_KEEP = 100
+
+_JOB_ID_RE = re.compile(r"[0-9a-f]{12}")
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _job_path(job_id: str) -> Path:
+    return INDEX_VERSIONS_DIR / f"reindex_{job_id}.json"
+
+
+def _read_job(job_id: str) -> Optional[dict]:
+    if not _JOB_ID_RE.fullmatch(job_id or ""):
+        return None
+    try:
+        with open(_job_path(job_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_job(job: dict) -> None:
+    path = _job_path(job["job_id"])
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _remove_old_jobs() -> None:
+    jobs = sorted(INDEX_VERSIONS_DIR.glob("reindex_*.json"), key=lambda p: p.stat().st_mtime)
+    for path in jobs[:-JOBS_TO_KEEP]:
+        path.unlink(missing_ok=True)
+
+
+class ReindexJobManager:
+    """Lanza y sigue trabajos de reindexación. Sólo se ejecuta uno a la vez (entre procesos)."""
+
+    def __init__(self, on_published: Optional[Callable[[str], None]] = None):
+        self.on_published = on_published
+        self._lock = threading.Lock()
+        self._running = None   # (trabajo, fichero de cerrojo) del trabajo de este proceso
+
+    def _try_lock(self):
+        """Abre el fichero de cerrojo y lo bloquea sin esperar. Devuelve el fichero o None."""
+        INDEX_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+        lock_file = open(LOCK_FILE, "a+", encoding="utf-8")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.seek(0)
+                running_id = lock_file.read().strip()
+                lock_file.close()
+                return None, running_id
+        return lock_file, None
+
+    def start(self) -> dict:
+        """Lanza un trabajo nuevo, o devuelve el que ya está en curso."""
+        with self._lock:
+            if self._running is not None:
+                return dict(self._running[0])
+            lock_file, running_id = self._try_lock()
+            if lock_file is None:
+                job = _read_job(running_id)
+                if job is not None:
+                    return job
+                raise RuntimeError("Hay una reindexación en curso en otro proceso.")
+
+            # Un trabajo anterior que no terminó (proceso caído) se marca como interrumpido
+            lock_file.seek(0)
+            previous = _read_job(lock_file.read().strip())
+            if previous is not None and previous["estado"] in ("pendiente", "en_curso"):
+                previous.update(estado="error", error="Interrumpido (el proceso terminó).", finalizado_en=_now())
+                _write_job(previous)
+
+            job_id = uuid.uuid4().hex[:12]
+            job = {
+                "job_id": job_id,
+                "estado": "pendiente",
+                "etapa": None,
+                "progreso": 0.0,
+                "version": None,
+                "creado_en": _now(),
+                "finalizado_en": None,
+                "detalle": {},
+                "error": None,
+            }
+            _write_job(job)
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(job_id)
+            lock_file.flush()
+            self._running = (job, lock_file)
+            _remove_old_jobs()
+
+        thread = threading.Thread(target=self._run, args=(job_id,), name=f"reindex-{job_id}", daemon=True)
+        thread.start()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            if self._running is not None and self._running[0]["job_id"] == job_id:
+                return dict(self._running[0])
+        return _read_job(job_id)
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._running[0]
+            job.update(fields)
+            _write_job(job)
+
+    def _run(self, job_id: str) -> None:
+        try:
+            version = self._build_and_publish(job_id)
+            if version is not None:
+                self._notify_published(job_id, version)
+        finally:
+            with self._lock:
+                _, lock_file = self._running
+                self._running = None
+                lock_file.close()   # Libera el flock
+
+    def _build_and_publish(self, job_id: str) -> Optional[str]:
+        """Construye y publica una versión nueva. Devuelve su nombre, o None si falla."""
+        version = None
+        try:
+            chunks_dir, embeddings_dir, _ = active_index_dirs()
+            version, version_dir = create_version_dir()
+            self._update(job_id, estado="en_curso", version=version)
+            detalle = {}
+
+            if INGESTION_MODE == "streaming":
+                self._update(job_id, etapa="streaming", progreso=0.1)
+                detalle["streaming"] = run_streaming_ingestion(chunks_dir=version_dir, embeddings_dir=version_dir)
+            else:
+                self._update(job_id, etapa="pdfs", progreso=0.0)
+                detalle["pdfs"] = run_pdf_processing()
+                self._update(job_id, etapa="chunks", progreso=0.3, detalle=dict(detalle))
+                detalle["chunks"] = run_chunking(chunks_dir=version_dir, previous_dir=chunks_dir)
+                self._update(job_id, etapa="embeddings", progreso=0.5, detalle=dict(detalle))
+                detalle["embeddings"] = run_embedding_generation(
+                    chunks_dir=version_dir, embeddings_dir=version_dir, previous_dir=embeddings_dir
+                )
+
+            if not (version_dir / EMBEDDINGS_FILE).exists():
+                raise RuntimeError("La reindexación no generó ningún índice (¿hay PDFs en data/?).")
+
+            self._update(job_id, etapa="publicacion", progreso=0.95, detalle=dict(detalle))
+            publish_version(version)
+            return version
+        except Exception as e:
+            traceback.print_exc()
+            # Sólo se borra una versión que no llegó a publicarse: si el puntero
+            # ya apunta a ella, los workers la están usando
+            if version is not None and active_version() != version:
+                discard_version(version)
+            self._update(job_id, estado="error", error=str(e), finalizado_en=_now())
+            return None
+
+    def _notify_published(self, job_id: str, version: str) -> None:
+        """Avisa al servicio de este proceso. Si falla, la versión sigue publicada en disco."""
+        try:
+            if self.on_published is not None:
+                self.on_published(version)
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, estado="error_recarga", etapa=None, progreso=1.0, finalizado_en=_now(),
+                         error=f"Índice publicado, pero no se pudo recargar en este proceso: {e}")
+            return
+        self._update(job_id, estado="completado", etapa=None, progreso=1.0, finalizado_en=_now())
@@ -0,0 +1,250 @@
+"""
+Índice léxico (BM25) de los chunks, complementario a la búsqueda vectorial.
+
+Los textos administrativos están llenos de términos exactos (números de
+artículo, "Orden de 12 de mayo", códigos de formulario) que los embeddings de
+MiniLM no distinguen bien. El índice invertido se construye junto al almacén de
+chunks y en la consulta se fusiona con la búsqueda densa por RRF.
+
+Formato (en el directorio del almacén de chunks):
+- bm25_vocab.json        lista ordenada de términos; el término `t` es vocab[t]
+- bm25_offsets.npy       int64[V + 1], las apariciones de `t` son [offsets[t]:offsets[t + 1]]
+- bm25_doc_ids.npy       int32, chunk de cada aparición
+- bm25_tfs.npy           uint16, frecuencia del término en ese chunk
+- bm25_doc_lengths.npy   int32[n], nº de términos de cada chunk
+"""
+
+import json
+import os
+import re
+import shutil
+import unicodedata
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .chunk_store import save_array
+from .vector_search import top_k_indices
+
+VOCAB_FILE = "bm25_vocab.json"
+OFFSETS_FILE = "bm25_offsets.npy"
+DOC_IDS_FILE = "bm25_doc_ids.npy"
+TFS_FILE = "bm25_tfs.npy"
+DOC_LENGTHS_FILE = "bm25_doc_lengths.npy"
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Palabras vacías frecuentes (ya sin tildes)
+STOPWORDS = frozenset("""
+a al algo ante antes como con contra cual cuando de del desde donde durante e el ella ellas ellos
+en entre era es esa ese eso esta este esto estos estas fue ha hay la las le les lo los mas me mi
+muy no nos o os para pero por que se segun sera si sin sobre son su sus tambien te ti tu un una
+unas uno unos y ya
+""".split())
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin tildes ni diéresis ("Orden" y "órdenes" -> "orden", "ordenes")."""
+    decomposed = unicodedata.normalize("NFD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens para BM25: palabras plegadas sin palabras vacías. Los números se conservan siempre."""
+    return [
+        token for token in _TOKEN_RE.findall(fold(text))
+        if token.isdigit() or (len(token) > 1 and token not in STOPWORDS)
+    ]
+
+
+class SparseIndexWriter:
+    """Acumula las listas de apariciones chunk a chunk y las guarda en formato CSR.
+
+    Con `spill_dir`, `spill_if_full()` vuelca las listas acumuladas a una tanda en
+    disco cuando superan `max_postings` apariciones, y `save()` fusiona las tandas:
+    la memoria queda acotada por `max_postings` y no por el tamaño del corpus.
+    """
+
+    def __init__(self, spill_dir: Optional[Path] = None, max_postings: int = 2_000_000):
+        self._postings: Dict[str, tuple] = {}
+        self._doc_lengths = array("i")
+        self._pending = 0            # Apariciones en memoria
+        self._spilled_docs = 0       # Chunks ya volcados a tandas
+        self._runs: List[Path] = []
+        self.spill_dir = spill_dir
+        self.max_postings = max_postings
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, text: str) -> None:
+        doc_id = len(self._doc_lengths)
+        tokens = tokenize(text)
+        self._doc_lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("i"), array("H"))
+            postings[0].append(doc_id)
+            postings[1].append(min(tf, 65535))
+            self._pending += 1
+
+    def truncate(self, n_docs: int) -> None:
+        """Descarta los chunks a partir de `n_docs` (que aún no pueden estar volcados)."""
+        if n_docs < self._spilled_docs:
+            raise ValueError("No se pueden descartar chunks ya volcados a disco.")
+        del self._doc_lengths[n_docs:]
+        for term in list(self._postings):
+            ids, counts = self._postings[term]
+            cut = len(ids)
+            while cut and ids[cut - 1] >= n_docs:
+                cut -= 1
+            self._pending -= len(ids) - cut
+            del ids[cut:], counts[cut:]
+            if not ids:
+                del self._postings[term]
+
+    def spill_if_full(self) -> None:
+        """Vuelca las apariciones en memoria a una tanda si superan `max_postings`."""
+        if self.spill_dir is not None and self._pending >= self.max_postings:
+            self._spill()
+
+    def _spill(self) -> None:
+        run = self.spill_dir / f"tanda_{len(self._runs):04d}"
+        run.mkdir(parents=True, exist_ok=True)
+        self._save_postings(run)
+        self._runs.append(run)
+        self._postings = {}
+        self._pending = 0
+        self._spilled_docs = len(self._doc_lengths)
+
+    def _save_postings(self, directory: Path) -> None:
+        vocab = sorted(self._postings)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum([len(self._postings[term][0]) for term in vocab], out=offsets[1:])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for t, term in enumerate(vocab):
+            ids, counts = self._postings[term]
+            doc_ids[offsets[t]:offsets[t + 1]] = np.frombuffer(ids, dtype=np.int32)
+            tfs[offsets[t]:offsets[t + 1]] = np.frombuffer(counts, dtype=np.uint16)
+
+        save_array(directory / OFFSETS_FILE, offsets)
+        save_array(directory / DOC_IDS_FILE, doc_ids)
+        save_array(directory / TFS_FILE, tfs)
+        with open(directory / VOCAB_FILE, "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+
+    def _merge_runs(self, directory: Path) -> None:
+        """Fusiona las tandas (en orden de chunk) en el índice definitivo, término a término."""
+        runs = []
+        for run in self._runs:
+            with open(run / VOCAB_FILE, "r", encoding="utf-8") as f:
+                term_ids = {term: t for t, term in enumerate(json.load(f))}
+            runs.append((term_ids, np.load(run / OFFSETS_FILE, mmap_mode="r"),
+                         np.load(run / DOC_IDS_FILE, mmap_mode="r"), np.load(run / TFS_FILE, mmap_mode="r")))
+        vocab = sorted(set().union(*(term_ids for term_ids, _, _, _ in runs)))
+        total = sum(int(offsets[-1]) for _, offsets, _, _ in runs)
+
+        offsets_out = np.zeros(len(vocab) + 1, dtype=np.int64)
+        tmp_ids = directory / (DOC_IDS_FILE + ".tmp")
+        tmp_tfs = directory / (TFS_FILE + ".tmp")
+        doc_ids_out = np.lib.format.open_memmap(tmp_ids, mode="w+", dtype=np.int32, shape=(total,))
+        tfs_out = np.lib.format.open_memmap(tmp_tfs, mode="w+", dtype=np.uint16, shape=(total,))
+        position = 0
+        for t, term in enumerate(vocab):
+            for term_ids, offsets, doc_ids, tfs in runs:
+                r = term_ids.get(term)
+                if r is None:
+                    continue
+                start, end = offsets[r], offsets[r + 1]
+                doc_ids_out[position:position + end - start] = doc_ids[start:end]
+                tfs_out[position:position + end - start] = tfs[start:end]
+                position += end - start
+            offsets_out[t + 1] = position
+        doc_ids_out.flush()
+        tfs_out.flush()
+        del doc_ids_out, tfs_out, runs
+
+        os.replace(tmp_ids, directory / DOC_IDS_FILE)
+        os.replace(tmp_tfs, directory / TFS_FILE)
+        save_array(directory / OFFSETS_FILE, offsets_out)
+        with open(directory / VOCAB_FILE, "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+
+    def save(self, directory: Path) -> None:
+        if self._runs:
+            if self._postings:
+                self._spill()
+            self._merge_runs(directory)
+            self.abort()
+        else:
+            self._save_postings(directory)
+        save_array(directory / DOC_LENGTHS_FILE, np.frombuffer(self._doc_lengths, dtype=np.int32))
+
+    def abort(self) -> None:
+        """Borra las tandas volcadas a disco."""
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+        self._runs = []
+
+
+class SparseIndex:
+    """Búsqueda BM25 sobre las listas de apariciones (abiertas con mmap)."""
+
+    def __init__(self, directory: Path, k1: float = 1.2, b: float = 0.75):
+        with open(directory / VOCAB_FILE, "r", encoding="utf-8") as f:
+            self.term_ids = {term: t for t, term in enumerate(json.load(f))}
+        self.offsets = np.load(directory / OFFSETS_FILE, mmap_mode="r")
+        self.doc_ids = np.load(directory / DOC_IDS_FILE, mmap_mode="r")
+        self.tfs = np.load(directory / TFS_FILE, mmap_mode="r")
+        doc_lengths = np.load(directory / DOC_LENGTHS_FILE).astype(np.float32)
+
+        self.k1 = k1
+        avg_length = float(doc_lengths.mean()) if doc_lengths.size else 0.0
+        # Parte del denominador de BM25 que sólo depende del chunk, precalculada
+        self._length_norm = k1 * (1 - b + b * doc_lengths / (avg_length or 1.0))
+
+    def __len__(self) -> int:
+        return self._length_norm.shape[0]
+
+    def scores(self, query: str) -> np.ndarray:
+        """Puntuación BM25 de la consulta para todos los chunks (0 si no comparten términos)."""
+        n = len(self)
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.term_ids.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log1p((n - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+        return scores
+
+    def search(self, query: str, k: int):
+        """Devuelve (índices, scores) de los k chunks con mayor BM25, sólo los de score > 0."""
+        scores = self.scores(query)
+        indices = top_k_indices(scores, k)
+        indices = indices[scores[indices] > 0]
+        return indices, scores[indices]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int, rrf_k: int = 60) -> np.ndarray:
+    """Fusiona varias listas ordenadas de chunks por Reciprocal Rank Fusion.
+
+    Cada chunk suma 1 / (rrf_k + posición) por cada lista en la que aparece.
+    Devuelve los k chunks con mayor puntuación fusionada.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking):
+            idx = int(idx)
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (rrf_k + rank + 1)
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return np.array([idx for idx, _ in best], dtype=np.int64)
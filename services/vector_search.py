@@ -0,0 +1,459 @@
+"""
+Búsqueda vectorial sobre el índice de embeddings.
+La matriz se normaliza una única vez al cargarla, de modo que cada consulta
+es un producto matriz-vector más una selección parcial de los top-k.
+
+Backends disponibles:
+- "exact": recorrido completo de la matriz (VectorIndex).
+- "ivf":   índice invertido por clústeres (IVFIndex), aproximado y con
+           fallback exacto cuando no hay candidatos suficientes.
+- "int8" / "float16": recorrido de una copia cuantizada de la matriz
+           (QuantizedIndex) y reordenación exacta en float32 de los mejores candidatos.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .chunk_store import save_array
+
+EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_INFO_FILE = "index_info.json"
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_OFFSETS_FILE = "ivf_list_offsets.npy"
+IVF_IDS_FILE = "ivf_list_ids.npy"
+QUANTIZED_FILE = "embeddings_q.npy"
+QUANTIZED_SCALES_FILE = "embeddings_q_scales.npy"
+QUANTIZED_BACKENDS = ("int8", "float16")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Devuelve una copia float32 C-contigua con cada fila de norma 1."""
+    matrix = np.array(matrix, dtype=np.float32, order="C", copy=True)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Índices de los k mayores valores de `scores`, ordenados de mayor a menor.
+
+    Usa `argpartition` (O(n)) y sólo ordena los k candidatos seleccionados.
+    """
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(scores, n - k)[n - k:]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def adaptive_k(scores: np.ndarray, min_k: int, max_k: int,
+               relative_threshold: float, max_gap: float) -> int:
+    """Número de resultados a conservar según la distribución de scores.
+
+    Los scores deben venir ordenados de mayor a menor. Se recorren y se corta en
+    el primero que quede por debajo de `relative_threshold` veces el mejor score
+    o que caiga más de `max_gap` respecto al anterior. El resultado está en
+    [min_k, max_k].
+    """
+    n = min(scores.shape[0], max_k)
+    if n <= min_k:
+        return n
+    best = float(scores[0])
+    k = min_k
+    while k < n:
+        if scores[k] < best * relative_threshold or scores[k - 1] - scores[k] > max_gap:
+            break
+        k += 1
+    return k
+
+
+def top_k_indices_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Versión por filas de `top_k_indices` para una matriz de scores (m x n)."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(scores, n - k, axis=1)[:, n - k:]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape)
+    order = np.argsort(np.take_along_axis(scores, candidates, axis=1), axis=1)[:, ::-1]
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def save_embeddings(directory: Path, embeddings: np.ndarray, **extra_info) -> np.ndarray:
+    """Normaliza y guarda los embeddings listos para abrirse con mmap_mode='r'.
+
+    `extra_info` se añade a `index_info.json` (p. ej. el modelo de embeddings).
+    """
+    embeddings = normalize_rows(embeddings)
+    save_array(directory / EMBEDDINGS_FILE, embeddings)
+    info = {"normalizado": True, "num_chunks": embeddings.shape[0], "dimension": embeddings.shape[1]}
+    info.update(extra_info)
+    with open(directory / INDEX_INFO_FILE, "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    return embeddings
+
+
+class EmbeddingsWriter:
+    """Escribe la matriz de embeddings por lotes, sin tenerla entera en memoria.
+
+    Los lotes se añaden a un fichero float32 temporal y `close()` los vuelca,
+    normalizados y por bloques, al `embeddings.npy` definitivo.
+    """
+
+    def __init__(self, directory: Path, block_rows: int = 65536):
+        self.directory = directory
+        self.block_rows = block_rows
+        self.rows = 0
+        self.dimension = None
+        self._raw_path = directory / (EMBEDDINGS_FILE + ".raw")
+        self._raw = open(self._raw_path, "wb")
+
+    def append(self, vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape[0] == 0:
+            return
+        self.dimension = vectors.shape[1]
+        self._raw.write(vectors.tobytes())
+        self.rows += vectors.shape[0]
+
+    def truncate(self, rows: int) -> None:
+        """Descarta las filas a partir de `rows`."""
+        if rows >= self.rows:
+            return
+        self._raw.flush()
+        self._raw.truncate(rows * self.dimension * 4)
+        self._raw.seek(rows * self.dimension * 4)
+        self.rows = rows
+
+    def abort(self) -> None:
+        self._raw.close()
+        self._raw_path.unlink(missing_ok=True)
+
+    def close(self, **extra_info) -> None:
+        self._raw.close()
+        if self.rows == 0:
+            self._raw_path.unlink(missing_ok=True)
+            return
+        raw = np.memmap(self._raw_path, dtype=np.float32, mode="r", shape=(self.rows, self.dimension))
+        tmp_path = self.directory / (EMBEDDINGS_FILE + ".tmp")
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(self.rows, self.dimension))
+        for start in range(0, self.rows, self.block_rows):
+            out[start:start + self.block_rows] = normalize_rows(raw[start:start + self.block_rows])
+        out.flush()
+        del out, raw
+        os.replace(tmp_path, self.directory / EMBEDDINGS_FILE)
+        self._raw_path.unlink(missing_ok=True)
+
+        info = {"normalizado": True, "num_chunks": self.rows, "dimension": self.dimension}
+        info.update(extra_info)
+        with open(self.directory / INDEX_INFO_FILE, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+
+
+def load_embeddings(directory: Path):
+    """Abre los embeddings con mmap (sin copia) y devuelve (matriz, normalizado).
+
+    Los índices antiguos, sin `index_info.json`, se consideran sin normalizar.
+    """
+    embeddings = np.load(directory / EMBEDDINGS_FILE, mmap_mode="r")
+    return embeddings, load_index_info(directory).get("normalizado", False)
+
+
+class VectorIndex:
+    """Índice exacto por similitud del coseno sobre embeddings pre-normalizados.
+
+    Si la matriz ya viene normalizada en float32 (p. ej. abierta con mmap) se usa
+    tal cual, sin copiarla a memoria privada del proceso.
+    """
+
+    def __init__(self, embeddings: np.ndarray, normalized: bool = False):
+        if normalized and embeddings.dtype == np.float32 and embeddings.flags["C_CONTIGUOUS"]:
+            self.embeddings = embeddings
+        else:
+            self.embeddings = normalize_rows(embeddings)
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    def search(self, query_embedding: np.ndarray, k: int):
+        """Devuelve (índices, scores) de los k chunks más similares a la consulta."""
+        query = normalize_rows(query_embedding)[0]
+        scores = self.embeddings @ query
+        indices = top_k_indices(scores, k)
+        return indices, scores[indices]
+
+    def search_many(self, query_embeddings: np.ndarray, k: int, block_size: int = 256):
+        """Búsqueda de varias consultas a la vez: devuelve matrices (m x k) de índices y scores.
+
+        Cada bloque de consultas es un único producto matriz-matriz; los bloques
+        acotan la matriz de scores intermedia a block_size x n.
+        """
+        queries = normalize_rows(query_embeddings)
+        k = min(k, len(self))
+        indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for start in range(0, queries.shape[0], block_size):
+            block_scores = queries[start:start + block_size] @ self.embeddings.T
+            block_indices = top_k_indices_rows(block_scores, k)
+            indices[start:start + block_size] = block_indices
+            scores[start:start + block_size] = np.take_along_axis(block_scores, block_indices, axis=1)
+        return indices, scores
+
+
+class IVFIndex(VectorIndex):
+    """Índice IVF (inverted file) en NumPy puro.
+
+    Los embeddings se agrupan con k-means esférico en `nlist` clústeres. En cada
+    consulta sólo se puntúan los chunks de los `nprobe` clústeres más cercanos,
+    por lo que el coste crece con n / nlist * nprobe en lugar de con n.
+    Las listas se guardan en formato CSR: `list_ids[list_offsets[c]:list_offsets[c + 1]]`.
+    """
+
+    def __init__(self, embeddings: np.ndarray, centroids: np.ndarray,
+                 list_offsets: np.ndarray, list_ids: np.ndarray, nprobe: int = 8,
+                 normalized: bool = False):
+        super().__init__(embeddings, normalized=normalized)
+        self.centroids = normalize_rows(centroids)
+        self.list_offsets = np.ascontiguousarray(list_offsets, dtype=np.int64)
+        self.list_ids = np.ascontiguousarray(list_ids, dtype=np.int64)
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    def search(self, query_embedding: np.ndarray, k: int, nprobe: Optional[int] = None):
+        """Devuelve (índices, scores) aproximados de los k chunks más similares."""
+        query = normalize_rows(query_embedding)[0]
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        probed = top_k_indices(self.centroids @ query, nprobe)
+        candidates = np.concatenate([
+            self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probed
+        ])
+
+        # Fallback exacto si los clústeres sondeados no cubren k candidatos
+        if candidates.shape[0] < k:
+            return super().search(query_embedding, k)
+
+        scores = self.embeddings[candidates] @ query
+        best = top_k_indices(scores, k)
+        return candidates[best], scores[best]
+
+    def search_many(self, query_embeddings: np.ndarray, k: int, block_size: int = 256):
+        """Cada consulta sondea clústeres distintos, así que se resuelven una a una."""
+        queries = normalize_rows(query_embeddings)
+        results = [self.search(query[None, :], k) for query in queries]
+        if not results:
+            return np.empty((0, k), dtype=np.int64), np.empty((0, k), dtype=np.float32)
+        return np.stack([r[0] for r in results]), np.stack([r[1] for r in results])
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, nlist: Optional[int] = None, nprobe: int = 8,
+              iterations: int = 10, train_sample: int = 50000, seed: int = 42) -> "IVFIndex":
+        """Entrena los centroides con k-means esférico y asigna cada chunk a su lista."""
+        data = normalize_rows(embeddings)
+        n = data.shape[0]
+        if nlist is None:
+            nlist = int(np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+
+        rng = np.random.default_rng(seed)
+        sample = data if n <= train_sample else data[rng.choice(n, train_sample, replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            # Los clústeres vacíos conservan su centroide anterior
+            non_empty = counts > 0
+            centroids[non_empty] = normalize_rows(sums[non_empty])
+
+        assignments = _assign_in_batches(data, centroids)
+        list_ids = np.argsort(assignments, kind="stable")
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=nlist), out=list_offsets[1:])
+
+        return cls(data, centroids, list_offsets, list_ids, nprobe=nprobe, normalized=True)
+
+    def save(self, directory: Path) -> None:
+        """Persiste centroides y listas junto a `embeddings.npy`."""
+        save_array(directory / IVF_CENTROIDS_FILE, self.centroids)
+        save_array(directory / IVF_OFFSETS_FILE, self.list_offsets)
+        save_array(directory / IVF_IDS_FILE, self.list_ids)
+
+    @classmethod
+    def load(cls, directory: Path, embeddings: np.ndarray, nprobe: int = 8,
+             normalized: bool = False) -> "IVFIndex":
+        return cls(
+            embeddings,
+            np.load(directory / IVF_CENTROIDS_FILE),
+            np.load(directory / IVF_OFFSETS_FILE, mmap_mode="r"),
+            np.load(directory / IVF_IDS_FILE, mmap_mode="r"),
+            nprobe=nprobe,
+            normalized=normalized,
+        )
+
+
+def _assign_in_batches(data: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """Asigna cada fila a su centroide más cercano sin materializar la matriz n x nlist completa."""
+    assignments = np.empty(data.shape[0], dtype=np.int64)
+    for start in range(0, data.shape[0], batch_size):
+        block = data[start:start + batch_size]
+        assignments[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class QuantizedIndex(VectorIndex):
+    """Búsqueda en dos fases sobre una copia cuantizada de la matriz.
+
+    - int8: cuantización escalar simétrica con una escala por dimensión
+      (x ≈ q * escala). Ocupa 4 veces menos que float32.
+    - float16: mitad de memoria, sin escalas.
+
+    La primera fase puntúa todos los chunks con la matriz cuantizada (por bloques,
+    convirtiendo a float32 sólo el bloque en curso) y se queda con k * rescore
+    candidatos; la segunda los reordena con el producto exacto en float32. La
+    matriz float32 sigue mapeada en disco y sólo se leen las filas candidatas.
+    """
+
+    def __init__(self, embeddings: np.ndarray, quantized: np.ndarray, scales: Optional[np.ndarray] = None,
+                 rescore: int = 10, normalized: bool = False, block_rows: int = 16384):
+        super().__init__(embeddings, normalized=normalized)
+        self.quantized = quantized
+        self.scales = scales
+        self.rescore = rescore
+        self.block_rows = block_rows
+
+    def _approx_scores(self, queries: np.ndarray) -> np.ndarray:
+        """Scores aproximados (m x n) de consultas ya normalizadas."""
+        if self.scales is not None:
+            # q·(x * escala) = (q * escala)·x: las escalas se aplican a la consulta, no a la matriz
+            queries = queries * self.scales
+        scores = np.empty((queries.shape[0], self.quantized.shape[0]), dtype=np.float32)
+        for start in range(0, self.quantized.shape[0], self.block_rows):
+            block = self.quantized[start:start + self.block_rows].astype(np.float32)
+            scores[:, start:start + self.block_rows] = queries @ block.T
+        return scores
+
+    def _rescore(self, query: np.ndarray, candidates: np.ndarray, k: int):
+        # Leer las filas candidatas en orden favorece el acceso secuencial al mmap
+        candidates = np.sort(candidates)
+        exact = self.embeddings[candidates] @ query
+        best = top_k_indices(exact, k)
+        return candidates[best], exact[best]
+
+    def search(self, query_embedding: np.ndarray, k: int):
+        query = normalize_rows(query_embedding)
+        candidates = top_k_indices(self._approx_scores(query)[0], k * self.rescore)
+        return self._rescore(query[0], candidates, k)
+
+    def search_many(self, query_embeddings: np.ndarray, k: int, block_size: int = 256):
+        queries = normalize_rows(query_embeddings)
+        k = min(k, len(self))
+        indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for start in range(0, queries.shape[0], block_size):
+            block = queries[start:start + block_size]
+            candidates = top_k_indices_rows(self._approx_scores(block), k * self.rescore)
+            for row, (query, row_candidates) in enumerate(zip(block, candidates), start):
+                indices[row], scores[row] = self._rescore(query, row_candidates, k)
+        return indices, scores
+
+    @classmethod
+    def load(cls, directory: Path, embeddings: np.ndarray, rescore: int = 10,
+             normalized: bool = False) -> "QuantizedIndex":
+        quantized = np.load(directory / QUANTIZED_FILE, mmap_mode="r")
+        scales = None
+        if quantized.dtype == np.int8:
+            scales = np.load(directory / QUANTIZED_SCALES_FILE)
+        return cls(embeddings, quantized, scales, rescore=rescore, normalized=normalized)
+
+
+def _int8_scales(embeddings: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+    """Escala por dimensión para la cuantización int8 simétrica: max|x| / 127."""
+    max_abs = np.zeros(embeddings.shape[1], dtype=np.float32)
+    for start in range(0, embeddings.shape[0], block_rows):
+        np.maximum(max_abs, np.abs(embeddings[start:start + block_rows]).max(axis=0), out=max_abs)
+    return np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+
+
+def _quantize_block(block: np.ndarray, dtype: str, scales: Optional[np.ndarray]) -> np.ndarray:
+    block = np.asarray(block, dtype=np.float32)
+    if scales is not None:
+        block = np.clip(np.rint(block / scales), -127, 127)
+    return block.astype(dtype)
+
+
+def quantize_embeddings(embeddings: np.ndarray, dtype: str = "int8"):
+    """Cuantiza una matriz normalizada en memoria. Devuelve (matriz, escalas o None)."""
+    scales = _int8_scales(embeddings) if dtype == "int8" else None
+    return _quantize_block(embeddings, dtype, scales), scales
+
+
+def save_quantized_embeddings(directory: Path, embeddings: np.ndarray, dtype: str = "int8",
+                              block_rows: int = 65536) -> None:
+    """Guarda la copia cuantizada de una matriz normalizada, por bloques y de forma atómica."""
+    scales = _int8_scales(embeddings, block_rows) if dtype == "int8" else None
+    tmp_path = directory / (QUANTIZED_FILE + ".tmp")
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.dtype(dtype), shape=embeddings.shape)
+    for start in range(0, embeddings.shape[0], block_rows):
+        out[start:start + block_rows] = _quantize_block(embeddings[start:start + block_rows], dtype, scales)
+    out.flush()
+    del out
+    if scales is not None:
+        save_array(directory / QUANTIZED_SCALES_FILE, scales)
+    os.replace(tmp_path, directory / QUANTIZED_FILE)
+
+
+def create_search_index(directory: Path, backend: str = "exact", nprobe: int = 8,
+                        rescore: int = 10) -> VectorIndex:
+    """Abre los embeddings de `directory` y crea el índice de búsqueda configurado.
+
+    Si se pide "ivf", "int8" o "float16" pero no existen los ficheros del índice
+    (o no corresponden a la matriz actual), se usa la búsqueda exacta.
+    """
+    embeddings, normalized = load_embeddings(directory)
+    if backend in QUANTIZED_BACKENDS:
+        try:
+            index = QuantizedIndex.load(directory, embeddings, rescore=rescore, normalized=normalized)
+            if index.quantized.shape == index.embeddings.shape and index.quantized.dtype == np.dtype(backend):
+                return index
+            print(f"⚠️ La matriz cuantizada ({backend}) no corresponde a los embeddings actuales. "
+                  "Usando búsqueda exacta.")
+        except FileNotFoundError:
+            print(f"⚠️ No se encontró la matriz cuantizada ({backend}). Usando búsqueda exacta.")
+    elif backend == "ivf":
+        try:
+            index = IVFIndex.load(directory, embeddings, nprobe=nprobe, normalized=normalized)
+            if index.list_ids.shape[0] == len(index):
+                return index
+            print("⚠️ El índice IVF no corresponde a los embeddings actuales. Usando búsqueda exacta.")
+        except FileNotFoundError:
+            print("⚠️ No se encontró el índice IVF. Usando búsqueda exacta.")
+    elif backend != "exact":
+        print(f"⚠️ Backend de búsqueda desconocido '{backend}'. Usando búsqueda exacta.")
+    return VectorIndex(embeddings, normalized=normalized)
+
+
+def load_index_info(directory: Path) -> dict:
+    try:
+        with open(directory / INDEX_INFO_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
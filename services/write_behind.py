@@ -0,0 +1,235 @@
+"""
+Persistencia diferida (write-behind) para historiales y logs.
+
+Cada consulta escribía en disco dos veces dentro de la petición (el turno del
+historial y el registro de interacción). Aquí las escrituras se encolan en
+memoria y un hilo de fondo las agrupa: todos los registros pendientes de un
+mismo destino se escriben con una sola llamada, los ficheros tocados se
+sincronizan con fsync cada `fsync_interval` segundos y lo pendiente se vuelca
+al cerrar el proceso.
+
+Cada escritura es (destino, clave, registro). `destino(clave, registros)` recibe
+todos los registros pendientes de esa clave, en orden de llegada, y devuelve las
+rutas que ha modificado (para el fsync).
+
+Si un destino falla, sus registros se guardan y se reintentan (hasta
+`max_retries` veces, una por ciclo del hilo) por delante de los que lleguen
+después para la misma clave, de modo que no se reordenan.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from config.settings import (
+    WRITE_BEHIND, WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_QUEUE, WRITE_BEHIND_FSYNC_INTERVAL_S,
+    WRITE_BEHIND_MAX_RETRIES,
+)
+
+Destino = Callable[[object, List], Optional[Iterable[str]]]
+
+_STOP = object()
+
+
+class _Barrera:
+    """Marca en la cola: se señala cuando todo lo encolado antes está escrito."""
+
+    def __init__(self):
+        self.hecho = threading.Event()
+
+
+def _fsync(ruta: str) -> None:
+    try:
+        fd = os.open(ruta, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteBehindWriter:
+    """Cola de escrituras drenada por un hilo que las agrupa por destino y clave."""
+
+    def __init__(self, max_batch: int = 512, max_queue: int = 10000,
+                 fsync_interval: float = 1.0, max_retries: int = 5, name: str = "write-behind"):
+        self.max_batch = max_batch
+        self.fsync_interval = fsync_interval
+        self.max_retries = max_retries
+        # Cola acotada: si el disco no da abasto, los productores esperan en lugar de agotar la memoria
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pendientes_fsync = set()
+        # (destino, clave) -> (registros, intentos) de las escrituras que han fallado
+        self._fallidos: Dict[tuple, tuple] = {}
+        self._ultimo_fsync = time.monotonic()
+        self._cerrado = False
+        self._estado = threading.Lock()
+        self.lotes = 0
+        self.registros = 0
+        self.errores = 0
+        self.descartados = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, destino: Destino, clave, registro) -> None:
+        """Encola un registro; se escribirá en el próximo lote."""
+        with self._estado:
+            if not self._cerrado:
+                self._queue.put((destino, clave, registro))
+                return
+        # Ya no hay hilo que reintente: un fallo se registra y se descarta
+        self._escribir(destino, clave, [registro], intentos=self.max_retries)
+
+    def flush(self) -> None:
+        """Espera a que lo encolado hasta ahora esté escrito (sin fsync).
+
+        No espera a lo que otros productores encolen después.
+        """
+        if threading.current_thread() is self._thread:
+            return
+        barrera = _Barrera()
+        with self._estado:
+            if self._cerrado:
+                return
+            self._queue.put(barrera)
+        barrera.hecho.wait()
+
+    def close(self) -> None:
+        """Escribe lo pendiente, sincroniza con disco y detiene el hilo."""
+        with self._estado:
+            if self._cerrado:
+                return
+            self._cerrado = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "pendientes": self._queue.qsize(),
+            "lotes": self.lotes,
+            "registros": self.registros,
+            "errores": self.errores,
+            "reintentando": sum(len(registros) for registros, _ in self._fallidos.values()),
+            "descartados": self.descartados,
+            "registros_por_lote": round(self.registros / self.lotes, 2) if self.lotes else 0.0,
+        }
+
+    def _escribir(self, destino: Destino, clave, registros: List, intentos: int = 0) -> None:
+        try:
+            rutas = destino(clave, registros) or ()
+            self._pendientes_fsync.update(rutas)
+        except Exception as e:
+            self.errores += 1
+            nombre = getattr(destino, '__name__', destino)
+            if intentos < self.max_retries:
+                self._fallidos[(destino, clave)] = (registros, intentos + 1)
+                print(f"⚠️ Error en la escritura diferida ({nombre}, {clave}), se reintentará: {e}")
+            else:
+                self.descartados += len(registros)
+                print(f"❌ Error en la escritura diferida ({nombre}, {clave}), "
+                      f"se descartan {len(registros)} registros tras {intentos} reintentos: {e}")
+
+    def _reintentar(self, ultimo: bool = False) -> None:
+        """Reintenta las escrituras fallidas (con `ultimo`, las que vuelvan a fallar se descartan)."""
+        fallidos, self._fallidos = self._fallidos, {}
+        for (destino, clave), (registros, intentos) in fallidos.items():
+            self._escribir(destino, clave, registros, max(intentos, self.max_retries) if ultimo else intentos)
+
+    def _sincronizar(self, forzar: bool = False) -> None:
+        if not forzar and time.monotonic() - self._ultimo_fsync < self.fsync_interval:
+            return
+        for ruta in self._pendientes_fsync:
+            _fsync(ruta)
+        self._pendientes_fsync.clear()
+        self._ultimo_fsync = time.monotonic()
+
+    def _procesar(self, lote: List) -> None:
+        # Agrupa por (destino, clave) conservando el orden de llegada dentro de cada grupo
+        grupos: Dict[tuple, List] = {}
+        for destino, clave, registro in lote:
+            grupos.setdefault((destino, clave), []).append(registro)
+        for (destino, clave), registros in grupos.items():
+            # Lo que falló antes va por delante, para no alterar el orden
+            anteriores, intentos = self._fallidos.pop((destino, clave), ([], 0))
+            self._escribir(destino, clave, anteriores + registros, intentos)
+        self.lotes += 1
+        self.registros += len(lote)
+
+    def _run(self) -> None:
+        parar = False
+        while not parar:
+            try:
+                primero = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                self._reintentar()
+                self._sincronizar()
+                continue
+
+            lote = []
+            barrera = None
+            entrada = primero
+            while True:
+                if entrada is _STOP:
+                    parar = True
+                elif isinstance(entrada, _Barrera):
+                    barrera = entrada
+                else:
+                    lote.append(entrada)
+                if parar or barrera is not None or len(lote) >= self.max_batch:
+                    break
+                try:
+                    entrada = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if lote:
+                self._procesar(lote)
+            if parar:
+                self._reintentar(ultimo=True)
+            self._sincronizar(forzar=parar)
+            if barrera is not None:
+                barrera.hecho.set()
+            for _ in range(len(lote) + (barrera is not None) + parar):
+                self._queue.task_done()
+
+
+_writer: Optional[WriteBehindWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> Optional[WriteBehindWriter]:
+    """Escritor compartido del proceso (None si WRITE_BEHIND está desactivado)."""
+    global _writer
+    if not WRITE_BEHIND:
+        return None
+    with _writer_lock:
+        if _writer is None:
+            _writer = WriteBehindWriter(WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_QUEUE,
+                                        WRITE_BEHIND_FSYNC_INTERVAL_S, WRITE_BEHIND_MAX_RETRIES)
+            atexit.register(_writer.close)
+        return _writer
+
+
+def escribir(destino: Destino, clave, registro) -> None:
+    """Escribe `registro` con el escritor compartido, o en el acto si está desactivado."""
+    writer = get_writer()
+    if writer is None:
+        destino(clave, [registro])
+    else:
+        writer.put(destino, clave, registro)
+
+
+def vaciar() -> None:
+    """Espera a que las escrituras pendientes lleguen a los ficheros (lectura de lo recién escrito)."""
+    if _writer is not None:
+        _writer.flush()
+
+
+def cerrar() -> None:
+    """Vuelca y sincroniza lo pendiente. Se llama al apagar el servidor."""
+    if _writer is not None:
+        _writer.close()
@@ -22,30 +22,79 @@ document.addEventListener('DOMContentLoaded', () => {
         resultsSection.style.display = "none";
 
         try {
-            const response = await fetch('/api/query', {
+            const response = await fetch('/api/query/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ pregunta: question }),
             });
 
-            const data = await response.json();
-            answerText.textContent = data.respuesta;
+            if (!response.ok || !response.body) {
+                const data = await response.json().catch(() => ({}));
+                answerText.textContent = data.detail || "Error al procesar la consulta.";
+                sourcesList.innerHTML = "";
+                resultsSection.style.display = "block";
+                return;
+            }
 
+            answerText.textContent = "";
             sourcesList.innerHTML = "";
-            data.fuentes?.forEach(src => {
-                const li = document.createElement('li');
-                li.textContent = src.documento;
-                sourcesList.appendChild(li);
-            });
 
-            resultsSection.style.display = "block";
-            addToHistory(question, data.respuesta);
+            await readEventStream(response, (evento, data) => {
+                if (evento === "fuentes") {
+                    renderSources(data.fuentes);
+                    resultsSection.style.display = "block";
+                } else if (evento === "token") {
+                    answerText.textContent += data.texto;
+                } else if (evento === "fin") {
+                    answerText.textContent = data.respuesta;
+                    addToHistory(question, data.respuesta);
+                } else if (evento === "error") {
+                    answerText.textContent = data.error;
+                    resultsSection.style.display = "block";
+                }
+            });
 
         } finally {
             setLoading(false);
         }
     });
 
+    // Lee una respuesta text/event-stream y llama a onEvent(evento, datos) por cada mensaje
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let separator;
+            while ((separator = buffer.indexOf("\n\n")) !== -1) {
+                const message = buffer.slice(0, separator);
+                buffer = buffer.slice(separator + 2);
+
+                let evento = "message";
+                let data = "";
+                message.split("\n").forEach(line => {
+                    if (line.startsWith("event:")) evento = line.slice(6).trim();
+                    else if (line.startsWith("data:")) data += line.slice(5).trim();
+                });
+                if (data) onEvent(evento, JSON.parse(data));
+            }
+        }
+    }
+
+    function renderSources(fuentes) {
+        sourcesList.innerHTML = "";
+        fuentes?.forEach(src => {
+            const li = document.createElement('li');
+            li.textContent = src;
+            sourcesList.appendChild(li);
+        });
+    }
+
     function setLoading(isLoading) {
         submitBtn.disabled = isLoading;
         submitBtn.classList.toggle("loading", isLoading);
@@ -83,20 +132,47 @@ document.addEventListener('DOMContentLoaded', () => {
     const cerrarModal = document.getElementById("cerrarModal");
     const historialContent = document.getElementById("historialContent");
 
-    btnHistorial.onclick = async () => {
-        const res = await fetch("/api/historial?usuario_id=usuario_juan");
-        const data = await res.json();
+    const HISTORIAL_LIMIT = 20;
+    let historialCursor = null;
 
-        historialContent.innerHTML = "";
+    // El historial llega por páginas, de lo más reciente a lo más antiguo
+    const btnCargarAnteriores = document.createElement("button");
+    btnCargarAnteriores.className = "btn btn-secondary";
+    btnCargarAnteriores.textContent = "Cargar anteriores";
+    btnCargarAnteriores.style.display = "none";
+    historialContent.after(btnCargarAnteriores);
 
-        data.conversaciones?.forEach(item => {
-            historialContent.innerHTML += `
-                <div class="history-item">
-                    <p><strong>Usuario:</strong> ${item.usuario}</p>
-                    <p><strong>Asistente:</strong> ${item.agente}</p>
-                </div>
-            `;
-        });
+    async function cargarPaginaHistorial() {
+        const params = new URLSearchParams({ usuario_id: "usuario_juan", limit: HISTORIAL_LIMIT });
+        if (historialCursor !== null) params.set("before", historialCursor);
+
+        btnCargarAnteriores.disabled = true;
+        try {
+            const res = await fetch(`/api/historial?${params}`);
+            const data = await res.json();
+
+            data.conversaciones?.forEach(item => {
+                historialContent.insertAdjacentHTML("beforeend", `
+                    <div class="history-item">
+                        <p><strong>Usuario:</strong> ${item.usuario}</p>
+                        <p><strong>Asistente:</strong> ${item.agente}</p>
+                    </div>
+                `);
+            });
+
+            historialCursor = data.siguiente ?? null;
+            btnCargarAnteriores.style.display = historialCursor !== null ? "" : "none";
+        } finally {
+            btnCargarAnteriores.disabled = false;
+        }
+    }
+
+    btnCargarAnteriores.onclick = cargarPaginaHistorial;
+
+    btnHistorial.onclick = async () => {
+        historialContent.innerHTML = "";
+        historialCursor = null;
+        await cargarPaginaHistorial();
 
         modal.classList.remove("hidden");
         document.body.style.overflow = "hidden";